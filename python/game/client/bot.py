@@ -1,58 +1,184 @@
+from collections import Counter, deque
+from itertools import accumulate
 from pathlib import Path
-from random import choice
+from random import Random
 
-from game.client.models import MatchSummary, PlayerChoice
+from game.models.equilibrium import EQUILIBRIUM_CACHE, EquilibriumCache
 from game.models.game_config import GameConfig
-from game.models.shape import Shape
-from game.server.schemas import PlayerChoiceRequest
+from game.server.schemas import PlayerChoiceRequest, PlayerChoiceDelta
+
+
+COUNTER = 'counter'
+FREQUENCY = 'frequency'
+MARKOV = 'markov'
+EQUILIBRIUM = 'equilibrium'
+BOT_STRATEGIES = [COUNTER, FREQUENCY, MARKOV, EQUILIBRIUM]
+
+
+class ShapeCounts:
+    # How often each shape was seen, with the most common one kept up to date in O(1). Shapes are grouped by count, in
+    # the order they reached it
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        # Shapes seen as many times as the index, the first group stays empty
+        self.by_count: list[dict[int, None]] = [{}]
+        self.max_count = 0
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def add(self, shape_id: int):
+        count = self.counts[shape_id] + 1
+        self.counts[shape_id] = count
+        if count > 1:
+            del self.by_count[count - 1][shape_id]
+        if count == len(self.by_count):
+            self.by_count.append({})
+        self.by_count[count][shape_id] = None
+        self.max_count = max(self.max_count, count)
+
+    def remove(self, shape_id: int):
+        count = self.counts[shape_id] - 1
+        self.counts[shape_id] = count
+        del self.by_count[count + 1][shape_id]
+        if count:
+            self.by_count[count][shape_id] = None
+        if not self.by_count[self.max_count]:
+            self.max_count -= 1
+
+    def get_most_common(self) -> int | None:
+        # None if nothing was seen
+        return next(iter(self.by_count[self.max_count])) if self.max_count else None
 
 
 class GameBot:
 
-    def __init__(self, player_name: str, total_rounds: int):
+    HISTORY_SIZE = 256
+
+    def __init__(self, player_name: str, total_rounds: int, game_config: GameConfig | None = None,
+                 rng: Random | None = None, strategy: str = COUNTER, history_size: int = HISTORY_SIZE,
+                 equilibrium_cache: EquilibriumCache = EQUILIBRIUM_CACHE):
         self.player_name = player_name
-        self.history: list[MatchSummary] = []
-        self.past_winners = []
+        self.num_past_winners = 0
+        self.last_winner = None
         self.current_round = 0
         self.total_rounds = total_rounds
+        self.rng = rng if rng is not None else Random()
+        if strategy not in BOT_STRATEGIES:
+            raise ValueError(f'Unknown bot strategy {strategy}')
+        self.strategy = strategy
         # Get game config
-        config_path = Path.cwd().parent.joinpath('data').joinpath('gameconfig.json')
-        self.game_config = GameConfig.load(path=config_path)
+        if game_config is None:
+            config_path = Path.cwd().parent.joinpath('data').joinpath('gameconfig.json')
+            game_config = GameConfig.load(path=config_path)
+        self.game_config = game_config
+        self.options = [shape.name for shape in game_config.shapes]
+        self.option_ids = {option: i for i, option in enumerate(self.options)}
+        # First shape defeating each shape, None if nothing does
+        self.counters = [
+            next((i for i, row in enumerate(game_config.dominance) if row[shape_id]), None)
+            for shape_id in range(len(self.options))
+        ]
+        # Opponent model over the last history_size moves: (previous shape, shape) pairs,
+        # how often each shape was chosen and how often each shape followed each other one
+        self.history: deque[tuple[int | None, int]] = deque(maxlen=history_size)
+        self.frequencies = ShapeCounts(len(self.options))
+        self.transitions: dict[int, ShapeCounts] = {}
+        self.last_choices: dict[str, int] = {}
+        # Players of the match the bot was last asked about
+        self.match_players: set[str] = set()
+        self.last_opponent_choice: int | None = None
+        self.last_choice: int | None = None
+        # Equilibrium bots sample the mixed strategy no opponent can exploit, solved once per config
+        self.cumulative_weights = list(accumulate(equilibrium_cache.get(game_config).strategy)) \
+            if strategy == EQUILIBRIUM else None
 
-    def add_request_content(self, request: PlayerChoiceRequest):
-        self.past_winners = request.past_winners
+    def add_request_content(self, request: PlayerChoiceRequest | PlayerChoiceDelta):
+        # Delta requests only carry the winners since the last request
+        if isinstance(request, PlayerChoiceDelta):
+            new_winners = request.new_winners
+            self.num_past_winners += len(new_winners)
+        else:
+            new_winners = request.past_winners[self.num_past_winners:]
+            self.num_past_winners = len(request.past_winners)
+            self.total_rounds = request.total_rounds
+        # Eliminated players keep their choice until the round ends. A round starts with the choices of the match that
+        # ended the last one, which only its players have
+        new_round = request.current_round != self.current_round
+        if new_round:
+            players = {player_choice.player_name for player_choice in request.player_choices if player_choice.shape}
+        else:
+            players = self.match_players
         self.current_round = request.current_round
-        self.total_rounds = request.total_rounds
         # Find winner of last match
-        winner = None
-        if len(self.past_winners) != len(request.past_winners):
-            winner = request.past_winners[-1]
-        # Create last match summery
-        last_match_summary = MatchSummary(
-            winner=winner,
-            player_choices=[
-                PlayerChoice(
-                    player_name=player_choice.player_name,
-                    shape=player_choice.shape)
-                for player_choice in request.player_choices]
-        )
-        # Add to history
-        self.history.append(last_match_summary)
+        if new_winners:
+            self.last_winner = new_winners[-1]
+        # Observe opponent choices of last match
+        self.last_opponent_choice = None
+        for player_choice in request.player_choices:
+            if player_choice.player_name == self.player_name or player_choice.player_name not in players:
+                continue
+            shape_id = self.option_ids.get(player_choice.shape)
+            if shape_id is None:
+                continue
+            if self.last_opponent_choice is None:
+                self.last_opponent_choice = shape_id
+            self.observe(previous=self.last_choices.get(player_choice.player_name), shape_id=shape_id)
+            self.last_choices[player_choice.player_name] = shape_id
+        # Every player takes part in the first match of a round
+        self.match_players = {player_choice.player_name for player_choice in request.player_choices} if new_round \
+            else self.get_remaining_players(players=players, request=request)
+
+    def get_remaining_players(self, players: set[str], request: PlayerChoiceRequest | PlayerChoiceDelta) -> set[str]:
+        # Players of the last match who beat as many of its players as the best one stay in the round
+        shape_ids = {player_choice.player_name: self.option_ids.get(player_choice.shape)
+                     for player_choice in request.player_choices if player_choice.player_name in players}
+        shape_counts = Counter(shape_id for shape_id in shape_ids.values() if shape_id is not None)
+        dominance = self.game_config.dominance
+        wins = {shape_id: sum(count for other_id, count in shape_counts.items() if dominance[shape_id][other_id])
+                for shape_id in shape_counts}
+        best = max(wins.values(), default=0)
+        return {player_name for player_name, shape_id in shape_ids.items()
+                if shape_id is not None and wins[shape_id] == best}
+
+    def observe(self, previous: int | None, shape_id: int):
+        # Forget the oldest move before the ring buffer drops it
+        if len(self.history) == self.history.maxlen:
+            old_previous, old_shape_id = self.history[0]
+            self.frequencies.remove(old_shape_id)
+            if old_previous is not None:
+                self.transitions[old_previous].remove(old_shape_id)
+        self.history.append((previous, shape_id))
+        self.frequencies.add(shape_id)
+        if previous is not None:
+            if previous not in self.transitions:
+                self.transitions[previous] = ShapeCounts(len(self.options))
+            self.transitions[previous].add(shape_id)
+
+    def predict(self) -> int | None:
+        # Most likely next opponent shape according to the strategy
+        if self.strategy == COUNTER:
+            return self.last_opponent_choice
+        if self.strategy == FREQUENCY:
+            return self.frequencies.get_most_common()
+        if self.last_opponent_choice in self.transitions:
+            return self.transitions[self.last_opponent_choice].get_most_common()
+        return None
 
     def decide(self) -> str:
-        # Find result of last match
-        last_match = self.history[-1]
-        # Find choice of opponent
-        op_choice = None
-        for player_choice in last_match.player_choices:
-            if player_choice.player_name != self.player_name:
-                op_choice = player_choice.shape
-                break
+        if self.cumulative_weights is not None:
+            choice = self.rng.choices(self.options, cum_weights=self.cumulative_weights)[0]
+            self.last_choice = self.option_ids[choice]
+            return choice
+        prediction = self.predict()
+        # After a tie with the same shape, a bot like this one would counter it the same way and tie again forever
+        if prediction is not None and prediction == self.last_choice == self.last_opponent_choice:
+            prediction = None
         # If there is no information, chose random shape
-        if op_choice is None:
-            return choice(self.game_config.get_shapes()).name
-        op_shape = Shape(name=op_choice)
-        # Find shape that defeats opponent choice
-        for shape in self.game_config.get_shapes():
-            if op_shape in self.game_config.get_defeated_shapes(shape=shape):
-                return shape.name
+        if prediction is None or self.counters[prediction] is None:
+            choice = self.rng.choice(self.options)
+        else:
+            choice = self.options[self.counters[prediction]]
+        self.last_choice = self.option_ids[choice]
+        return choice
@@ -1,53 +1,97 @@
 from socket import socket, AF_INET, SOCK_STREAM
 
-from game.client.bot import GameBot
-from game.client.util import request_user_input, parse_incoming_message
-from game.server.schemas import JoinRequest, JoinResponse, PlayerChoiceRequest, PlayerChoiceResponse, EndOfGameMessage
-from game.utils.protocol import encode
+from game.client.bot import COUNTER, GameBot
+from game.client.util import request_another_game, request_user_input
+from game.server.schemas import JoinRequest, PlayerChoiceRequest, PlayerChoiceResponse, \
+    EndOfGameMessage, PlayerChoiceDelta, EndOfGameDelta, LeaveRequest, ServerBusyMessage
+from game.utils.codec import BINARY, JSON, JSON_CODEC, TYPED_JSON_CODEC, BinaryCodec, JsonCodec, decode_join_reply
+from game.utils.protocol import MessageReader, MessageWriter
 
 
 class GameClient:
     FORMAT = 'utf-8'
 
-    def __init__(self, player_name: str, is_bot: bool = False):
+    def __init__(self, player_name: str, is_bot: bool = False, encoding: str = JSON, delta: bool = False,
+                 strategy: str = COUNTER, typed: bool = False, games: int = 1):
         self.client = socket(AF_INET, SOCK_STREAM)
+        self.reader = MessageReader(self.client)
+        self.writer = MessageWriter(self.client)
         self.player_name = player_name
         self.is_bot = is_bot
         self.bot: GameBot | None = None
+        self.strategy = strategy
+        self.encoding = encoding
+        self.codec: JsonCodec | BinaryCodec = TYPED_JSON_CODEC if typed else JSON_CODEC
+        self.delta = delta
+        self.typed = typed
+        # Games to play on one connection, 0 asks after every game
+        self.games = games
+        self.options: list[str] = []
+
+    def get_join_request(self) -> JoinRequest:
+        return JoinRequest(
+            player_name=self.player_name, encoding=self.encoding, delta=self.delta, typed=self.typed, games=self.games)
 
     def request_join_game(self, server_host: str, server_port: int):
         # Connect to server
         self.client.connect((server_host, server_port))
         # Send join request
-        request = JoinRequest(player_name=self.player_name)
-        self.client.send(encode(request))
-        # Receive response
-        response_raw = self.client.recv(1024).decode(self.FORMAT)
-        response = JoinResponse.parse_raw(response_raw)
+        self.writer.send(self.get_join_request())
+        games_played = 0
+        while True:
+            if not self.join_game():
+                break
+            games_played += 1
+            if self.games == 0:
+                # Open sessions join the next game on the same connection or leave, bots keep playing
+                if not self.is_bot and not request_another_game():
+                    self.writer.send(self.codec.encode(LeaveRequest(player_name=self.player_name)))
+                    break
+                self.writer.send(self.codec.encode(self.get_join_request()))
+            elif games_played >= self.games:
+                break
+        self.client.close()
+
+    def join_game(self) -> bool:
+        # Receive response, in the negotiated encoding
+        if self.encoding == BINARY:
+            self.reader.sized = True
+            response = decode_join_reply(self.reader.read_join_reply(), BinaryCodec())
+        else:
+            response = decode_join_reply(self.reader.read_join_reply(), self.codec)
+        if isinstance(response, ServerBusyMessage):
+            print(f'[BUSY] {response}')
+            return False
+        if self.encoding == BINARY:
+            self.codec = BinaryCodec(players=response.players, shapes=response.options)
+        self.options = response.options or []
         # Create bot
         if self.is_bot:
-            self.bot = GameBot(player_name=self.player_name, total_rounds=response.total_rounds)
+            self.bot = GameBot(
+                player_name=self.player_name, total_rounds=response.total_rounds, strategy=self.strategy)
         # Play game for successful join response
         self.play_game()
+        return True
 
     def play_game(self):
         while True:
             # Receive message to decide shape or end game
-            message_raw = self.client.recv(1024).decode(self.FORMAT)
-            message = parse_incoming_message(message_raw)
+            message = self.codec.decode(self.reader.read_message())
             # Check for end of game
-            if isinstance(message, EndOfGameMessage):
+            if isinstance(message, (EndOfGameMessage, EndOfGameDelta)):
                 print(f'[END] {message}')
                 break
             # Check for player choice request
-            if isinstance(message, PlayerChoiceRequest):
+            if isinstance(message, (PlayerChoiceRequest, PlayerChoiceDelta)):
+                if isinstance(message, PlayerChoiceRequest):
+                    self.options = message.options
                 chosen_shape = None
                 if self.is_bot:
                     self.bot.add_request_content(request=message)
                     chosen_shape = self.bot.decide()
                 else:
                     print(f'[REQUEST] {message}')
-                    chosen_shape = request_user_input(request=message)
+                    chosen_shape = request_user_input(options=self.options)
                 # Send Response
                 response = PlayerChoiceResponse(
                     player_name=message.player_name,
@@ -55,4 +99,4 @@ class GameClient:
                     match_number=message.match_number,
                     shape=chosen_shape
                 )
-                self.client.send(encode(response))
+                self.writer.send(self.codec.encode(response))
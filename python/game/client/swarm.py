@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from random import Random
+from time import monotonic
+from uuid import UUID
+
+from game.models.game_config import GameConfig
+from game.server.async_server import raise_open_files_limit
+from game.server.schemas import JoinRequest, PlayerChoiceRequest, PlayerChoiceResponse, EndOfGameMessage, \
+    PlayerChoiceDelta, EndOfGameDelta, ServerBusyMessage
+from game.simulation.strategies import STRATEGIES
+from game.utils.codec import BINARY, JSON, BinaryCodec, JsonCodec, decode_join_reply
+from game.utils.protocol import MAX_FRAME_SIZE, encode, read_join_reply_async, read_message_async
+
+
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 10
+
+
+class ServerBusyError(ConnectionError):
+    pass
+
+
+@dataclass
+class PlayerResult:
+    player_name: str = ''
+    strategy: str = ''
+    # Games played to the end, in order
+    game_ids: list[UUID] = field(default_factory=list)
+    wins: int = 0
+    busy_replies: int = 0
+    join_latencies: list[float] = field(default_factory=list)
+    # Time between sending a choice and receiving the next request or the end of the game
+    match_latencies: list[float] = field(default_factory=list)
+    finished: bool = False
+    timed_out: bool = False
+    error: str | None = None
+
+
+class BotSwarm:
+    # Plays many bot players as coroutines of one event loop, sharing the game config and JSON codec
+
+    def __init__(self, host: str, port: int, game_config: GameConfig | None = None,
+                 strategies: list[str] | None = None, encoding: str = JSON, delta: bool = False, typed: bool = False,
+                 games: int = 1, read_timeout: float = DEFAULT_READ_TIMEOUT, seed: int | None = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        self.host = host
+        self.port = port
+        if game_config is None:
+            config_path = Path.cwd().parent.joinpath('data').joinpath('gameconfig.json')
+            game_config = GameConfig.load(path=config_path)
+        self.game_config = game_config
+        # Players take the strategies in turn
+        self.strategies = strategies or ['random']
+        for strategy in self.strategies:
+            if strategy not in STRATEGIES:
+                raise ValueError(f'Unknown strategy {strategy}')
+        self.encoding = encoding
+        self.delta = delta
+        self.typed = typed
+        # Games each player plays on its connection
+        if games < 1:
+            raise ValueError('Players must play at least one game.')
+        self.games = games
+        # Frames come from our own server, so they are not validated
+        self.json_codec = JsonCodec(typed=typed, trusted=True)
+        self.read_timeout = read_timeout
+        # Players told the server is busy try again this many times
+        self.max_retries = max_retries
+        self.rng = Random(seed)
+
+    def get_strategy(self, index: int) -> str:
+        return self.strategies[index % len(self.strategies)]
+
+    async def read_message(self, reader: asyncio.StreamReader, sized: bool) -> bytes:
+        return await asyncio.wait_for(read_message_async(reader, sized=sized), timeout=self.read_timeout)
+
+    async def play(self, result: PlayerResult):
+        while True:
+            busy = await self.play_session(result=result)
+            if busy is None:
+                result.finished = True
+                return
+            result.busy_replies += 1
+            if result.busy_replies > self.max_retries:
+                raise ServerBusyError(busy.reason)
+            # Jitter spreads out the players turned away together
+            await asyncio.sleep(busy.retry_after_ms / 1000 * (1 + self.rng.random()))
+
+    async def play_session(self, result: PlayerResult) -> ServerBusyMessage | None:
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_FRAME_SIZE)
+        try:
+            # Join and wait to be matched, players with several games are queued again by the server
+            writer.write(encode(JoinRequest(
+                player_name=result.player_name, encoding=self.encoding, delta=self.delta, typed=self.typed,
+                games=self.games)))
+            for _ in range(self.games):
+                busy = await self.play_game(reader=reader, writer=writer, result=result)
+                if busy is not None:
+                    return busy
+            return None
+        finally:
+            writer.close()
+
+    async def play_game(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        result: PlayerResult) -> ServerBusyMessage | None:
+        joined_at = monotonic()
+        sized = self.encoding == BINARY
+        response = decode_join_reply(
+            await asyncio.wait_for(read_join_reply_async(reader, sized=sized), timeout=self.read_timeout),
+            BinaryCodec() if sized else self.json_codec)
+        if isinstance(response, ServerBusyMessage):
+            return response
+        codec = BinaryCodec(players=response.players, shapes=response.options) if sized else self.json_codec
+        result.join_latencies.append(monotonic() - joined_at)
+        bot = STRATEGIES[result.strategy](
+            player_name=result.player_name, total_rounds=response.total_rounds, game_config=self.game_config,
+            rng=self.rng)
+        sent_at = None
+        while True:
+            message_raw = await self.read_message(reader, sized)
+            if sent_at is not None:
+                result.match_latencies.append(monotonic() - sent_at)
+            message = codec.decode(message_raw)
+            if isinstance(message, (EndOfGameMessage, EndOfGameDelta)):
+                result.game_ids.append(response.game_id)
+                if message.winner == result.player_name:
+                    result.wins += 1
+                return None
+            if isinstance(message, (PlayerChoiceRequest, PlayerChoiceDelta)):
+                bot.add_request_content(request=message)
+                writer.write(codec.encode(PlayerChoiceResponse(
+                    player_name=message.player_name, game_id=message.game_id,
+                    match_number=message.match_number, shape=bot.decide())))
+                sent_at = monotonic()
+
+    async def run_player(self, result: PlayerResult):
+        try:
+            await self.play(result=result)
+        except asyncio.TimeoutError:
+            result.timed_out = True
+        except (ConnectionError, OSError, ValueError) as e:
+            result.error = type(e).__name__
+
+    async def run(self, players: int, name_prefix: str = 'SwarmBot') -> list[PlayerResult]:
+        raise_open_files_limit()
+        results = [PlayerResult(player_name=f'{name_prefix}{i}', strategy=self.get_strategy(i))
+                   for i in range(players)]
+        await asyncio.gather(*[self.run_player(result=result) for result in results])
+        return results
+
+
+def get_swarm_summary(results: list[PlayerResult]) -> dict:
+    strategies = {}
+    for result in results:
+        stats = strategies.setdefault(result.strategy, {'players': 0, 'games': 0, 'wins': 0})
+        stats['players'] += 1
+        stats['games'] += len(result.game_ids)
+        stats['wins'] += result.wins
+    return {
+        'players': len(results),
+        'games_completed': len({game_id for result in results for game_id in result.game_ids}),
+        'players_finished': sum(1 for result in results if result.finished),
+        'errors': dict(Counter(result.error for result in results if result.error is not None)),
+        'timeouts': sum(1 for result in results if result.timed_out),
+        'busy_replies': sum(result.busy_replies for result in results),
+        'strategies': strategies
+    }
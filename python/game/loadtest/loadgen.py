@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+from time import monotonic
+
+from game.client.bot import EQUILIBRIUM
+from game.client.swarm import DEFAULT_READ_TIMEOUT, BotSwarm, PlayerResult
+from game.models.game_config import GameConfig
+from game.server.async_server import raise_open_files_limit
+from game.utils.codec import JSON
+
+
+DEFAULT_CONCURRENCY = 1000
+PERCENTILES = [0.5, 0.95, 0.99]
+PROCESS_SAMPLE_INTERVAL = 0.5
+
+
+@dataclass
+class ProcessStats:
+    max_rss: int = 0
+    max_threads: int = 0
+    samples: int = 0
+
+
+def get_summary(values: list[float]) -> dict:
+    # Nearest rank percentiles
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    summary = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+    for percentile in PERCENTILES:
+        summary[f'p{round(percentile * 100)}'] = values[min(len(values) - 1, int(percentile * len(values)))]
+    return summary
+
+
+def read_process_stats(pid: int) -> tuple[int, int] | None:
+    # Resident memory in bytes and thread count, only available on linux
+    try:
+        with open(f'/proc/{pid}/status') as status_file:
+            status = dict(line.split(':', 1) for line in status_file if ':' in line)
+        return int(status['VmRSS'].split()[0]) * 1024, int(status['Threads'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class LoadGenerator:
+    # Starts the players of a bot swarm at a given rate and concurrency, and reports how the server coped
+
+    def __init__(self, host: str, port: int, players: int, concurrency: int = DEFAULT_CONCURRENCY,
+                 arrival_rate: float = 0.0, game_config: GameConfig | None = None, strategy: str = EQUILIBRIUM,
+                 encoding: str = JSON, delta: bool = False, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 server_pid: int | None = None, typed: bool = False, games: int = 1):
+        self.host = host
+        self.port = port
+        self.players = players
+        self.concurrency = concurrency
+        # New players per second, 0 starts them as fast as the concurrency allows
+        self.arrival_rate = arrival_rate
+        self.swarm = BotSwarm(
+            host=host, port=port, game_config=game_config, strategies=[strategy], encoding=encoding, delta=delta,
+            typed=typed, games=games, read_timeout=read_timeout)
+        if concurrency < self.swarm.game_config.num_players:
+            raise ValueError(f'Concurrency must allow at least {self.swarm.game_config.num_players} players.')
+        self.strategy = strategy
+        self.encoding = encoding
+        self.delta = delta
+        self.typed = typed
+        self.games = games
+        self.server_pid = server_pid
+
+    async def run_player(self, player_name: str, semaphore: asyncio.Semaphore, results: list[PlayerResult]):
+        result = PlayerResult(player_name=player_name, strategy=self.strategy)
+        results.append(result)
+        try:
+            await self.swarm.run_player(result=result)
+        finally:
+            semaphore.release()
+
+    async def monitor_server(self, stats: ProcessStats):
+        while True:
+            process_stats = read_process_stats(self.server_pid)
+            if process_stats is not None:
+                rss, threads = process_stats
+                stats.max_rss = max(stats.max_rss, rss)
+                stats.max_threads = max(stats.max_threads, threads)
+                stats.samples += 1
+            await asyncio.sleep(PROCESS_SAMPLE_INTERVAL)
+
+    async def run(self) -> dict:
+        raise_open_files_limit()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results: list[PlayerResult] = []
+        tasks = []
+        server_stats = ProcessStats()
+        monitor = asyncio.create_task(self.monitor_server(server_stats)) if self.server_pid else None
+        started_at = monotonic()
+        for i in range(self.players):
+            await semaphore.acquire()
+            if self.arrival_rate:
+                # Keep a steady arrival rate even when players are admitted late
+                await asyncio.sleep(max(0.0, started_at + i / self.arrival_rate - monotonic()))
+            tasks.append(asyncio.create_task(
+                self.run_player(player_name=f'LoadBot{i}', semaphore=semaphore, results=results)))
+        await asyncio.gather(*tasks)
+        duration = monotonic() - started_at
+        if monitor is not None:
+            monitor.cancel()
+        return self.get_report(results=results, duration=duration, server_stats=server_stats)
+
+    def get_report(self, results: list[PlayerResult], duration: float, server_stats: ProcessStats) -> dict:
+        games = {game_id for result in results for game_id in result.game_ids}
+        return {
+            'settings': {
+                'players': self.players,
+                'concurrency': self.concurrency,
+                'arrival_rate': self.arrival_rate,
+                'strategy': self.strategy,
+                'encoding': self.encoding,
+                'delta': self.delta,
+                'typed': self.typed,
+                'games': self.games
+            },
+            'duration': duration,
+            'games_completed': len(games),
+            'games_per_second': len(games) / duration if duration else 0.0,
+            'players_finished': sum(1 for result in results if result.finished),
+            'errors': sum(1 for result in results if result.error is not None),
+            'timeouts': sum(1 for result in results if result.timed_out),
+            'busy_replies': sum(result.busy_replies for result in results),
+            'error_types': dict(Counter(result.error for result in results if result.error is not None)),
+            'join_to_match_latency': get_summary(
+                [latency for result in results for latency in result.join_latencies]),
+            'match_round_trip': get_summary(
+                [latency for result in results for latency in result.match_latencies]),
+            'server': {
+                'pid': self.server_pid,
+                'max_rss_bytes': server_stats.max_rss,
+                'max_threads': server_stats.max_threads
+            } if server_stats.samples else None
+        }
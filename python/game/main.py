@@ -1,10 +1,28 @@
 from socket import gethostbyname, gethostname
+import asyncio
 from argparse import ArgumentParser
+from json import dumps
 from pathlib import Path
 
+from game.client.bot import BOT_STRATEGIES, COUNTER, EQUILIBRIUM
 from game.client.client import GameClient
+from game.client.swarm import BotSwarm, get_swarm_summary
+from game.loadtest.loadgen import DEFAULT_CONCURRENCY, LoadGenerator
 from game.models.game_config import GameConfig
+from game.server.admission import DEFAULT_IDLE_TIMEOUT, DEFAULT_JOIN_TIMEOUT, DEFAULT_RETRY_AFTER, AdmissionLimits
+from game.server.async_server import AsyncGameServer
+from game.server.game import TIMEOUT_POLICIES, RANDOM, ServerGame
+from game.server.matchmaking import MATCHMAKING_POLICIES, SkillBucketPolicy
+from game.server.ratings import RatingService
+from game.server.replay import ReplayLog
+from game.server.results import ResultsStore
 from game.server.server import GameServer
+from game.server.spectators import DEFAULT_QUEUE_SIZE
+from game.server.tracing import DEFAULT_PROFILE_DIRECTORY
+from game.server.workers import MultiProcessGameServer
+from game.simulation.engine import DEFAULT_BATCH_SIZE, DEFAULT_MAX_MATCHES, run_simulation
+from game.simulation.strategies import STRATEGIES
+from game.utils.codec import ENCODINGS, JSON
 
 
 DEFAULT_SERVER_PORT = 40_000
@@ -19,29 +37,133 @@ if __name__ == '__main__':
     # Server configuration options
     parser.add_argument('--server', action='store_true')
     parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--async', dest='use_async', action='store_true')
+    parser.add_argument('--matchmaking', choices=MATCHMAKING_POLICIES.keys(), default='fifo')
+    parser.add_argument('--snapshot-interval', type=int, default=ServerGame.DEFAULT_SNAPSHOT_INTERVAL)
+    parser.add_argument('--match-timeout', type=float, default=ServerGame.DEFAULT_MATCH_TIMEOUT,
+                        help='seconds players have to answer a choice request, 0 waits for every answer')
+    parser.add_argument('--timeout-policy', choices=TIMEOUT_POLICIES, default=RANDOM)
+    parser.add_argument('--log-sample', type=int, default=ServerGame.DEFAULT_LOG_SAMPLE_INTERVAL)
+    parser.add_argument('--metrics-port', type=int)
+    parser.add_argument('--results-db')
+    parser.add_argument('--ratings')
+    parser.add_argument('--replay-log', metavar='DIRECTORY')
+    parser.add_argument('--profile-every', type=int, metavar='GAMES')
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIRECTORY)
+    parser.add_argument('--spectator-port', type=int)
+    parser.add_argument('--spectator-queue', type=int, default=DEFAULT_QUEUE_SIZE, metavar='EVENTS')
+    parser.add_argument('--max-connections', type=int)
+    parser.add_argument('--max-waiting', type=int)
+    parser.add_argument('--max-games', type=int)
+    parser.add_argument('--join-timeout', type=float, default=DEFAULT_JOIN_TIMEOUT)
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_RETRY_AFTER)
     parser.add_argument('--port')
     parser.add_argument('--host')
+    parser.add_argument('--config')
     # Client configuration options
     parser.add_argument('--client', action='store_true')  # Default
     parser.add_argument('--bot', action='store_true')
     parser.add_argument('--name', '-n')
+    parser.add_argument('--encoding', choices=ENCODINGS, default=JSON)
+    parser.add_argument('--delta', action='store_true')
+    parser.add_argument('--typed', action='store_true')
+    parser.add_argument('--strategy', choices=BOT_STRATEGIES)
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--swarm', type=int, metavar='PLAYERS')
+    # Simulation options
+    parser.add_argument('--simulate', type=int, metavar='GAMES')
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES.keys(), default=['bot', 'random'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--max-matches', type=int, default=DEFAULT_MAX_MATCHES)
+    # Load test options
+    parser.add_argument('--loadtest', type=int, metavar='PLAYERS')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--arrival-rate', type=float, default=0.0)
+    parser.add_argument('--server-pid', type=int)
+    parser.add_argument('--output')
     # Parse arguments
     args = parser.parse_args()
+    # Without ratings every player has the same skill, so skill matchmaking would be first come, first served
+    if args.matchmaking == 'skill' and not args.ratings:
+        parser.error('--matchmaking skill requires --ratings')
     port = int(args.port or DEFAULT_SERVER_PORT)
     host = args.host or DEFAULT_SERVER_HOST
-    # Program must be run as either client or server
-    if args.server == args.client:
-        raise ValueError('Program must be executed as either client or server')
+    config_path = Path(args.config) if args.config else Path.cwd().parent.joinpath('data').joinpath('gameconfig.json')
+    # Program must be run as either client, server, bot swarm, simulation or load test
+    modes = [args.server, args.client, args.swarm is not None, args.simulate is not None, args.loadtest is not None]
+    if modes.count(True) != 1:
+        raise ValueError('Program must be executed as either client, server, bot swarm, simulation or load test')
     # Server
     if args.server:
         # Read game configurations
-        config_path = Path.cwd().parent.joinpath('data').joinpath('gameconfig.json')
         config = GameConfig.load(path=config_path)
-        # Create server
-        server = GameServer(host=host, port=port, game_config=config, verbose=args.verbose)
+        # Store finished games if a database is given
+        results_store = ResultsStore(path=args.results_db) if args.results_db else None
+        # Record every finished game as a binary event stream if a directory is given
+        replay_log = ReplayLog(directory=args.replay_log, game_config=config) if args.replay_log else None
+        # Rate players and match them by rating if a snapshot file is given
+        ratings = RatingService(path=args.ratings) if args.ratings else None
+        if args.matchmaking == 'skill':
+            matchmaking_policy = SkillBucketPolicy(skill=ratings.get_rating)
+        else:
+            matchmaking_policy = MATCHMAKING_POLICIES[args.matchmaking]()
+        # Timeouts of 0 are disabled
+        limits = AdmissionLimits(
+            max_connections=args.max_connections, max_waiting=args.max_waiting, max_games=args.max_games,
+            join_timeout=args.join_timeout or None, idle_timeout=args.idle_timeout or None,
+            retry_after=args.retry_after)
+        # Create server, games are played by worker processes if workers are given
+        server_options = {}
+        if args.workers:
+            if args.use_async:
+                raise ValueError('Worker processes are only supported by the threaded server')
+            server_class = MultiProcessGameServer
+            server_options['workers'] = args.workers
+        else:
+            server_class = AsyncGameServer if args.use_async else GameServer
+        server = server_class(
+            host=host, port=port, game_config=config, verbose=args.verbose,
+            matchmaking_policy=matchmaking_policy, snapshot_interval=args.snapshot_interval,
+            match_timeout=args.match_timeout or None, timeout_policy=args.timeout_policy,
+            log_sample_interval=args.log_sample, metrics_port=args.metrics_port, results_store=results_store,
+            ratings=ratings, limits=limits, replay_log=replay_log, profile_interval=args.profile_every,
+            profile_directory=args.profile_dir, spectator_port=args.spectator_port,
+            spectator_queue_size=args.spectator_queue,
+            **server_options)
         # Run server
         server.start()
     # Client
     if args.client:
-        client = GameClient(player_name=args.name or DEFAULT_CLIENT_NAME, is_bot=args.bot)
+        client = GameClient(
+            player_name=args.name or DEFAULT_CLIENT_NAME, is_bot=args.bot, encoding=args.encoding, delta=args.delta,
+            strategy=args.strategy or COUNTER, typed=args.typed, games=args.games)
         client.request_join_game(server_host=host, server_port=port)
+    # Bot swarm, players take the given strategies in turn
+    if args.swarm is not None:
+        swarm = BotSwarm(
+            host=host, port=port, game_config=GameConfig.load(path=config_path), strategies=args.strategies,
+            encoding=args.encoding, delta=args.delta, typed=args.typed, games=args.games, seed=args.seed)
+        print(dumps(get_swarm_summary(asyncio.run(swarm.run(players=args.swarm))), indent=2))
+    # Simulation
+    if args.simulate is not None:
+        config = GameConfig.load(path=config_path)
+        # Print running totals as JSON lines
+        for stats in run_simulation(
+                game_config=config, strategies=tuple(args.strategies), num_games=args.simulate, seed=args.seed,
+                workers=args.workers, batch_size=args.batch_size, max_matches=args.max_matches):
+            print(dumps(stats.to_dict()), flush=True)
+    # Load test
+    if args.loadtest is not None:
+        # Random choices by default, so bots never tie forever
+        generator = LoadGenerator(
+            host=host, port=port, players=args.loadtest, concurrency=args.concurrency, arrival_rate=args.arrival_rate,
+            game_config=GameConfig.load(path=config_path), strategy=args.strategy or EQUILIBRIUM,
+            encoding=args.encoding, delta=args.delta, server_pid=args.server_pid, typed=args.typed, games=args.games)
+        report = dumps(asyncio.run(generator.run()), indent=2)
+        if args.output:
+            Path(args.output).write_text(report + '\n')
+        else:
+            print(report)
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+from itertools import islice
+
+from game.models.game_config import GameConfig
+from game.models.player import Player
+
+
+class WinnerLog:
+    # Append-only list of winner ids. Versions share one list and only copy it
+    # when appending to a version that is no longer the newest
+    __slots__ = ('items', 'size')
+
+    def __init__(self, items: list[int] | None = None, size: int | None = None):
+        self.items = items if items is not None else []
+        self.size = len(self.items) if size is None else size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return islice(self.items, self.size)
+
+    def __getitem__(self, index: int) -> int:
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('Winner index out of range')
+        return self.items[index]
+
+    def __eq__(self, other):
+        return isinstance(other, WinnerLog) and self.size == other.size and \
+            all(a == b for a, b in zip(self, other))
+
+    def appended(self, item: int) -> WinnerLog:
+        if self.size == len(self.items):
+            self.items.append(item)
+            return WinnerLog(items=self.items, size=self.size + 1)
+        return WinnerLog(items=self.items[:self.size] + [item])
+
+    def count(self, num_items: int) -> list[int]:
+        counts = [0] * num_items
+        for item in self:
+            counts[item] += 1
+        return counts
+
+
+class CompactState:
+    # Game state using player and shape ids: choices is a tuple of shape ids (None when
+    # not chosen) and active is a bitmask of player ids. Players are shared by every state of a game
+    __slots__ = ('config', 'players', 'player_ids', 'choices', 'active', 'current_round', 'winners')
+
+    def __init__(self, config: GameConfig, players: tuple[Player, ...], player_ids: dict[Player, int],
+                 choices: tuple[int | None, ...], active: int, current_round: int, winners: WinnerLog):
+        self.config = config
+        self.players = players
+        self.player_ids = player_ids
+        self.choices = choices
+        self.active = active
+        self.current_round = current_round
+        self.winners = winners
+
+    @staticmethod
+    def create(config: GameConfig, players: tuple[Player, ...], current_round: int = 0,
+               winners: WinnerLog | None = None) -> CompactState:
+        return CompactState(
+            config=config,
+            players=players,
+            player_ids={player: i for i, player in enumerate(players)},
+            choices=(None,) * len(players),
+            active=(1 << len(players)) - 1,
+            current_round=current_round,
+            winners=winners if winners is not None else WinnerLog()
+        )
+
+    def replaced(self, choices: tuple[int | None, ...] | None = None, active: int | None = None,
+                 current_round: int | None = None) -> CompactState:
+        return CompactState(
+            config=self.config,
+            players=self.players,
+            player_ids=self.player_ids,
+            choices=self.choices if choices is None else choices,
+            active=self.active if active is None else active,
+            current_round=self.current_round if current_round is None else current_round,
+            winners=self.winners
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, CompactState) and self.config == other.config and \
+            self.players == other.players and self.choices == other.choices and self.active == other.active and \
+            self.current_round == other.current_round and self.winners == other.winners
+
+    def is_active(self, player_id: int) -> bool:
+        return bool(self.active >> player_id & 1)
+
+    def get_active_ids(self) -> list[int]:
+        return [i for i in range(len(self.players)) if self.active >> i & 1]
+
+    def with_choices(self, choices: dict[int, int | None]) -> CompactState:
+        # Applies every choice with a single copy of the choices tuple
+        new_choices = list(self.choices)
+        for player_id, shape_id in choices.items():
+            new_choices[player_id] = shape_id
+        return self.replaced(choices=tuple(new_choices))
+
+    def without_players(self, player_ids) -> CompactState:
+        active = self.active
+        for player_id in player_ids:
+            active &= ~(1 << player_id)
+        return self.replaced(active=active)
+
+    def is_ready_for_confrontation(self) -> bool:
+        return all(self.choices[i] is not None for i in self.get_active_ids())
+
+    def get_win_counts(self) -> dict[int, int]:
+        # Players choosing the same shape never defeat each other, so counting choices
+        # per shape gives every player's wins in O(N + S^2)
+        active_ids = self.get_active_ids()
+        choices = self.choices
+        shape_counts = [0] * len(self.config.shapes)
+        for i in active_ids:
+            shape_counts[choices[i]] += 1
+        shape_wins = self.config.count_wins(shape_counts)
+        # A player never confronts itself
+        dominance = self.config.dominance
+        return {i: shape_wins[choices[i]] - dominance[choices[i]][choices[i]] for i in active_ids}
+
+    def is_end_of_round(self) -> bool:
+        # Exactly one bit set
+        return self.active != 0 and self.active & (self.active - 1) == 0
+
+    def get_round_winner(self) -> int | None:
+        return self.active.bit_length() - 1 if self.is_end_of_round() else None
+
+    def is_finished(self) -> bool:
+        return len(self.winners) == self.config.rounds
+
+    def get_winner(self) -> int | None:
+        if not self.is_finished():
+            return None
+        win_counts = self.winners.count(len(self.players))
+        return max(range(len(self.players)), key=win_counts.__getitem__)
+
+    def get_next_state(self) -> CompactState:
+        if self.is_end_of_round():
+            return self.get_next_round()
+        if not self.is_ready_for_confrontation():
+            return self
+        win_counts = self.get_win_counts()
+        max_count = max(win_counts.values())
+        return self.without_players([i for i, count in win_counts.items() if count != max_count])
+
+    def played_match(self, choices: dict[int, int | None]) -> CompactState:
+        # Players without a choice forfeit, the next round starts with the choices of the match that ended the last one
+        state = self.with_choices(choices).without_players(
+            [player_id for player_id, shape_id in choices.items() if shape_id is None])
+        if not state.is_end_of_round():
+            state = state.get_next_state()
+        if state.is_end_of_round():
+            state = state.get_next_round().with_choices(choices)
+        return state
+
+    def get_next_round(self) -> CompactState:
+        if not self.is_end_of_round():
+            return self
+        return CompactState(
+            config=self.config,
+            players=self.players,
+            player_ids=self.player_ids,
+            choices=(None,) * len(self.players),
+            active=(1 << len(self.players)) - 1,
+            current_round=self.current_round + 1,
+            winners=self.winners.appended(self.get_round_winner())
+        )
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from hashlib import sha256
+from json import dumps, load
+from pathlib import Path
+from threading import Lock
+
+from game.models.game_config import GameConfig
+
+try:
+    import numpy
+except ImportError:  # Solver falls back to pure python
+    numpy = None
+
+
+DEFAULT_CACHE_DIRECTORY = Path.home().joinpath('.cache').joinpath('rpsls')
+DEFAULT_TOLERANCE = 1e-4
+DEFAULT_MAX_ITERATIONS = 100_000
+# Exploitability is checked every this many iterations
+CHECK_INTERVAL = 50
+
+
+@dataclass(frozen=True)
+class Equilibrium:
+    # Probability of playing each shape, in the order of the config's shapes
+    strategy: tuple[float, ...]
+    # Most a best response gains against the strategy, 0 for an exact equilibrium
+    exploitability: float
+    iterations: int
+
+
+def get_payoff_matrix(game_config: GameConfig) -> list[list[int]]:
+    # Two player payoffs: 1 if the row shape defeats the column shape, -1 if it is defeated
+    dominance = game_config.dominance
+    size = len(dominance)
+    return [[dominance[i][j] - dominance[j][i] for j in range(size)] for i in range(size)]
+
+
+def get_config_hash(game_config: GameConfig) -> str:
+    # Only the shapes and who defeats whom change the equilibrium
+    shapes = [shape.name for shape in game_config.shapes]
+    return sha256(dumps([shapes, game_config.dominance], separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def solve_equilibrium(payoffs: list[list[int]], tolerance: float = DEFAULT_TOLERANCE,
+                      max_iterations: int = DEFAULT_MAX_ITERATIONS) -> Equilibrium:
+    # Predictive regret matching+ in self-play: the next strategy also counts the last regrets once more, which takes
+    # hundreds instead of tens of thousands of iterations on large configs. The game is symmetric and zero-sum,
+    # so the average of the strategies played converges to an equilibrium whose value is 0
+    if numpy is not None:
+        return solve_equilibrium_numpy(payoffs=payoffs, tolerance=tolerance, max_iterations=max_iterations)
+    size = len(payoffs)
+    strategy = [1.0 / size] * size
+    regrets = [0.0] * size
+    average = [0.0] * size
+    weights = 0
+    exploitability = float('inf')
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        values = [sum(payoff * probability for payoff, probability in zip(row, strategy) if probability)
+                  for row in payoffs]
+        value = sum(v * probability for v, probability in zip(values, strategy))
+        instant = [v - value for v in values]
+        regrets = [max(regret + gain, 0.0) for regret, gain in zip(regrets, instant)]
+        # Later iterations weigh more, which converges faster than a plain average
+        average = [total + iteration * probability for total, probability in zip(average, strategy)]
+        weights += iteration
+        predicted = [max(regret + gain, 0.0) for regret, gain in zip(regrets, instant)]
+        total_regret = sum(predicted)
+        strategy = [regret / total_regret for regret in predicted] if total_regret > 0 else [1.0 / size] * size
+        if iteration % CHECK_INTERVAL == 0 or iteration == max_iterations:
+            mean = [total / weights for total in average]
+            exploitability = max(sum(payoff * probability for payoff, probability in zip(row, mean))
+                                 for row in payoffs)
+            if exploitability <= tolerance:
+                break
+    return Equilibrium(strategy=tuple(total / weights for total in average), exploitability=exploitability,
+                       iterations=iteration)
+
+
+def solve_equilibrium_numpy(payoffs: list[list[int]], tolerance: float, max_iterations: int) -> Equilibrium:
+    matrix = numpy.array(payoffs, dtype=numpy.float64)
+    size = len(matrix)
+    strategy = numpy.full(size, 1.0 / size)
+    regrets = numpy.zeros(size)
+    average = numpy.zeros(size)
+    weights = 0
+    exploitability = float('inf')
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        values = matrix @ strategy
+        instant = values - values @ strategy
+        numpy.maximum(regrets + instant, 0.0, out=regrets)
+        average += iteration * strategy
+        weights += iteration
+        predicted = numpy.maximum(regrets + instant, 0.0)
+        total_regret = predicted.sum()
+        strategy = predicted / total_regret if total_regret > 0 else numpy.full(size, 1.0 / size)
+        if iteration % CHECK_INTERVAL == 0 or iteration == max_iterations:
+            exploitability = float((matrix @ (average / weights)).max())
+            if exploitability <= tolerance:
+                break
+    return Equilibrium(strategy=tuple((average / weights).tolist()), exploitability=exploitability,
+                       iterations=iteration)
+
+
+class EquilibriumCache:
+    # Solved equilibria kept in memory and in directory/<config hash>.json, so configs are only solved once
+
+    def __init__(self, directory: str | Path = DEFAULT_CACHE_DIRECTORY, tolerance: float = DEFAULT_TOLERANCE):
+        self.directory = Path(directory)
+        self.tolerance = tolerance
+        self.lock = Lock()
+        # Keyed by the shape names and dominance matrix, which hash much faster than they serialize
+        self.equilibria: dict[tuple, Equilibrium] = {}
+
+    def get(self, game_config: GameConfig) -> Equilibrium:
+        key = (tuple(shape.name for shape in game_config.shapes), game_config.dominance)
+        equilibrium = self.equilibria.get(key)
+        if equilibrium is not None:
+            return equilibrium
+        with self.lock:
+            equilibrium = self.equilibria.get(key)
+            if equilibrium is None:
+                path = self.directory.joinpath(f'{get_config_hash(game_config)}.json')
+                equilibrium = self.load(path=path, shapes=key[0])
+                if equilibrium is None:
+                    equilibrium = solve_equilibrium(payoffs=get_payoff_matrix(game_config), tolerance=self.tolerance)
+                    logging.info(f'[EQUILIBRIUM] Solved {len(key[0])} shapes in {equilibrium.iterations} '
+                                 f'iterations, exploitability={equilibrium.exploitability:.6f}.')
+                    self.save(path=path, shapes=key[0], equilibrium=equilibrium)
+                self.equilibria[key] = equilibrium
+        return equilibrium
+
+    def load(self, path: Path, shapes: tuple[str, ...]) -> Equilibrium | None:
+        try:
+            with open(path) as cache_file:
+                cached = load(cache_file)
+            # Equilibria solved with a looser tolerance are solved again
+            if tuple(cached['shapes']) != shapes or cached['tolerance'] > self.tolerance:
+                return None
+            return Equilibrium(strategy=tuple(cached['strategy']), exploitability=cached['exploitability'],
+                               iterations=cached['iterations'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f'[EQUILIBRIUM] Ignoring unreadable cache file {path}: {e!r}')
+            return None
+
+    def save(self, path: Path, shapes: tuple[str, ...], equilibrium: Equilibrium):
+        # Written next to the cache file and renamed, so a crash never leaves a partial file
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'w') as cache_file:
+                cache_file.write(dumps({
+                    'shapes': shapes,
+                    'tolerance': self.tolerance,
+                    'strategy': equilibrium.strategy,
+                    'exploitability': equilibrium.exploitability,
+                    'iterations': equilibrium.iterations
+                }))
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f'[EQUILIBRIUM] Could not write cache file {path}: {e!r}')
+
+
+# Shared by every bot of the process
+EQUILIBRIUM_CACHE = EquilibriumCache()
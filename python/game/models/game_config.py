@@ -1,21 +1,69 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from json import load
 from pathlib import Path
 
 from game.models.player import Player
 from game.models.shape import Shape
 
+try:
+    import numpy
+except ImportError:  # Confrontation falls back to pure python
+    numpy = None
+
 
 @dataclass(frozen=True)
 class GameConfig:
     num_players: int
     rules: dict[Shape, set[Shape]]
     rounds: int
+    # Integer ids of shapes, the dominance matrix (row shape defeats column shape)
+    # and, for each id, a bitmask of the shape ids it defeats
+    shapes: tuple[Shape, ...] = field(init=False, repr=False, compare=False)
+    shape_ids: dict[Shape, int] = field(init=False, repr=False, compare=False)
+    dominance: tuple[tuple[int, ...], ...] = field(init=False, repr=False, compare=False)
+    defeats: tuple[int, ...] = field(init=False, repr=False, compare=False)
+    dominance_array: object = field(init=False, repr=False, compare=False)
+
+    # Below this many shapes a python loop beats the numpy call overhead
+    NUMPY_MIN_SHAPES = 32
+
+    def __post_init__(self):
+        shapes = tuple(self.rules.keys())
+        shape_ids = {shape: i for i, shape in enumerate(shapes)}
+        dominance = tuple(
+            tuple(1 if other_shape in self.rules[shape] else 0 for other_shape in shapes) for shape in shapes)
+        defeats = tuple(sum(1 << i for i, defeated in enumerate(row) if defeated) for row in dominance)
+        object.__setattr__(self, 'shapes', shapes)
+        object.__setattr__(self, 'shape_ids', shape_ids)
+        object.__setattr__(self, 'dominance', dominance)
+        object.__setattr__(self, 'defeats', defeats)
+        object.__setattr__(
+            self, 'dominance_array',
+            numpy.array(dominance, dtype=numpy.int64) if numpy and len(shapes) >= self.NUMPY_MIN_SHAPES else None)
+
+    def check_rules(self):
+        for shape, defeated_shapes in self.rules.items():
+            unknown_shapes = [other_shape.name for other_shape in defeated_shapes if other_shape not in self.shape_ids]
+            if unknown_shapes:
+                raise ValueError(f'Invalid rules: {shape.name} defeats unknown shapes {", ".join(unknown_shapes)}.')
+        for i, shape in enumerate(self.shapes):
+            if self.dominance[i][i]:
+                raise ValueError(f'Invalid rules: {shape.name} defeats itself.')
+            for j in range(i):
+                if self.dominance[i][j] and self.dominance[j][i]:
+                    raise ValueError(f'Invalid rules: {shape.name} and {self.shapes[j].name} defeat each other.')
+
+    def count_wins(self, shape_counts: list[int]) -> list[int]:
+        # Wins of a player choosing each shape against players choosing shapes with the given counts
+        if self.dominance_array is not None:
+            return (self.dominance_array @ numpy.array(shape_counts, dtype=numpy.int64)).tolist()
+        present = [(j, count) for j, count in enumerate(shape_counts) if count]
+        return [sum(row[j] * count for j, count in present) for row in self.dominance]
 
     def get_shapes(self) -> list[Shape]:
-        return list(self.rules.keys())
+        return list(self.shapes)
 
     def get_defeated_shapes(self, shape: Shape):
         return self.rules[shape]
@@ -31,7 +79,9 @@ class GameConfig:
                 for shape_name, other_shapes in config_dict['rules'].items()
             }
             rounds = config_dict['rounds']
-        return cls(num_players=num_players, rules=rules, rounds=rounds)
+        game_config = cls(num_players=num_players, rules=rules, rounds=rounds)
+        game_config.check_rules()
+        return game_config
 
 
 if __name__ == '__main__':
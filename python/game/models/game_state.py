@@ -1,25 +1,72 @@
 from __future__ import annotations
 
-from copy import deepcopy
-from dataclasses import dataclass
 from typing import Any
 
+from game.models.compact_state import CompactState, WinnerLog
 from game.models.game_config import GameConfig
 from game.models.player import Player
 from game.models.player_state import PlayerState
 from game.models.shape import Shape
 
 
-@dataclass(frozen=True)
 class GameState:
-    config: GameConfig
-    player_states: dict[Player, PlayerState]
-    current_round: int
-    past_winners: list[Player]
+    # Immutable facade over a CompactState. Transitions only copy a tuple of choice ids
+    # and an integer mask, player objects and past winners are shared between states
+    __slots__ = ('core', 'cached_player_states')
+
+    def __init__(self, config: GameConfig, player_states: dict[Player, PlayerState], current_round: int,
+                 past_winners: list[Player]):
+        players = tuple(player_states.keys())
+        player_ids = {player: i for i, player in enumerate(players)}
+        core = CompactState(
+            config=config,
+            players=players,
+            player_ids=player_ids,
+            choices=tuple(config.shape_ids[player_state.choice] if player_state.choice is not None else None
+                          for player_state in player_states.values()),
+            active=sum(1 << i for i, player_state in enumerate(player_states.values()) if player_state.active),
+            current_round=current_round,
+            winners=WinnerLog(items=[player_ids[player] for player in past_winners])
+        )
+        self.core = core
+        self.cached_player_states = None
+
+    @staticmethod
+    def wrap(core: CompactState) -> GameState:
+        state = GameState.__new__(GameState)
+        state.core = core
+        state.cached_player_states = None
+        return state
+
+    @property
+    def config(self) -> GameConfig:
+        return self.core.config
+
+    @property
+    def current_round(self) -> int:
+        return self.core.current_round
+
+    @property
+    def past_winners(self) -> list[Player]:
+        players = self.core.players
+        return [players[player_id] for player_id in self.core.winners]
+
+    @property
+    def player_states(self) -> dict[Player, PlayerState]:
+        # Built on first access only
+        if self.cached_player_states is None:
+            core = self.core
+            shapes = core.config.shapes
+            self.cached_player_states = {
+                player: PlayerState(choice=shapes[shape_id] if shape_id is not None else None,
+                                    active=core.is_active(i))
+                for i, (player, shape_id) in enumerate(zip(core.players, core.choices))
+            }
+        return self.cached_player_states
 
     @property
     def players(self) -> list[Player]:
-        return list(self.player_states.keys())
+        return list(self.core.players)
 
     @staticmethod
     def get_initial_state(
@@ -36,132 +83,97 @@ class GameState:
             player_names = []
             for i in range(config.num_players):
                 player_names.append(f'Player{i+1}')
-        # Create player states
-        player_states = {Player(name=player_name): PlayerState() for player_name in player_names}
-        # Create initial game state
-        return GameState(
-            config=config,
-            player_states=player_states,
-            current_round=current_round,
-            past_winners=[] if not past_winners else past_winners
-        )
+        # Repeated names are a single player
+        players = tuple(dict.fromkeys(Player(name=player_name) for player_name in player_names))
+        winners = WinnerLog(items=[players.index(player) for player in past_winners or []])
+        return GameState.wrap(CompactState.create(
+            config=config, players=players, current_round=current_round, winners=winners))
 
     def get_player_choice(self, player) -> Shape | None:
-        player_state = self.player_states[player]
-        return player_state.choice
+        shape_id = self.core.choices[self.core.player_ids[player]]
+        return self.core.config.shapes[shape_id] if shape_id is not None else None
 
     def get_active_players(self):
-        return [player for player, player_state in self.player_states.items() if player_state.active]
+        players = self.core.players
+        return [players[i] for i in self.core.get_active_ids()]
 
     def get_unready_players(self):
-        return [player for player in self.get_active_players() if self.player_states[player].choice is None]
+        players = self.core.players
+        return [players[i] for i in self.core.get_active_ids() if self.core.choices[i] is None]
 
     def confront_two_players(self, player1, player2) -> int:
-        player1_choice = self.get_player_choice(player=player1)
-        player2_choice = self.get_player_choice(player=player2)
-        player1_defeated_shapes = self.config.get_defeated_shapes(shape=player1_choice)
-        return 1 if player2_choice in player1_defeated_shapes else 0
+        player1_choice = self.core.choices[self.core.player_ids[player1]]
+        player2_choice = self.core.choices[self.core.player_ids[player2]]
+        return self.core.config.defeats[player1_choice] >> player2_choice & 1
 
     def confront_all_players(self) -> dict[Player, int]:
-        # Find players that are still active
-        active_players = self.get_active_players()
-        # Initialize map to count victories
-        player_win_counts = {player: 0 for player in active_players}
-        # Iterate all active players
-        for player in active_players:
-            for confronted_player in active_players:
-                if confronted_player != player:
-                    player_win_counts[player] += self.confront_two_players(player1=player, player2=confronted_player)
-        return player_win_counts
+        players = self.core.players
+        return {players[i]: count for i, count in self.core.get_win_counts().items()}
 
     def is_ready_for_confrontation(self):
-        for player in self.get_active_players():
-            if self.get_player_choice(player=player) is None:
-                return False
-        return True
+        return self.core.is_ready_for_confrontation()
 
     def is_finished(self) -> bool:
-        return len(self.past_winners) == self.config.rounds
+        return self.core.is_finished()
 
     def get_winner(self) -> Player | None:
-        if not self.is_finished():
-            return None
-        # Get player with most wins
-        win_count = {player: 0 for player in self.players}
-        for player in self.past_winners:
-            win_count[player] += 1
-        winner = max(win_count, key=win_count.get)
-        return winner
+        winner = self.core.get_winner()
+        return self.core.players[winner] if winner is not None else None
 
     def is_end_of_round(self) -> bool:
-        return len(self.get_active_players()) == 1
+        return self.core.is_end_of_round()
 
     def get_round_winner(self) -> Player | None:
-        if not self.is_end_of_round():
-            return None
-        return self.get_active_players()[0]
+        winner = self.core.get_round_winner()
+        return self.core.players[winner] if winner is not None else None
 
     def get_next_state(self) -> GameState:
-        if self.is_end_of_round():
-            return self.get_next_round()
-        if not self.is_ready_for_confrontation():
-            return self
-        # Get win count for each player
-        player_win_counts = self.confront_all_players()
-        # Get the highest win count
-        max_count_player = max(player_win_counts, key=player_win_counts.get)
-        # Find losers
-        losers = [player for player in self.get_active_players()
-                  if player_win_counts[player] != player_win_counts[max_count_player]]
-        # Deactivate losers
-        new_state = self.deactivated_players(players=losers)
-        # Return next state
-        return new_state
+        core = self.core.get_next_state()
+        return self if core is self.core else GameState.wrap(core)
 
     def get_next_round(self) -> GameState:
-        if not self.is_end_of_round():
-            return self
-        winners = deepcopy(self.past_winners)
-        winners.append(self.get_active_players()[0])
-        return GameState.get_initial_state(
-            config=self.config,
-            player_names=[player.name for player in self.players],
-            current_round=self.current_round + 1,
-            past_winners=winners
-        )
+        core = self.core.get_next_round()
+        return self if core is self.core else GameState.wrap(core)
 
     def updated_player_choice(self, player: Player, choice: Shape):
-        player_state = self.player_states[player].updated_choice(new_choice=choice)
-        player_states = deepcopy(self.player_states)
-        player_states[player] = player_state
-        return self.updated('player_states', player_states)
+        return self.updated_player_choices(player_choices={player: choice})
 
     def updated_player_choices(self, player_choices: dict[Player, Shape]) -> GameState:
-        state = self
-        for player, choice in player_choices.items():
-            state = state.updated_player_choice(player, choice)
-        return state
+        player_ids = self.core.player_ids
+        shape_ids = self.core.config.shape_ids
+        return GameState.wrap(self.core.with_choices({
+            player_ids[player]: shape_ids[choice] if choice is not None else None
+            for player, choice in player_choices.items()
+        }))
 
     def reset_choices(self) -> GameState:
-        return self.updated_player_choices(player_choices={player: None for player in self.players})
+        return GameState.wrap(self.core.replaced(choices=(None,) * len(self.core.players)))
 
     def deactivated_player(self, player: Player) -> GameState:
-        player_state = self.player_states[player].deactivated()
-        player_states = deepcopy(self.player_states)
-        player_states[player] = player_state
-        return self.updated('player_states', player_states)
+        return self.deactivated_players(players=[player])
 
     def deactivated_players(self, players) -> GameState:
-        state = self
-        for player in players:
-            state = state.deactivated_player(player=player)
-        return state
+        player_ids = self.core.player_ids
+        return GameState.wrap(self.core.without_players([player_ids[player] for player in players]))
 
     def incremented_round(self) -> GameState:
-        return self.updated('current_round', self.current_round + 1)
+        return GameState.wrap(self.core.replaced(current_round=self.core.current_round + 1))
 
     def updated(self, attr: str, val: Any) -> GameState:
-        return GameState(**{**self.__dict__, attr: val})
+        return GameState(**{
+            'config': self.config,
+            'player_states': self.player_states,
+            'current_round': self.current_round,
+            'past_winners': self.past_winners,
+            attr: val
+        })
+
+    def __eq__(self, other):
+        return isinstance(other, GameState) and self.core == other.core
+
+    def __repr__(self) -> str:
+        return f'GameState(config={self.config!r}, player_states={self.player_states!r}, ' \
+               f'current_round={self.current_round!r}, past_winners={self.past_winners!r})'
 
     def __str__(self) -> str:
         desc = f'Rounds: {self.current_round + 1}/{self.config.rounds}\n'
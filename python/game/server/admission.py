@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+
+from game.server.schemas import ServerBusyMessage
+from game.utils.codec import JSON_CODEC
+
+
+DEFAULT_JOIN_TIMEOUT = 10.0
+DEFAULT_IDLE_TIMEOUT = 120.0
+DEFAULT_RETRY_AFTER = 1.0
+
+# Reasons given in busy messages
+CONNECTIONS = 'connections'
+WAITING = 'waiting'
+BUSY_REASONS = [CONNECTIONS, WAITING]
+
+
+@dataclass(frozen=True)
+class AdmissionLimits:
+    # None disables a limit. Players over a cap are told to retry later, while games in progress keep their pace
+    max_connections: int | None = None
+    max_waiting: int | None = None
+    # Groups are only formed while fewer games are in progress, other players keep waiting
+    max_games: int | None = None
+    # Seconds to send a join request, and to send or receive anything afterwards
+    join_timeout: float | None = DEFAULT_JOIN_TIMEOUT
+    idle_timeout: float | None = DEFAULT_IDLE_TIMEOUT
+    retry_after: float = DEFAULT_RETRY_AFTER
+
+    def is_connection_allowed(self, connections: int) -> bool:
+        # Connections counted before the new one
+        return self.max_connections is None or connections < self.max_connections
+
+    def is_join_allowed(self, waiting: int) -> bool:
+        return self.max_waiting is None or waiting < self.max_waiting
+
+    def get_busy_message(self, reason: str) -> bytes:
+        return JSON_CODEC.encode(ServerBusyMessage(reason=reason, retry_after_ms=round(self.retry_after * 1000)))
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import signal
+from asyncio import StreamReader, StreamWriter, Task
+from dataclasses import replace
+from time import monotonic, perf_counter
+
+from game.models.game_config import GameConfig
+from game.models.player import Player
+from game.models.shape import Shape
+from game.server.admission import CONNECTIONS, WAITING, AdmissionLimits
+from game.server.game import RANDOM, MatchRecorder, ServerGame
+from game.server.metrics import MetricsServer, ServerMetrics
+from game.server.matchmaking import AsyncMatchmaker, MatchmakingPolicy
+from game.server.ratings import RatingService
+from game.server.replay import ReplayLog
+from game.server.results import ResultsStore
+from game.server.models import AsyncPlayerConnection
+from game.server.schemas import JoinRequest, LeaveRequest, PlayerChoiceResponse
+from game.server.spectators import DEFAULT_QUEUE_SIZE, END, START, SpectatorHub, SpectatorServer
+from game.server.tracing import DECODE, DEFAULT_PROFILE_DIRECTORY, DEFAULT_PROFILE_INTERVAL, SEND, WAIT, \
+    GameProfiler
+from game.utils.codec import BINARY, JSON_CODEC, BinaryCodec
+from game.utils.logging import configure_logger
+from game.utils.protocol import MAX_FRAME_SIZE, read_message_async
+
+try:
+    import resource
+except ImportError:  # Not available on windows
+    resource = None
+
+
+def raise_open_files_limit():
+    # Every connection holds a file descriptor, so allow as many as the system permits
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class AsyncGameServer:
+
+    BACKLOG = 4096
+    STATS_LOG_INTERVAL = 100
+
+    def __init__(self, host: str, port: int, game_config: GameConfig, verbose: bool = True,
+                 matchmaking_policy: MatchmakingPolicy | None = None,
+                 snapshot_interval: int = ServerGame.DEFAULT_SNAPSHOT_INTERVAL,
+                 match_timeout: float | None = ServerGame.DEFAULT_MATCH_TIMEOUT, timeout_policy: str = RANDOM,
+                 log_sample_interval: int = ServerGame.DEFAULT_LOG_SAMPLE_INTERVAL, metrics_port: int | None = None,
+                 results_store: ResultsStore | None = None, ratings: RatingService | None = None,
+                 limits: AdmissionLimits = AdmissionLimits(), replay_log: ReplayLog | None = None,
+                 profile_interval: int | None = None, profile_directory: str = DEFAULT_PROFILE_DIRECTORY,
+                 spectator_port: int | None = None, spectator_queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.host = host
+        self.port = port
+        self.game_config = game_config
+        self.snapshot_interval = snapshot_interval
+        self.match_timeout = match_timeout
+        self.timeout_policy = timeout_policy
+        self.log_sample_interval = log_sample_interval
+        self.match_recorder = MatchRecorder()
+        self.matchmaking_policy = matchmaking_policy
+        self.matchmaker: AsyncMatchmaker | None = None
+        # Open connections are counted by a thread-safe gauge
+        self.metrics = ServerMetrics()
+        self.metrics_port = metrics_port
+        self.results_store = results_store
+        self.ratings = ratings
+        self.replay_log = replay_log
+        # Every profile_interval-th game is profiled if given, profiling can also be switched on with SIGUSR1
+        self.profiler = GameProfiler(
+            directory=profile_directory, interval=profile_interval or DEFAULT_PROFILE_INTERVAL,
+            enabled=profile_interval is not None)
+        # Games are streamed to spectators if a port is given
+        self.spectators = SpectatorHub(queue_size=spectator_queue_size, metrics=self.metrics) \
+            if spectator_port is not None else None
+        self.spectator_port = spectator_port
+        self.limits = limits
+        self.game_slots: asyncio.Semaphore | None = None
+        # Keep references to running tasks so they are not garbage collected
+        self.tasks: set[Task] = set()
+        # Configure logger
+        configure_logger(filename='server.log', level=logging.INFO if verbose else logging.WARNING)
+        # Log start of server
+        logging.info(f'[STARTING] Async server is starting at {host, port}.')
+
+    def start(self):
+        raise_open_files_limit()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            # Game threads keep running, so shutdown hooks are called here
+            if self.ratings is not None:
+                self.ratings.close()
+            exit(0)
+
+    async def serve(self):
+        # Matchmaker must be created inside the running event loop
+        self.matchmaker = AsyncMatchmaker(policy=self.matchmaking_policy, group_size=self.game_config.num_players)
+        if self.limits.max_games is not None:
+            self.game_slots = asyncio.Semaphore(self.limits.max_games)
+        server = await asyncio.start_server(
+            self.handle_player, self.host, self.port, backlog=self.BACKLOG, limit=MAX_FRAME_SIZE)
+        logging.info(f'[LISTENING] Server is listening on {self.host}.')
+        self.start_metrics()
+        self.start_spectators()
+        if hasattr(signal, 'SIGUSR1'):
+            # Handled by the event loop rather than interrupting it while it holds the profiler's lock
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.profiler.toggle)
+        if self.ratings is not None:
+            self.ratings.start()
+        # Handle server queue of waiting players
+        self.spawn(self.handle_queue())
+        async with server:
+            await server.serve_forever()
+
+    def start_metrics(self):
+        # Scrapes run on the metrics thread and only read the queue length
+        self.metrics.queue_depth.function = lambda: len(self.matchmaker.policy)
+        if self.metrics_port is not None:
+            MetricsServer(metrics=self.metrics, host=self.host, port=self.metrics_port).start()
+
+    def start_spectators(self):
+        if self.spectators is not None:
+            self.metrics.spectators.function = lambda: len(self.spectators)
+            SpectatorServer(hub=self.spectators, host=self.host, port=self.spectator_port).start()
+
+    def spawn(self, coroutine) -> Task:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def handle_player(self, reader: StreamReader, writer: StreamWriter):
+        self.metrics.connections.inc()
+        connection_allowed = self.limits.is_connection_allowed(self.metrics.active_connections.value)
+        self.metrics.active_connections.inc()
+        addr = writer.get_extra_info('peername')
+        # Read player request
+        try:
+            request = JSON_CODEC.decode(
+                await asyncio.wait_for(read_message_async(reader), timeout=self.limits.join_timeout), JoinRequest)
+        except (ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            logging.warning(f'[REJECTED_CONNECTION] {addr}: {e!r}')
+            if isinstance(e, asyncio.TimeoutError):
+                self.metrics.reaped_connections.inc()
+            else:
+                self.metrics.rejected_connections.inc()
+            await self.close_connection(writer)
+            return
+        # Join requests are cheap to read here, so players over a cap are answered after theirs
+        if not connection_allowed or not self.limits.is_join_allowed(len(self.matchmaker.policy)):
+            reason = WAITING if connection_allowed else CONNECTIONS
+            self.metrics.busy_replies[reason].inc()
+            writer.write(self.limits.get_busy_message(reason))
+            await self.close_connection(writer)
+            return
+        # Log connection
+        logging.info(f'[NEW_CONNECTION] {request.player_name} {addr} connected.')
+        logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
+        # Add player to queue
+        player_conn = AsyncPlayerConnection(
+            player_name=request.player_name, reader=reader, writer=writer, addr=addr, encoding=request.encoding,
+            delta=request.delta, typed=request.typed, games=request.games)
+        self.matchmaker.put(player_conn)
+
+    async def handle_session(self, player_conn: AsyncPlayerConnection):
+        # Open sessions join another game or leave, on the connection and buffers of their previous game
+        codec = BinaryCodec() if player_conn.encoding == BINARY else JSON_CODEC
+        try:
+            request = codec.decode(await asyncio.wait_for(
+                read_message_async(player_conn.reader, sized=codec.SIZED), timeout=self.limits.idle_timeout))
+            if not isinstance(request, (JoinRequest, LeaveRequest)):
+                raise ValueError(f'Expected JoinRequest or LeaveRequest, got {type(request).__name__}')
+        except (ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            logging.warning(f'[SESSION] {player_conn}: {e!r}')
+            if isinstance(e, asyncio.TimeoutError):
+                self.metrics.reaped_connections.inc()
+            await self.close_connection(player_conn.writer)
+            return
+        if isinstance(request, LeaveRequest):
+            logging.info(f'[SESSION] {player_conn} left.')
+            await self.close_connection(player_conn.writer)
+            return
+        self.rejoin(replace(player_conn, games=request.games))
+
+    def continue_session(self, player_conn: AsyncPlayerConnection):
+        if player_conn.games == 0:
+            self.spawn(self.handle_session(player_conn))
+        else:
+            self.rejoin(replace(player_conn, games=player_conn.games - 1))
+
+    def rejoin(self, player_conn: AsyncPlayerConnection):
+        # Sessions joining another game are turned away like new players when too many are waiting
+        if not self.limits.is_join_allowed(len(self.matchmaker.policy)):
+            self.metrics.busy_replies[WAITING].inc()
+            player_conn.writer.write(self.limits.get_busy_message(WAITING))
+            self.spawn(self.close_connection(player_conn.writer))
+            return
+        self.matchmaker.put(player_conn)
+
+    async def handle_queue(self):
+        while True:
+            # Groups are not formed while the most games are in progress, so running games keep their pace
+            if self.game_slots is not None:
+                await self.game_slots.acquire()
+            player_conns = await self.matchmaker.get_group()
+            self.spawn(self.handle_game(player_conns))
+            if self.matchmaker.recorder.groups_matched % self.STATS_LOG_INTERVAL == 0:
+                logging.info(f'[MATCHMAKING] {self.matchmaker.get_stats()}')
+                logging.info(f'[MATCHES] {self.match_recorder.get_stats()}')
+
+    async def drain(self, writer: StreamWriter):
+        # Players that stop reading are disconnected instead of holding their game
+        try:
+            await asyncio.wait_for(writer.drain(), timeout=self.limits.idle_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError('Player stopped reading')
+
+    async def close_connection(self, writer: StreamWriter):
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), timeout=self.limits.idle_timeout)
+        except ConnectionError:
+            pass
+        except asyncio.TimeoutError:
+            # Unsent bytes of players that stopped reading are dropped
+            writer.transport.abort()
+        self.metrics.active_connections.dec()
+
+    async def read_player_choice_response(
+            self, player_conn: AsyncPlayerConnection, request, game: ServerGame, previous_read: Task | None
+    ) -> PlayerChoiceResponse:
+        # Reads are never cancelled, so wait for any read left over from a timed out match
+        if previous_read is not None:
+            await previous_read
+        sized = game.get_codec(player_conn=player_conn).SIZED
+        while True:
+            message = await read_message_async(player_conn.reader, sized=sized)
+            response = game.decode(player_conn=player_conn, payload=message, schema_class=PlayerChoiceResponse)
+            # Skip late responses to matches that already timed out
+            if response.match_number >= request.match_number:
+                return response
+
+    async def request_player_choices(self, game: ServerGame, reads: dict[Player, Task]) -> dict[Player, Shape | None]:
+        started = monotonic()
+        # Send every request before waiting for any response
+        requests, payloads = game.get_player_choice_requests()
+        with game.phase_times.span(SEND):
+            for player, payload in payloads.items():
+                game.players_map[player].writer.write(payload)
+            await asyncio.gather(*[self.drain(game.players_map[player].writer) for player in requests])
+        # Collect responses concurrently until the deadline
+        waited, decode_time = perf_counter(), game.phase_times.totals[DECODE]
+        for player, request in requests.items():
+            reads[player] = asyncio.create_task(self.read_player_choice_response(
+                player_conn=game.players_map[player], request=request, game=game, previous_read=reads.get(player)))
+        await asyncio.wait([reads[player] for player in requests], timeout=self.match_timeout)
+        player_choices = {}
+        for player in requests:
+            read = reads[player]
+            if read.done():
+                del reads[player]
+                player_choices[player] = game.parse_player_choice_response(
+                    request=requests[player], response=read.result())
+        # Waiting is everything but the decoding in between
+        game.phase_times.add(WAIT, perf_counter() - waited - (game.phase_times.totals[DECODE] - decode_time))
+        # Replace missing or invalid choices
+        unanswered = [player for player in requests if player not in player_choices]
+        for player in requests:
+            if player_choices.get(player) is None:
+                player_choices[player] = game.get_fallback_choice(player=player)
+        game.record_match(latency=monotonic() - started, requested=list(requests), unanswered=unanswered)
+        return player_choices
+
+    async def handle_game(self, player_conns: list[AsyncPlayerConnection]):
+        game = ServerGame(
+            game_config=self.game_config, player_conns=player_conns,
+            snapshot_interval=self.snapshot_interval, timeout_policy=self.timeout_policy,
+            match_recorder=self.match_recorder, log_sample_interval=self.log_sample_interval, metrics=self.metrics,
+            record_matches=self.results_store is not None or self.replay_log is not None, spectators=self.spectators)
+        self.metrics.game_started()
+        # Profiles cover everything the event loop runs during the game
+        profile = self.profiler.start()
+        completed = False
+        sessions = []
+        game.log_event('start', players=[str(player_conn) for player_conn in game.player_conns])
+        game.publish_event(START, players=[player_conn.player_name for player_conn in game.player_conns],
+                           total_rounds=self.game_config.rounds)
+        # Pending reads of players that did not answer in time
+        reads: dict[Player, Task] = {}
+        try:
+            # Send responses
+            for player, payload in game.get_join_responses().items():
+                game.players_map[player].writer.write(payload)
+            # Run game
+            while not game.is_finished():
+                # Request clients to each choose a shape
+                player_choices = await self.request_player_choices(game=game, reads=reads)
+                game.play_match(player_choices=player_choices)
+            # Inform winner. Phase times are formatted now, since encoding the end of game messages adds to them
+            game.log_event('end', winner=game.get_winner().player_name, stats=game.recorder.get_stats(),
+                           phases=str(game.phase_times))
+            completed = True
+            record = game.get_record() if game.match_records is not None else None
+            if self.results_store is not None:
+                self.results_store.put(record)
+            if self.replay_log is not None:
+                self.replay_log.put(record)
+            for player_conn in game.player_conns:
+                end_request = game.get_end_of_game_message(player_conn=player_conn)
+                player_conn.writer.write(game.encode(player_conn=player_conn, message=end_request))
+                await self.drain(player_conn.writer)
+            sessions = game.get_sessions()
+        except (ConnectionError, ValueError) as e:
+            game.log_event('aborted', level=logging.WARNING, error=repr(e))
+        finally:
+            if profile is not None:
+                self.profiler.stop(profile=profile, game_id=game.game_id)
+            self.metrics.record_phases(game.phase_times)
+            # Aborted games have no winner
+            game.publish_event(END, winner=game.get_winner().player_name if completed else None)
+            for read in reads.values():
+                read.cancel()
+            await self.end_game(player_conns=game.player_conns,
+                                winner=game.get_winner().player_name if completed else None, sessions=sessions)
+
+    async def end_game(self, player_conns: list[AsyncPlayerConnection], winner: str | None,
+                       sessions: list[AsyncPlayerConnection]):
+        # Winner is None for aborted games
+        self.metrics.game_finished(completed=winner is not None)
+        if self.game_slots is not None:
+            self.game_slots.release()
+        if winner is not None and self.ratings is not None:
+            self.ratings.record_game(player_names=[player_conn.player_name for player_conn in player_conns],
+                                     winner=winner)
+        # Close connections, except those of sessions with games left
+        for player_conn in player_conns:
+            if player_conn in sessions:
+                self.continue_session(player_conn=player_conn)
+            else:
+                await self.close_connection(player_conn.writer)
+        logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
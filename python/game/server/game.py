@@ -0,0 +1,345 @@
+import logging
+from dataclasses import dataclass
+from random import choice
+from threading import Lock
+from time import perf_counter, time
+from uuid import uuid1
+
+from pydantic import BaseModel
+
+from game.models.game_config import GameConfig
+from game.models.game_state import GameState
+from game.models.player import Player
+from game.models.shape import Shape
+from game.server.metrics import ServerMetrics
+from game.server.results import GameRecord, MatchRecord
+from game.server.schemas import JoinResponse, PlayerChoiceRequest, PlayerChoiceResponse, PlayerChoiceInfo, \
+    EndOfGameMessage, PlayerChoiceDelta, EndOfGameDelta
+from game.server.spectators import MATCH, SpectatorHub, SpectatorRelay
+from game.server.tracing import BUILD, DECODE, ENCODE, STATE, PhaseTimes
+from game.utils.codec import BINARY, JSON_CODEC, TYPED_JSON_CODEC, BinaryCodec, JsonCodec
+from game.utils.logging import log_event
+
+
+RANDOM = 'random'
+FORFEIT = 'forfeit'
+REPEAT = 'repeat'
+TIMEOUT_POLICIES = [RANDOM, FORFEIT, REPEAT]
+
+
+@dataclass(frozen=True)
+class MatchStats:
+    matches: int
+    timeouts: int
+    mean_latency: float
+    max_latency: float
+
+    def __str__(self) -> str:
+        return f'matches={self.matches} timeouts={self.timeouts} ' \
+               f'latency_mean={self.mean_latency:.3f}s latency_max={self.max_latency:.3f}s'
+
+
+class MatchRecorder:
+    # Thread-safe record of how long matches took to collect every choice
+
+    def __init__(self):
+        self.lock = Lock()
+        self.matches = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float, timeouts: int):
+        with self.lock:
+            self.matches += 1
+            self.timeouts += timeouts
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def get_stats(self) -> MatchStats:
+        with self.lock:
+            return MatchStats(
+                matches=self.matches,
+                timeouts=self.timeouts,
+                mean_latency=self.total_latency / self.matches if self.matches else 0.0,
+                max_latency=self.max_latency
+            )
+
+
+class ServerGame:
+
+    DEFAULT_SNAPSHOT_INTERVAL = 50
+    DEFAULT_MATCH_TIMEOUT = 30.0
+    DEFAULT_LOG_SAMPLE_INTERVAL = 1
+
+    def __init__(self, game_config: GameConfig, player_conns: list, snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+                 timeout_policy: str = RANDOM, match_recorder: MatchRecorder | None = None,
+                 log_sample_interval: int = DEFAULT_LOG_SAMPLE_INTERVAL, metrics: ServerMetrics | None = None,
+                 record_matches: bool = False, spectators: SpectatorHub | SpectatorRelay | None = None):
+        self.game_config = game_config
+        self.game_id = uuid1()
+        self.player_conns = player_conns
+        self.options = [shape.name for shape in game_config.rules.keys()]
+        # Get initial game state
+        self.game_state = GameState.get_initial_state(
+            config=game_config, player_names=[player_conn.player_name for player_conn in player_conns])
+        # Map player objects to connections
+        self.players_map = dict(zip(self.game_state.players, player_conns))
+        self.match_number = 1
+        self.binary_codec = BinaryCodec(
+            players=[player_conn.player_name for player_conn in player_conns], shapes=self.options)
+        # Delta encoded connections get a full snapshot every snapshot_interval matches
+        self.snapshot_interval = snapshot_interval
+        self.known_winners = {player_conn: 0 for player_conn in player_conns}
+        # Choices of players that do not answer in time are replaced according to the timeout policy
+        self.timeout_policy = timeout_policy
+        self.recorder = MatchRecorder()
+        self.phase_times = PhaseTimes()
+        # Players whose last request was not answered, their late response may still arrive after the game
+        self.unanswered: set[Player] = set()
+        self.match_recorder = match_recorder
+        # Only every log_sample_interval-th match is logged, none if 0
+        self.log_sample_interval = log_sample_interval
+        self.metrics = metrics
+        # Choices of every match are only kept when the game result is stored
+        self.started_at = time()
+        self.match_records: list[MatchRecord] | None = [] if record_matches else None
+        self.spectators = spectators
+
+    def __str__(self) -> str:
+        return f'{self.game_id}'
+
+    def is_finished(self) -> bool:
+        return self.game_state.is_finished()
+
+    def get_codec(self, player_conn) -> JsonCodec | BinaryCodec:
+        if player_conn.encoding == BINARY:
+            return self.binary_codec
+        return TYPED_JSON_CODEC if player_conn.typed else JSON_CODEC
+
+    def encode(self, player_conn, message: BaseModel) -> bytes:
+        started = perf_counter()
+        payload = self.get_codec(player_conn=player_conn).encode(message)
+        elapsed = perf_counter() - started
+        self.phase_times.add(ENCODE, elapsed)
+        if self.metrics is not None:
+            self.metrics.encode_time[player_conn.encoding].observe(elapsed)
+        return payload
+
+    def decode(self, player_conn, payload: bytes, schema_class: type[BaseModel]) -> BaseModel:
+        started = perf_counter()
+        message = self.get_codec(player_conn=player_conn).decode(payload, schema_class)
+        elapsed = perf_counter() - started
+        self.phase_times.add(DECODE, elapsed)
+        if self.metrics is not None:
+            self.metrics.decode_time[player_conn.encoding].observe(elapsed)
+        return message
+
+    def encode_for_players(self, message: BaseModel, players: list[Player]) -> dict[Player, bytes]:
+        # Messages that only differ in player_name are serialized once per codec
+        codec_players: dict[JsonCodec | BinaryCodec, list[Player]] = {}
+        for player in players:
+            codec_players.setdefault(self.get_codec(player_conn=self.players_map[player]), []).append(player)
+        payloads = {}
+        for codec, group in codec_players.items():
+            started = perf_counter()
+            encoded = codec.encode_for_players(message, [player.name for player in group])
+            elapsed = perf_counter() - started
+            self.phase_times.add(ENCODE, elapsed)
+            if self.metrics is not None:
+                self.metrics.encode_time[self.players_map[group[0]].encoding].observe(elapsed)
+            payloads.update(zip(group, encoded))
+        return payloads
+
+    def get_join_responses(self) -> dict[Player, bytes]:
+        return self.encode_for_players(
+            message=JoinResponse(
+                player_name='',
+                players=[player_conn.player_name for player_conn in self.player_conns],
+                game_id=self.game_id,
+                total_rounds=self.game_config.rounds,
+                options=self.options),
+            players=list(self.players_map))
+
+    def get_player_choices_info(self) -> list[PlayerChoiceInfo]:
+        return [
+            PlayerChoiceInfo(
+                player_name=player.name, shape=player_state.choice.name if player_state.choice else None
+            ) for player, player_state in self.game_state.player_states.items()]
+
+    def get_new_winners(self, player_conn) -> list[str]:
+        # Winners the connection has not been told about yet
+        past_winners = self.game_state.past_winners
+        new_winners = [player.name for player in past_winners[self.known_winners[player_conn]:]]
+        self.known_winners[player_conn] = len(past_winners)
+        return new_winners
+
+    def is_snapshot_match(self) -> bool:
+        return (self.match_number - 1) % self.snapshot_interval == 0
+
+    def get_player_choice_request(
+            self, delta: bool, known_winners: int, past_winners: list[str], player_choices: list[PlayerChoiceInfo]
+    ) -> PlayerChoiceRequest | PlayerChoiceDelta:
+        if delta:
+            return PlayerChoiceDelta(
+                player_name='',
+                game_id=self.game_id,
+                match_number=self.match_number,
+                current_round=self.game_state.current_round+1,
+                new_winners=past_winners[known_winners:],
+                player_choices=player_choices
+            )
+        return PlayerChoiceRequest(
+            player_name='',
+            game_id=self.game_id,
+            match_number=self.match_number,
+            options=self.options,
+            current_round=self.game_state.current_round+1,
+            total_rounds=self.game_state.config.rounds,
+            past_winners=past_winners,
+            player_choices=player_choices
+        )
+
+    def get_player_choice_requests(
+            self
+    ) -> tuple[dict[Player, PlayerChoiceRequest | PlayerChoiceDelta], dict[Player, bytes]]:
+        # Only players still in the round are asked. Requests are built and serialized once for every group of
+        # players told the same winners, so the work per match grows linearly with the number of players
+        started, encode_time = perf_counter(), self.phase_times.totals[ENCODE]
+        player_choices = self.get_player_choices_info()
+        past_winners = [player.name for player in self.game_state.past_winners]
+        active_players = self.game_state.get_active_players()
+        groups: dict[tuple[bool, int], list[Player]] = {}
+        for player in active_players:
+            player_conn = self.players_map[player]
+            delta = player_conn.delta and not self.is_snapshot_match()
+            groups.setdefault((delta, self.known_winners[player_conn] if delta else 0), []).append(player)
+        requests, payloads = {}, {}
+        for (delta, known_winners), players in groups.items():
+            request = self.get_player_choice_request(
+                delta=delta, known_winners=known_winners, past_winners=past_winners, player_choices=player_choices)
+            payloads.update(self.encode_for_players(message=request, players=players))
+            for player in players:
+                requests[player] = request.copy(update={'player_name': player.name})
+                self.known_winners[self.players_map[player]] = len(past_winners)
+        # Building is everything but the encoding in between
+        self.phase_times.add(BUILD, perf_counter() - started - (self.phase_times.totals[ENCODE] - encode_time))
+        return {player: requests[player] for player in active_players}, payloads
+
+    def parse_player_choice_response(
+            self, request: PlayerChoiceRequest | PlayerChoiceDelta, response: PlayerChoiceResponse
+    ) -> Shape | None:
+        # Assert request and response match
+        if any([request.game_id != response.game_id,
+                request.match_number != response.match_number,
+                request.player_name != response.player_name]):
+            return None
+        # Parse response
+        for shape in self.game_config.rules.keys():
+            if shape.name == response.shape:
+                return shape
+
+    def get_fallback_choice(self, player: Player) -> Shape | None:
+        # None forfeits the match
+        if self.timeout_policy == FORFEIT:
+            return None
+        if self.timeout_policy == REPEAT and self.game_state.get_player_choice(player=player) is not None:
+            return self.game_state.get_player_choice(player=player)
+        return choice(self.game_config.get_shapes())
+
+    def record_match(self, latency: float, requested: list[Player], unanswered: list[Player]):
+        self.unanswered.difference_update(requested)
+        self.unanswered.update(unanswered)
+        timeouts = len(unanswered)
+        self.recorder.record(latency=latency, timeouts=timeouts)
+        if self.match_recorder is not None:
+            self.match_recorder.record(latency=latency, timeouts=timeouts)
+        if self.metrics is not None:
+            self.metrics.match_round_trip.observe(latency)
+            if timeouts:
+                self.metrics.match_timeouts.inc(timeouts)
+
+    def is_logged_match(self) -> bool:
+        return self.log_sample_interval > 0 and (self.match_number - 1) % self.log_sample_interval == 0 and \
+            logging.getLogger().isEnabledFor(logging.INFO)
+
+    def log_event(self, event: str, level: int = logging.INFO, **fields):
+        log_event(self.game_id, event, level=level, **fields)
+
+    def publish_event(self, event: str, **fields):
+        if self.spectators is not None:
+            self.spectators.publish(game_id=self.game_id, event=event, **fields)
+
+    def play_match(self, player_choices: dict[Player, Shape | None]):
+        # Players without a choice forfeit, unless nobody still in the round made one
+        forfeits = [player for player in self.game_state.get_active_players() if player_choices.get(player) is None]
+        if len(forfeits) == len(self.game_state.get_active_players()):
+            player_choices = {
+                **player_choices, **{player: choice(self.game_config.get_shapes()) for player in forfeits}}
+            forfeits = []
+        # Go to next game state with player choices
+        with self.phase_times.span(STATE):
+            game_state = self.game_state.updated_player_choices(player_choices=player_choices)
+            game_state = game_state.deactivated_players(players=forfeits)
+            if not game_state.is_end_of_round():
+                game_state = game_state.get_next_state()
+            # Handle rounds
+            round_winner = game_state.get_round_winner()
+            if round_winner is not None:
+                game_state = game_state.get_next_round().updated_player_choices(player_choices)
+        if self.match_records is not None:
+            self.match_records.append(MatchRecord(
+                match_number=self.match_number, round=self.game_state.current_round + 1,
+                choices=tuple(player_choices[player].name if player_choices.get(player) is not None else None
+                              for player in self.players_map)))
+        if self.is_logged_match():
+            self.log_event(
+                'match', number=self.match_number, round=self.game_state.current_round + 1,
+                choices=[(player.name, shape.name if shape is not None else 'forfeit')
+                         for player, shape in player_choices.items()],
+                result=round_winner.name if round_winner is not None else 'tie')
+        if self.spectators is not None and self.spectators.is_watched(self.game_id):
+            self.publish_event(
+                MATCH, number=self.match_number, round=self.game_state.current_round + 1,
+                player_choices=[{'player_name': player.name, 'shape': shape.name if shape is not None else None}
+                                for player, shape in player_choices.items()],
+                round_winner=round_winner.name if round_winner is not None else None,
+                past_winners=[player.name for player in game_state.past_winners])
+        self.game_state = game_state
+        self.match_number += 1
+
+    def get_winner(self):
+        return self.players_map[self.game_state.get_winner()]
+
+    def get_record(self) -> GameRecord:
+        return GameRecord(
+            game_id=str(self.game_id),
+            players=tuple(player.name for player in self.players_map),
+            winner=self.get_winner().player_name,
+            round_winners=tuple(player.name for player in self.game_state.past_winners),
+            matches=tuple(self.match_records or ()),
+            started_at=self.started_at,
+            finished_at=time()
+        )
+
+    def get_end_of_game_message(self, player_conn) -> EndOfGameMessage | EndOfGameDelta:
+        if player_conn.delta:
+            return EndOfGameDelta(
+                current_round=self.game_state.current_round,
+                new_winners=self.get_new_winners(player_conn=player_conn),
+                player_choices=self.get_player_choices_info(),
+                winner=self.get_winner().player_name
+            )
+        return EndOfGameMessage(
+            current_round=self.game_state.current_round,
+            total_rounds=self.game_state.config.rounds,
+            past_winners=[player.name for player in self.game_state.past_winners],
+            player_choices=self.get_player_choices_info(),
+            winner=self.get_winner().player_name
+        )
+
+    def get_sessions(self) -> list:
+        # Connections kept open for another game of their session. A late response could not be told apart
+        # from the next game's frames, so players that did not answer their last request are disconnected
+        return [player_conn for player, player_conn in self.players_map.items()
+                if player_conn.games != 1 and player not in self.unanswered]
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from itertools import islice
+from threading import Condition
+from time import monotonic
+from typing import Any, Callable
+
+
+@dataclass(eq=False)
+class QueueEntry:
+    player_conn: Any
+    enqueued_at: float
+    matched: bool = False
+    bucket: int = 0
+
+    @property
+    def player_name(self) -> str:
+        return self.player_conn.player_name
+
+
+class MatchmakingPolicy(ABC):
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def add(self, entry: QueueEntry):
+        ...
+
+    @abstractmethod
+    def pop_group(self, size: int, now: float) -> list[QueueEntry] | None:
+        ...
+
+    def get_timeout(self, size: int, now: float) -> float | None:
+        # Time until the policy may form a group without new arrivals (None waits for arrivals only)
+        return None
+
+
+class FifoPolicy(MatchmakingPolicy):
+
+    def __init__(self):
+        self.entries: deque[QueueEntry] = deque()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, entry: QueueEntry):
+        self.entries.append(entry)
+
+    def pop_group(self, size: int, now: float) -> list[QueueEntry] | None:
+        if len(self.entries) < size:
+            return None
+        return [self.entries.popleft() for _ in range(size)]
+
+
+class NameExclusionPolicy(MatchmakingPolicy):
+    # Never groups two connections that use the same player name
+
+    def __init__(self):
+        # Names are kept in the order their oldest waiting connection arrived
+        self.entries: OrderedDict[str, deque[QueueEntry]] = OrderedDict()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, entry: QueueEntry):
+        self.entries.setdefault(entry.player_name, deque()).append(entry)
+        self.size += 1
+
+    def pop_group(self, size: int, now: float) -> list[QueueEntry] | None:
+        if len(self.entries) < size:
+            return None
+        group = []
+        for name in list(islice(self.entries, size)):
+            name_entries = self.entries[name]
+            group.append(name_entries.popleft())
+            if name_entries:
+                self.entries.move_to_end(name)
+            else:
+                del self.entries[name]
+        self.size -= size
+        return group
+
+
+class SkillBucketPolicy(MatchmakingPolicy):
+    # Groups players whose skill falls in the same bucket, widening to any bucket after max_wait seconds
+
+    def __init__(self, skill: Callable[[str], float] | None = None, bucket_size: float = 100.0,
+                 max_wait: float | None = 5.0):
+        self.skill = skill or (lambda player_name: 0.0)
+        self.bucket_size = bucket_size
+        self.max_wait = max_wait
+        self.buckets: dict[int, deque[QueueEntry]] = {}
+        self.bucket_sizes: dict[int, int] = {}
+        self.candidates: OrderedDict[int, None] = OrderedDict()
+        # Global arrival order, used to widen the search for players waiting too long
+        self.entries: deque[QueueEntry] = deque()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, entry: QueueEntry):
+        # Skill may change while waiting, so the bucket is fixed on arrival
+        bucket = entry.bucket = int(self.skill(entry.player_name) // self.bucket_size)
+        self.buckets.setdefault(bucket, deque()).append(entry)
+        self.bucket_sizes[bucket] = self.bucket_sizes.get(bucket, 0) + 1
+        self.candidates[bucket] = None
+        self.entries.append(entry)
+        self.size += 1
+
+    @staticmethod
+    def pop_unmatched(entries: deque[QueueEntry]) -> QueueEntry:
+        # Matched entries are removed lazily from the other deques
+        entry = entries.popleft()
+        while entry.matched:
+            entry = entries.popleft()
+        return entry
+
+    def peek_oldest(self) -> QueueEntry | None:
+        while self.entries and self.entries[0].matched:
+            self.entries.popleft()
+        return self.entries[0] if self.entries else None
+
+    def take(self, group: list[QueueEntry]) -> list[QueueEntry]:
+        for entry in group:
+            entry.matched = True
+            bucket = entry.bucket
+            self.bucket_sizes[bucket] -= 1
+            if not self.bucket_sizes[bucket]:
+                del self.bucket_sizes[bucket]
+                del self.buckets[bucket]
+            elif len(self.buckets[bucket]) > 2 * self.bucket_sizes[bucket]:
+                self.buckets[bucket] = deque(other for other in self.buckets[bucket] if not other.matched)
+        self.size -= len(group)
+        # Matched entries stuck behind a long-waiting player are dropped once they outnumber the waiting ones,
+        # so the deques never grow past twice the queue
+        if len(self.entries) > 2 * self.size:
+            self.entries = deque(entry for entry in self.entries if not entry.matched)
+        return group
+
+    def pop_group(self, size: int, now: float) -> list[QueueEntry] | None:
+        if self.size < size:
+            return None
+        # Only buckets that received players since they were last checked may have filled up
+        while self.candidates:
+            bucket = next(iter(self.candidates))
+            if self.bucket_sizes.get(bucket, 0) >= size:
+                bucket_entries = self.buckets[bucket]
+                return self.take([self.pop_unmatched(bucket_entries) for _ in range(size)])
+            del self.candidates[bucket]
+        # Widen to every bucket once the oldest player has waited long enough
+        oldest = self.peek_oldest()
+        if self.max_wait is not None and now - oldest.enqueued_at >= self.max_wait:
+            return self.take([self.pop_unmatched(self.entries) for _ in range(size)])
+        return None
+
+    def get_timeout(self, size: int, now: float) -> float | None:
+        # Widening cannot form a group until enough players are waiting
+        if self.max_wait is None or self.size < size:
+            return None
+        oldest = self.peek_oldest()
+        return max(0.0, oldest.enqueued_at + self.max_wait - now)
+
+
+MATCHMAKING_POLICIES: dict[str, Callable[[], MatchmakingPolicy]] = {
+    'fifo': FifoPolicy,
+    'name': NameExclusionPolicy,
+    'skill': SkillBucketPolicy,
+}
+
+
+@dataclass(frozen=True)
+class MatchmakingStats:
+    queue_depth: int
+    max_queue_depth: int
+    players_queued: int
+    groups_matched: int
+    mean_wait: float
+    max_wait: float
+    p50_wait: float
+    p95_wait: float
+
+    def __str__(self) -> str:
+        return f'depth={self.queue_depth} queued={self.players_queued} matched={self.groups_matched} ' \
+               f'wait_mean={self.mean_wait:.3f}s wait_p50={self.p50_wait:.3f}s ' \
+               f'wait_p95={self.p95_wait:.3f}s wait_max={self.max_wait:.3f}s'
+
+
+@dataclass
+class MatchmakingRecorder:
+    max_queue_depth: int = 0
+    players_queued: int = 0
+    players_matched: int = 0
+    groups_matched: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    recent_waits: deque[float] = field(default_factory=lambda: deque(maxlen=1024))
+
+    def record_arrival(self, queue_depth: int):
+        self.players_queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def record_group(self, group: list[QueueEntry], now: float):
+        self.groups_matched += 1
+        for entry in group:
+            wait = now - entry.enqueued_at
+            self.players_matched += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_waits.append(wait)
+
+    def snapshot(self, queue_depth: int) -> MatchmakingStats:
+        waits = sorted(self.recent_waits)
+        return MatchmakingStats(
+            queue_depth=queue_depth,
+            max_queue_depth=self.max_queue_depth,
+            players_queued=self.players_queued,
+            groups_matched=self.groups_matched,
+            mean_wait=self.total_wait / self.players_matched if self.players_matched else 0.0,
+            max_wait=self.max_wait,
+            p50_wait=waits[len(waits) // 2] if waits else 0.0,
+            p95_wait=waits[int(len(waits) * 0.95)] if waits else 0.0
+        )
+
+
+class Matchmaker:
+    # Thread-safe matchmaker that blocks until a policy can form a group
+
+    def __init__(self, policy: MatchmakingPolicy | None = None, group_size: int = 2):
+        self.policy = policy if policy is not None else FifoPolicy()
+        self.group_size = group_size
+        self.recorder = MatchmakingRecorder()
+        self.condition = Condition()
+
+    def put(self, player_conn):
+        with self.condition:
+            self.policy.add(QueueEntry(player_conn=player_conn, enqueued_at=monotonic()))
+            self.recorder.record_arrival(queue_depth=len(self.policy))
+            self.condition.notify()
+
+    def get_group(self) -> list:
+        with self.condition:
+            while True:
+                now = monotonic()
+                group = self.policy.pop_group(size=self.group_size, now=now)
+                if group is not None:
+                    self.recorder.record_group(group=group, now=now)
+                    return [entry.player_conn for entry in group]
+                self.condition.wait(timeout=self.policy.get_timeout(size=self.group_size, now=now))
+
+    def get_stats(self) -> MatchmakingStats:
+        with self.condition:
+            return self.recorder.snapshot(queue_depth=len(self.policy))
+
+
+class AsyncMatchmaker:
+    # Matchmaker for the asyncio server, must only be used from the event loop thread
+
+    def __init__(self, policy: MatchmakingPolicy | None = None, group_size: int = 2):
+        self.policy = policy if policy is not None else FifoPolicy()
+        self.group_size = group_size
+        self.recorder = MatchmakingRecorder()
+        self.arrival = asyncio.Event()
+
+    def put(self, player_conn):
+        self.policy.add(QueueEntry(player_conn=player_conn, enqueued_at=monotonic()))
+        self.recorder.record_arrival(queue_depth=len(self.policy))
+        self.arrival.set()
+
+    async def get_group(self) -> list:
+        while True:
+            now = monotonic()
+            group = self.policy.pop_group(size=self.group_size, now=now)
+            if group is not None:
+                self.recorder.record_group(group=group, now=now)
+                return [entry.player_conn for entry in group]
+            self.arrival.clear()
+            try:
+                await asyncio.wait_for(
+                    self.arrival.wait(), timeout=self.policy.get_timeout(size=self.group_size, now=now))
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self) -> MatchmakingStats:
+        return self.recorder.snapshot(queue_depth=len(self.policy))
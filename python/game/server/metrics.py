@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable
+
+from game.server.admission import BUSY_REASONS
+from game.server.tracing import PHASES, PhaseTimes
+from game.utils.codec import ENCODINGS
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CODEC_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01)
+
+
+def format_labels(labels: dict[str, str], extra: str = '') -> str:
+    pairs = [f'{key}="{value}"' for key, value in labels.items()]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: dict[str, str] | None = None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount: int | float = 1):
+        with self.lock:
+            self.value += amount
+
+    def get_samples(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labels)} {self.value}']
+
+    def get_state(self) -> list[int | float]:
+        return [self.value]
+
+    def add_state(self, state: list[int | float]):
+        self.inc(state[0])
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: dict[str, str] | None = None,
+                 function: Callable[[], float] | None = None):
+        super().__init__(name=name, help_text=help_text, labels=labels)
+        # Gauges with a function are read when scraped
+        self.function = function
+
+    def dec(self, amount: int | float = 1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: int | float):
+        self.value = value
+
+    def get_samples(self) -> list[str]:
+        value = self.function() if self.function is not None else self.value
+        return [f'{self.name}{format_labels(self.labels)} {value}']
+
+
+class RateGauge(Gauge):
+    # Events per second over the last window seconds, counted in one second slots
+
+    def __init__(self, name: str, help_text: str, labels: dict[str, str] | None = None, window: int = 60):
+        super().__init__(name=name, help_text=help_text, labels=labels)
+        self.window = window
+        self.slots = [0] * window
+        self.slot_times = [0] * window
+
+    def mark(self, amount: int = 1):
+        second = int(monotonic())
+        with self.lock:
+            slot = second % self.window
+            if self.slot_times[slot] != second:
+                self.slot_times[slot] = second
+                self.slots[slot] = 0
+            self.slots[slot] += amount
+
+    def get_samples(self) -> list[str]:
+        second = int(monotonic())
+        with self.lock:
+            # The current second is still being counted
+            total = sum(count for count, time in zip(self.slots, self.slot_times) if 0 < second - time < self.window)
+        return [f'{self.name}{format_labels(self.labels)} {total / (self.window - 1)}']
+
+
+class Histogram:
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: dict[str, str] | None = None,
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = buckets
+        self.lock = Lock()
+        # Last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+
+    def get_samples(self) -> list[str]:
+        with self.lock:
+            counts, total = list(self.counts), self.total
+        samples = []
+        cumulative = 0
+        for bucket, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            bucket_label = f'le="{bucket}"'
+            samples.append(f'{self.name}_bucket{format_labels(self.labels, bucket_label)} {cumulative}')
+        samples.append(f'{self.name}_sum{format_labels(self.labels)} {total}')
+        samples.append(f'{self.name}_count{format_labels(self.labels)} {cumulative}')
+        return samples
+
+    def get_state(self) -> list[int | float]:
+        with self.lock:
+            return [*self.counts, self.total]
+
+    def add_state(self, state: list[int | float]):
+        with self.lock:
+            for index, count in enumerate(state[:-1]):
+                self.counts[index] += count
+            self.total += state[-1]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Prometheus text exposition format, metrics sharing a name are grouped under one header
+        lines = []
+        names = set()
+        for metric in sorted(self.metrics, key=lambda metric: metric.name):
+            if metric.name not in names:
+                names.add(metric.name)
+                lines.append(f'# HELP {metric.name} {metric.help_text}')
+                lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            lines.extend(metric.get_samples())
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        register = self.registry.register
+        self.connections = register(Counter('rpsls_connections_total', 'Accepted connections.'))
+        self.rejected_connections = register(Counter(
+            'rpsls_rejected_connections_total', 'Connections closed because of an invalid join request.'))
+        self.active_connections = register(Gauge('rpsls_active_connections', 'Open player connections.'))
+        self.busy_replies = {reason: register(Counter(
+            'rpsls_busy_replies_total', 'Players told to retry later because a limit was reached.',
+            labels={'reason': reason})) for reason in BUSY_REASONS}
+        self.reaped_connections = register(Counter(
+            'rpsls_reaped_connections_total', 'Connections closed because the player did not join or went idle.'))
+        self.queue_depth = register(Gauge('rpsls_queue_depth', 'Players waiting to be matched.'))
+        self.games_in_progress = register(Gauge('rpsls_games_in_progress', 'Games being played.'))
+        self.games_completed = register(Counter('rpsls_games_completed_total', 'Games played to the end.'))
+        self.games_aborted = register(Counter('rpsls_games_aborted_total', 'Games aborted by a connection error.'))
+        self.games_per_second = register(RateGauge(
+            'rpsls_games_completed_per_second', 'Games completed per second over the last minute.'))
+        self.match_round_trip = register(Histogram(
+            'rpsls_match_round_trip_seconds', 'Time from sending choice requests to having every choice.'))
+        self.match_timeouts = register(Counter(
+            'rpsls_match_timeouts_total', 'Choices replaced because players did not answer in time.'))
+        self.phase_time = {phase: register(Counter(
+            'rpsls_phase_seconds_total', 'Time games spent in each phase of their matches.', labels={'phase': phase}))
+            for phase in PHASES}
+        self.phase_spans = {phase: register(Counter(
+            'rpsls_phase_spans_total', 'Times games went through each phase.', labels={'phase': phase}))
+            for phase in PHASES}
+        self.spectators = register(Gauge('rpsls_spectators', 'Spectators following games.'))
+        self.spectator_events = register(Counter(
+            'rpsls_spectator_events_total', 'Game events serialized for spectators.'))
+        self.spectator_lost_events = {reason: register(Counter(
+            'rpsls_spectator_lost_events_total', 'Events slow spectators missed because their queue was full.',
+            labels={'reason': reason})) for reason in ['coalesced', 'dropped']}
+        self.encode_time = {}
+        self.decode_time = {}
+        for encoding in ENCODINGS:
+            self.encode_time[encoding] = register(Histogram(
+                'rpsls_encode_seconds', 'Time spent encoding messages.', labels={'encoding': encoding},
+                buckets=CODEC_BUCKETS))
+            self.decode_time[encoding] = register(Histogram(
+                'rpsls_decode_seconds', 'Time spent decoding messages.', labels={'encoding': encoding},
+                buckets=CODEC_BUCKETS))
+        # Metrics of matches, which worker processes report to the acceptor process along with their games
+        self.match_metrics: dict[str, Counter | Histogram] = {
+            f'{metric.name}{format_labels(metric.labels)}': metric for metric in [
+                self.match_round_trip, self.match_timeouts, *self.phase_time.values(), *self.phase_spans.values(),
+                *self.encode_time.values(), *self.decode_time.values()]}
+        self.reported_lock = Lock()
+        self.reported = {key: metric.get_state() for key, metric in self.match_metrics.items()}
+
+    def take_match_deltas(self) -> dict[str, list[int | float]]:
+        # Changes of the match metrics since the last call, for those that changed
+        deltas = {}
+        with self.reported_lock:
+            for key, metric in self.match_metrics.items():
+                state = metric.get_state()
+                delta = [value - reported for value, reported in zip(state, self.reported[key])]
+                if any(delta):
+                    deltas[key] = delta
+                    self.reported[key] = state
+        return deltas
+
+    def add_match_deltas(self, deltas: dict[str, list[int | float]]):
+        for key, delta in deltas.items():
+            self.match_metrics[key].add_state(delta)
+
+    def game_started(self):
+        self.games_in_progress.inc()
+
+    def game_finished(self, completed: bool):
+        self.games_in_progress.dec()
+        if completed:
+            self.games_completed.inc()
+            self.games_per_second.mark()
+        else:
+            self.games_aborted.inc()
+
+    def record_phases(self, phase_times: PhaseTimes):
+        # Added once per game, so games never contend for the counters during matches
+        for phase in PHASES:
+            self.phase_time[phase].inc(phase_times.totals[phase])
+            self.phase_spans[phase].inc(phase_times.counts[phase])
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+class MetricsServer:
+    # Serves metrics over HTTP from a daemon thread
+
+    def __init__(self, metrics: ServerMetrics, host: str, port: int):
+        self.metrics = metrics
+        metrics_server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_server.metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.http_server.daemon_threads = True
+
+    def start(self):
+        Thread(target=self.http_server.serve_forever, daemon=True).start()
+        logging.info(f'[METRICS] Metrics are served on {self.http_server.server_address}/metrics.')
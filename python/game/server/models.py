@@ -1,12 +1,39 @@
+from asyncio import StreamReader, StreamWriter
 from dataclasses import dataclass
 from socket import socket
 
+from game.utils.codec import JSON
+from game.utils.protocol import MessageReader, MessageWriter
+
 
 @dataclass(frozen=True)
 class PlayerConnection:
     player_name: str
     conn: socket
     addr: str
+    reader: MessageReader
+    writer: MessageWriter
+    encoding: str = JSON
+    delta: bool = False
+    typed: bool = False
+    # Games left in the session, 0 if the player decides after every game
+    games: int = 1
+
+    def __str__(self) -> str:
+        return f'{self.player_name} {self.addr}'
+
+
+@dataclass(frozen=True)
+class AsyncPlayerConnection:
+    player_name: str
+    reader: StreamReader
+    writer: StreamWriter
+    addr: str
+    encoding: str = JSON
+    delta: bool = False
+    typed: bool = False
+    # Games left in the session, 0 if the player decides after every game
+    games: int = 1
 
     def __str__(self) -> str:
         return f'{self.player_name} {self.addr}'
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from itertools import islice
+from json import dump, load
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+
+DEFAULT_RATING = 1500.0
+K_FACTOR = 32.0
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+
+
+@dataclass(frozen=True)
+class Rating:
+    player_name: str
+    rating: float
+    games: int
+    # 1 is the best rating
+    rank: int
+
+
+class Leaderboard:
+    # Sorted (-rating, player_name) keys, kept in chunks so inserts and removals only shift one short list
+
+    LOAD = 1000
+
+    def __init__(self, keys: list[tuple[float, str]] | None = None):
+        keys = sorted(keys or [])
+        self.chunks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        # Number of keys before each chunk, rebuilt after chunks are added or removed
+        self.offsets: list[int] | None = None
+        self.size = len(keys)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def get_offsets(self) -> list[int]:
+        if self.offsets is None:
+            offsets = [0]
+            for chunk in self.chunks[:-1]:
+                offsets.append(offsets[-1] + len(chunk))
+            self.offsets = offsets
+        return self.offsets
+
+    def add(self, key: tuple[float, str]):
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+        else:
+            index = min(bisect_left(self.maxes, key), len(self.chunks) - 1)
+            chunk = self.chunks[index]
+            insort(chunk, key)
+            self.maxes[index] = chunk[-1]
+            if len(chunk) > 2 * self.LOAD:
+                self.chunks.insert(index + 1, chunk[self.LOAD:])
+                del chunk[self.LOAD:]
+                self.maxes.insert(index, chunk[-1])
+        self.offsets = None
+        self.size += 1
+
+    def remove(self, key: tuple[float, str]):
+        index = bisect_left(self.maxes, key)
+        chunk = self.chunks[index]
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self.maxes[index] = chunk[-1]
+        else:
+            del self.chunks[index]
+            del self.maxes[index]
+        self.offsets = None
+        self.size -= 1
+
+    def index(self, key: tuple[float, str]) -> int:
+        index = bisect_left(self.maxes, key)
+        return self.get_offsets()[index] + bisect_left(self.chunks[index], key)
+
+    def head(self, count: int) -> list[tuple[float, str]]:
+        return list(islice(self, count))
+
+
+class RatingService:
+    # Elo ratings updated after every completed game, snapshotted to disk so restarts only load one file
+
+    def __init__(self, path: str | None = None, snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+                 k_factor: float = K_FACTOR, initial_rating: float = DEFAULT_RATING):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.k_factor = k_factor
+        self.initial_rating = initial_rating
+        self.lock = Lock()
+        self.ratings: dict[str, float] = {}
+        self.games: dict[str, int] = {}
+        if path is not None and Path(path).exists():
+            self.load_snapshot()
+        self.leaderboard = Leaderboard(keys=[(-rating, name) for name, rating in self.ratings.items()])
+        self.changed = False
+        self.closed = Event()
+        self.snapshotter: Thread | None = None
+
+    def start(self):
+        if self.path is None:
+            return
+        self.snapshotter = Thread(target=self.snapshot_periodically, daemon=True)
+        self.snapshotter.start()
+        atexit.register(self.close)
+
+    def close(self):
+        if self.snapshotter is not None and not self.closed.is_set():
+            self.closed.set()
+            self.snapshotter.join()
+            self.snapshot()
+
+    def snapshot_periodically(self):
+        while not self.closed.wait(timeout=self.snapshot_interval):
+            self.snapshot()
+
+    def load_snapshot(self):
+        with open(self.path) as snapshot_file:
+            for name, rating, games in load(snapshot_file):
+                self.ratings[name] = rating
+                self.games[name] = games
+        logging.info(f'[RATINGS] Loaded {len(self.ratings)} ratings from {self.path}.')
+
+    def snapshot(self):
+        with self.lock:
+            if not self.changed:
+                return
+            rows = [[name, rating, self.games[name]] for name, rating in self.ratings.items()]
+            self.changed = False
+        # Written next to the snapshot and renamed, so a crash never leaves a partial file
+        temp_path = f'{self.path}.tmp'
+        try:
+            with open(temp_path, 'w') as snapshot_file:
+                dump(rows, snapshot_file, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.error(f'[RATINGS] Could not write snapshot: {e!r}')
+
+    @staticmethod
+    def get_expected_score(rating: float, opponent_rating: float) -> float:
+        return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+    def record_game(self, player_names: list[str], winner: str):
+        # The winner beat every other player, every update uses the ratings from before the game
+        with self.lock:
+            before = {name: self.ratings.get(name, self.initial_rating) for name in player_names}
+            deltas = dict.fromkeys(player_names, 0.0)
+            for name in player_names:
+                if name == winner:
+                    continue
+                change = self.k_factor * (1.0 - self.get_expected_score(before[winner], before[name]))
+                deltas[winner] += change
+                deltas[name] -= change
+            for name, delta in deltas.items():
+                if name in self.ratings:
+                    self.leaderboard.remove((-before[name], name))
+                self.ratings[name] = before[name] + delta
+                self.games[name] = self.games.get(name, 0) + 1
+                self.leaderboard.add((-self.ratings[name], name))
+            self.changed = True
+
+    def get_rating(self, player_name: str) -> float:
+        return self.ratings.get(player_name, self.initial_rating)
+
+    def get_rank(self, player_name: str) -> Rating | None:
+        with self.lock:
+            rating = self.ratings.get(player_name)
+            if rating is None:
+                return None
+            return Rating(player_name=player_name, rating=rating, games=self.games[player_name],
+                          rank=self.leaderboard.index((-rating, player_name)) + 1)
+
+    def get_top(self, count: int) -> list[Rating]:
+        with self.lock:
+            return [Rating(player_name=name, rating=-key, games=self.games[name], rank=rank)
+                    for rank, (key, name) in enumerate(self.leaderboard.head(count), start=1)]
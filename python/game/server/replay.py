@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import mmap
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from operator import itemgetter
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from struct import Struct
+from threading import Thread
+from time import time
+from typing import BinaryIO, Iterator
+from uuid import UUID
+
+from game.models.compact_state import CompactState, WinnerLog
+from game.models.game_config import GameConfig
+from game.models.player import Player
+from game.server.results import GameRecord
+
+
+LOG_MAGIC = b'RPL1'
+INDEX_MAGIC = b'RPX1'
+LOG_SUFFIX = '.rpl'
+INDEX_SUFFIX = '.idx'
+# Record size, game id, start and end time, number of players and shapes, rounds, matches and snapshots
+GAME_HEADER = Struct('!I16sddBBHIH')
+NAME_SIZE = Struct('!H')
+# Match a snapshot was taken before, and where the snapshot starts in the record
+SNAPSHOT_ENTRY = Struct('!II')
+SNAPSHOT_ROUND = Struct('!H')
+# Game id and offset of a record in its log
+INDEX_ENTRY = Struct('!16sQ')
+# Written for forfeited choices and matches that did not end a round
+NO_ID = 255
+
+DEFAULT_SNAPSHOT_INTERVAL = 16
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ReplayMatch:
+    match_number: int
+    # Shape id chosen by each player, None if forfeited or out of the round
+    choices: tuple[int | None, ...]
+    round_winner: int | None
+
+
+def get_mask_size(num_players: int) -> int:
+    return (num_players + 7) // 8
+
+
+def encode_snapshot(state: CompactState) -> bytes:
+    # Round, bitmask of active players, choices and the winner of every past round
+    return b''.join([
+        SNAPSHOT_ROUND.pack(state.current_round),
+        state.active.to_bytes(get_mask_size(len(state.players)), 'big'),
+        bytes(NO_ID if shape_id is None else shape_id for shape_id in state.choices),
+        bytes(state.winners)
+    ])
+
+
+def decode_snapshot(buffer, offset: int, game_config: GameConfig, players: tuple[Player, ...]) -> CompactState:
+    current_round, = SNAPSHOT_ROUND.unpack_from(buffer, offset)
+    offset += SNAPSHOT_ROUND.size
+    mask_size = get_mask_size(len(players))
+    active = int.from_bytes(buffer[offset:offset + mask_size], 'big')
+    offset += mask_size
+    choices = tuple(None if shape_id == NO_ID else shape_id for shape_id in buffer[offset:offset + len(players)])
+    offset += len(players)
+    winners = WinnerLog(items=list(buffer[offset:offset + current_round]))
+    return CompactState.create(config=game_config, players=players, current_round=current_round, winners=winners) \
+        .replaced(choices=choices, active=active)
+
+
+def encode_game(record: GameRecord, game_config: GameConfig,
+                snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL) -> bytes:
+    # Header, player names, snapshot table, one fixed size event per match and the snapshots
+    if len(record.players) >= NO_ID or len(game_config.shapes) >= NO_ID:
+        raise ValueError(f'Replays hold at most {NO_ID - 1} players and shapes')
+    shape_ids = {shape.name: i for i, shape in enumerate(game_config.shapes)}
+    names = b''.join(NAME_SIZE.pack(len(name)) + name for name in (name.encode('utf-8') for name in record.players))
+    # Matches are replayed to find round winners and take snapshots
+    state = CompactState.create(config=game_config, players=tuple(Player(name=name) for name in record.players))
+    events = bytearray()
+    snapshots = []
+    for match in record.matches:
+        if (match.match_number - 1) % snapshot_interval == 0:
+            snapshots.append((match.match_number, encode_snapshot(state)))
+        choices = [None if shape is None else shape_ids[shape] for shape in match.choices]
+        current_round = state.current_round
+        state = state.played_match({player_id: choices[player_id] for player_id in state.get_active_ids()})
+        events += bytes(NO_ID if shape_id is None else shape_id for shape_id in choices)
+        events.append(state.winners[-1] if state.current_round > current_round else NO_ID)
+    offset = GAME_HEADER.size + len(names) + SNAPSHOT_ENTRY.size * len(snapshots) + len(events)
+    table = bytearray()
+    for match_number, snapshot in snapshots:
+        table += SNAPSHOT_ENTRY.pack(match_number, offset)
+        offset += len(snapshot)
+    header = GAME_HEADER.pack(
+        offset, UUID(record.game_id).bytes, record.started_at, record.finished_at, len(record.players),
+        len(game_config.shapes), game_config.rounds, len(record.matches), len(snapshots))
+    return b''.join([header, names, table, events, *(snapshot for _, snapshot in snapshots)])
+
+
+class GameReplay:
+    # View of a game record in a log, matches and states are decoded on access
+
+    def __init__(self, buffer, offset: int, game_config: GameConfig):
+        size, game_id, started_at, finished_at, num_players, num_shapes, rounds, matches, num_snapshots = \
+            GAME_HEADER.unpack_from(buffer, offset)
+        if num_shapes != len(game_config.shapes) or rounds != game_config.rounds:
+            raise ValueError('Game was played with another game configuration')
+        self.buffer = buffer
+        self.offset = offset
+        self.game_config = game_config
+        self.game_id = UUID(bytes=game_id)
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.matches = matches
+        position = offset + GAME_HEADER.size
+        names = []
+        for _ in range(num_players):
+            name_size, = NAME_SIZE.unpack_from(buffer, position)
+            position += NAME_SIZE.size
+            names.append(bytes(buffer[position:position + name_size]).decode('utf-8'))
+            position += name_size
+        self.players = tuple(names)
+        self.snapshots = [SNAPSHOT_ENTRY.unpack_from(buffer, position + i * SNAPSHOT_ENTRY.size)
+                          for i in range(num_snapshots)]
+        self.events_offset = position + SNAPSHOT_ENTRY.size * num_snapshots
+        # Choices of every player and the round winner
+        self.event_size = num_players + 1
+
+    def check_match_number(self, match_number: int, last: int):
+        if not 1 <= match_number <= last:
+            raise ValueError(f'Game {self.game_id} has no match {match_number}')
+
+    def get_match(self, match_number: int) -> ReplayMatch:
+        self.check_match_number(match_number=match_number, last=self.matches)
+        start = self.events_offset + (match_number - 1) * self.event_size
+        event = self.buffer[start:start + self.event_size]
+        return ReplayMatch(
+            match_number=match_number,
+            choices=tuple(None if shape_id == NO_ID else shape_id for shape_id in event[:-1]),
+            round_winner=None if event[-1] == NO_ID else event[-1])
+
+    def get_state(self, match_number: int) -> CompactState:
+        # State before the match, from the nearest snapshot. The state after the last match follows it
+        self.check_match_number(match_number=match_number, last=self.matches + 1)
+        players = tuple(Player(name=name) for name in self.players)
+        index = bisect_right(self.snapshots, match_number, key=itemgetter(0)) - 1
+        if index < 0:
+            state, start = CompactState.create(config=self.game_config, players=players), 1
+        else:
+            start, snapshot_offset = self.snapshots[index]
+            state = decode_snapshot(
+                self.buffer, self.offset + snapshot_offset, game_config=self.game_config, players=players)
+        for number in range(start, match_number):
+            match = self.get_match(number)
+            state = state.played_match({player_id: match.choices[player_id] for player_id in state.get_active_ids()})
+        return state
+
+    def get_round_winners(self) -> list[int]:
+        # Every event's last byte, read with a single strided slice
+        start = self.events_offset + self.event_size - 1
+        winners = self.buffer[start:self.events_offset + self.event_size * self.matches:self.event_size]
+        return [winner for winner in winners if winner != NO_ID]
+
+    def get_winner(self) -> str | None:
+        round_winners = self.get_round_winners()
+        if len(round_winners) < self.game_config.rounds:
+            return None
+        win_counts = [0] * len(self.players)
+        for winner in round_winners:
+            win_counts[winner] += 1
+        return self.players[max(range(len(self.players)), key=win_counts.__getitem__)]
+
+
+class ReplayReader:
+    # Reads a log through a memory map, so only the pages of the games read are loaded
+
+    def __init__(self, path: str, game_config: GameConfig):
+        self.path = path
+        self.game_config = game_config
+        with open(path, 'rb') as log_file:
+            # Logs their writer has not flushed yet may be shorter than their header, and have no games to read
+            size = os.fstat(log_file.fileno()).st_size
+            self.buffer = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) if size >= len(LOG_MAGIC) else None
+        if self.buffer is None:
+            self.offsets = {}
+            return
+        if self.buffer[:len(LOG_MAGIC)] != LOG_MAGIC:
+            self.buffer.close()
+            raise ValueError(f'{path} is not a replay log')
+        self.offsets = self.load_index()
+
+    def __enter__(self) -> ReplayReader:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[GameReplay]:
+        for offset in self.offsets.values():
+            yield GameReplay(buffer=self.buffer, offset=offset, game_config=self.game_config)
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def load_index(self) -> dict[UUID, int]:
+        index_path = Path(self.path).with_suffix(INDEX_SUFFIX)
+        if index_path.exists():
+            index = index_path.read_bytes()
+            if index[:len(INDEX_MAGIC)] == INDEX_MAGIC:
+                return {UUID(bytes=game_id): offset
+                        for game_id, offset in INDEX_ENTRY.iter_unpack(index[len(INDEX_MAGIC):])}
+        # Logs still being written, or left by a crash, have no index and are scanned up to the last whole record
+        offsets = {}
+        offset = len(LOG_MAGIC)
+        while offset + GAME_HEADER.size <= len(self.buffer):
+            size, game_id = GAME_HEADER.unpack_from(self.buffer, offset)[:2]
+            if offset + size > len(self.buffer):
+                break
+            offsets[UUID(bytes=game_id)] = offset
+            offset += size
+        return offsets
+
+    def get_game(self, game_id: UUID | str) -> GameReplay:
+        offset = self.offsets.get(game_id if isinstance(game_id, UUID) else UUID(game_id))
+        if offset is None:
+            raise KeyError(f'Game {game_id} is not in {self.path}')
+        return GameReplay(buffer=self.buffer, offset=offset, game_config=self.game_config)
+
+
+def read_replays(directory: str, game_config: GameConfig) -> Iterator[GameReplay]:
+    # Logs are opened one at a time, and closed once their games have been read
+    for path in sorted(Path(directory).glob(f'*{LOG_SUFFIX}')):
+        with ReplayReader(path=str(path), game_config=game_config) as reader:
+            yield from reader
+
+
+class ReplayLog:
+    # Games are queued by game threads and appended to log files by a single writer thread. Every process writes
+    # its own files, and a file's index is written next to it once it is full or the log is closed
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, directory: str, game_config: GameConfig, snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL,
+                 max_file_size: int = DEFAULT_MAX_FILE_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.directory = directory
+        self.game_config = game_config
+        self.snapshot_interval = snapshot_interval
+        self.max_file_size = max_file_size
+        self.flush_interval = flush_interval
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.queue: SimpleQueue[GameRecord | None] = SimpleQueue()
+        self.writer = Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def put(self, record: GameRecord):
+        # Never blocks the caller
+        self.queue.put(record)
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    def open_file(self) -> tuple[BinaryIO, Path]:
+        path = Path(self.directory).joinpath(f'games-{int(time() * 1000)}-{os.getpid()}{LOG_SUFFIX}')
+        log_file = open(path, 'wb')
+        log_file.write(LOG_MAGIC)
+        return log_file, path
+
+    @staticmethod
+    def close_file(log_file: BinaryIO, path: Path, offsets: list[tuple[UUID, int]]):
+        log_file.close()
+        # Written next to the index and renamed, so readers never see a partial index
+        index_path = path.with_suffix(INDEX_SUFFIX)
+        temp_path = path.with_suffix(f'{INDEX_SUFFIX}.tmp')
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(INDEX_MAGIC)
+            index_file.write(b''.join(INDEX_ENTRY.pack(game_id.bytes, offset) for game_id, offset in offsets))
+        os.replace(temp_path, index_path)
+
+    def write_records(self):
+        log_file, path, offsets = None, None, []
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                # Buffered records reach the file once the queue has been idle for a while
+                if log_file is not None:
+                    log_file.flush()
+                continue
+            if record is None:
+                break
+            try:
+                payload = encode_game(
+                    record=record, game_config=self.game_config, snapshot_interval=self.snapshot_interval)
+                if log_file is None:
+                    log_file, path = self.open_file()
+                offset = log_file.tell()
+                log_file.write(payload)
+                offsets.append((UUID(record.game_id), offset))
+                if log_file.tell() >= self.max_file_size:
+                    self.close_file(log_file=log_file, path=path, offsets=offsets)
+                    log_file, path, offsets = None, None, []
+            except Exception as e:
+                # The writer keeps running, so one bad record does not stop the recording of later games
+                logging.error(f'[REPLAY] Lost game {record.game_id}: {e!r}')
+        if log_file is not None:
+            try:
+                self.close_file(log_file=log_file, path=path, offsets=offsets)
+            except OSError as e:
+                logging.error(f'[REPLAY] Could not write the index of {path}: {e!r}')
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import sqlite3
+from dataclasses import dataclass
+from json import dumps, loads
+from queue import Empty, SimpleQueue
+from threading import Thread
+
+
+@dataclass(frozen=True)
+class MatchRecord:
+    match_number: int
+    round: int
+    # Shape chosen by each player, in the order of the game's players, None if forfeited
+    choices: tuple[str | None, ...]
+
+
+@dataclass(frozen=True)
+class GameRecord:
+    game_id: str
+    players: tuple[str, ...]
+    winner: str
+    round_winners: tuple[str, ...]
+    matches: tuple[MatchRecord, ...]
+    started_at: float
+    finished_at: float
+
+
+class ResultsStore:
+    # Game results are queued by game threads and written in batches by a single writer thread
+
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 1.0
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS games ('
+        'game_id TEXT PRIMARY KEY, players TEXT NOT NULL, winner TEXT NOT NULL, round_winners TEXT NOT NULL, '
+        'matches TEXT NOT NULL, started_at REAL NOT NULL, finished_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS game_players ('
+        'player_name TEXT NOT NULL, finished_at REAL NOT NULL, game_id TEXT NOT NULL, seat INTEGER NOT NULL)',
+        # Games are written once, a game id written again is ignored
+        'CREATE UNIQUE INDEX IF NOT EXISTS game_players_by_game ON game_players (game_id, seat)',
+        'CREATE INDEX IF NOT EXISTS game_players_by_name ON game_players (player_name, finished_at, game_id)',
+        'CREATE INDEX IF NOT EXISTS games_by_time ON games (finished_at)'
+    ]
+
+    def __init__(self, path: str, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: SimpleQueue[GameRecord | None] = SimpleQueue()
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        conn.close()
+        self.writer = Thread(target=self.write_batches, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        # Durable at checkpoints only, which is enough for analytics
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def put(self, record: GameRecord):
+        # Never blocks the caller
+        self.queue.put(record)
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    def write_batches(self):
+        conn = self.connect()
+        closed = False
+        while not closed:
+            batch = []
+            try:
+                # Wait for a first record, then take whatever else is queued
+                record = self.queue.get(timeout=self.flush_interval)
+                while record is not None:
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        break
+                    record = self.queue.get_nowait()
+                closed = record is None
+            except Empty:
+                pass
+            if batch:
+                try:
+                    self.write(conn=conn, batch=batch)
+                except Exception as e:
+                    # The writer keeps running, so later results are still stored
+                    logging.error(f'[RESULTS] Lost {len(batch)} game results: {e!r}')
+        conn.close()
+
+    def write(self, conn: sqlite3.Connection, batch: list[GameRecord]):
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(record.game_id, dumps(record.players), record.winner, dumps(record.round_winners),
+                  dumps([[match.match_number, match.round, match.choices] for match in record.matches]),
+                  record.started_at, record.finished_at) for record in batch])
+            conn.executemany(
+                'INSERT OR IGNORE INTO game_players VALUES (?, ?, ?, ?)',
+                [(player_name, record.finished_at, record.game_id, seat)
+                 for record in batch for seat, player_name in enumerate(record.players)])
+
+    @staticmethod
+    def to_record(row: tuple) -> GameRecord:
+        game_id, players, winner, round_winners, matches, started_at, finished_at = row
+        return GameRecord(
+            game_id=game_id,
+            players=tuple(loads(players)),
+            winner=winner,
+            round_winners=tuple(loads(round_winners)),
+            matches=tuple(
+                MatchRecord(match_number=match_number, round=round, choices=tuple(choices))
+                for match_number, round, choices in loads(matches)),
+            started_at=started_at,
+            finished_at=finished_at
+        )
+
+    def query(self, sql: str, parameters: tuple) -> list[GameRecord]:
+        # Readers use their own connection and are not blocked by the writer in WAL mode
+        conn = self.connect()
+        try:
+            return [self.to_record(row) for row in conn.execute(sql, parameters)]
+        finally:
+            conn.close()
+
+    def get_player_history(self, player_name: str, limit: int = 100,
+                           before: tuple[float, str] | None = None) -> list[GameRecord]:
+        # Most recent games first, pages are requested with the finished_at and game_id of the last game as before,
+        # so games that finished at the same time are not skipped
+        finished_at, game_id = before if before is not None else (float('inf'), '')
+        return self.query(
+            'SELECT games.* FROM game_players JOIN games USING (game_id) '
+            'WHERE game_players.player_name = ? AND (game_players.finished_at, game_players.game_id) < (?, ?) '
+            'ORDER BY game_players.finished_at DESC, game_players.game_id DESC LIMIT ?',
+            (player_name, finished_at, game_id, limit))
+
+    def get_games(self, start: float, end: float, limit: int = 100) -> list[GameRecord]:
+        return self.query(
+            'SELECT * FROM games WHERE finished_at >= ? AND finished_at < ? ORDER BY finished_at LIMIT ?',
+            (start, end, limit))
@@ -1,10 +1,29 @@
+from typing import Literal
 from uuid import UUID
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class JoinRequest(BaseModel):
     player_name: str
+    encoding: Literal['json', 'binary'] = 'json'
+    delta: bool = False
+    # JSON frames carry a message type discriminator
+    typed: bool = False
+    # Games to play on this connection, 0 keeps the session open until the player leaves
+    games: int = Field(default=1, ge=0)
+
+
+class LeaveRequest(BaseModel):
+    # Ends an open session instead of joining another game
+    player_name: str
+    leave: bool = True
+
+
+class ServerBusyMessage(BaseModel):
+    # Sent as JSON instead of a JoinResponse when the server is saturated, before closing the connection
+    reason: str
+    retry_after_ms: int
 
 
 class JoinResponse(BaseModel):
@@ -12,6 +31,7 @@ class JoinResponse(BaseModel):
     players: list[str]
     game_id: UUID
     total_rounds: int
+    options: list[str] | None = None
 
 
 class PlayerChoiceInfo(BaseModel):
@@ -42,3 +62,17 @@ class PlayerChoiceResponse(PlayerChoiceBase):
 
 class EndOfGameMessage(GameStateInfo):
     winner: str
+
+
+class GameStateDelta(BaseModel):
+    current_round: int
+    new_winners: list[str]
+    player_choices: list[PlayerChoiceInfo]
+
+
+class PlayerChoiceDelta(PlayerChoiceBase, GameStateDelta):
+    pass
+
+
+class EndOfGameDelta(GameStateDelta):
+    winner: str
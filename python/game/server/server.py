@@ -1,39 +1,87 @@
 import logging
-from asyncio import Queue
+import signal
+from contextlib import suppress
+from dataclasses import replace
+from selectors import DefaultSelector, EVENT_READ
 from socket import socket, AF_INET, SOCK_STREAM
-from threading import Thread
-from uuid import uuid1, UUID
+from threading import Semaphore, Thread
+from time import monotonic, perf_counter
 
 from game.models.game_config import GameConfig
-from game.models.game_state import GameState
+from game.models.player import Player
 from game.models.shape import Shape
+from game.server.admission import CONNECTIONS, WAITING, AdmissionLimits
+from game.server.game import RANDOM, MatchRecorder, ServerGame
+from game.server.metrics import MetricsServer, ServerMetrics
+from game.server.matchmaking import Matchmaker, MatchmakingPolicy
+from game.server.ratings import RatingService
+from game.server.replay import ReplayLog
+from game.server.results import ResultsStore
 from game.server.models import PlayerConnection
-from game.server.schemas import JoinRequest, JoinResponse, \
-    PlayerChoiceRequest, PlayerChoiceResponse, PlayerChoiceInfo, EndOfGameMessage
+from game.server.schemas import JoinRequest, LeaveRequest, PlayerChoiceResponse
+from game.server.spectators import DEFAULT_QUEUE_SIZE, END, START, SpectatorHub, SpectatorServer
+from game.server.tracing import DECODE, DEFAULT_PROFILE_DIRECTORY, DEFAULT_PROFILE_INTERVAL, SEND, WAIT, \
+    GameProfiler
+from game.utils.codec import BINARY, JSON_CODEC, BinaryCodec
 from game.utils.logging import configure_logger
-from game.utils.protocol import encode
+from game.utils.protocol import RECV_SIZE, MessageReader, MessageWriter
 
 
 class GameServer:
 
     FORMAT = 'utf-8'
+    STATS_LOG_INTERVAL = 100
 
-    def __init__(self, host: str, port: int, game_config: GameConfig, verbose: bool = True):
-        self.server = socket(AF_INET, SOCK_STREAM)
+    def __init__(self, host: str, port: int, game_config: GameConfig, verbose: bool = True,
+                 matchmaking_policy: MatchmakingPolicy | None = None,
+                 snapshot_interval: int = ServerGame.DEFAULT_SNAPSHOT_INTERVAL,
+                 match_timeout: float | None = ServerGame.DEFAULT_MATCH_TIMEOUT, timeout_policy: str = RANDOM,
+                 log_sample_interval: int = ServerGame.DEFAULT_LOG_SAMPLE_INTERVAL, metrics_port: int | None = None,
+                 results_store: ResultsStore | None = None, ratings: RatingService | None = None,
+                 limits: AdmissionLimits = AdmissionLimits(), replay_log: ReplayLog | None = None,
+                 profile_interval: int | None = None, profile_directory: str = DEFAULT_PROFILE_DIRECTORY,
+                 spectator_port: int | None = None, spectator_queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.server: socket | None = None
         self.host = host
         self.port = port
-        self.server.bind((host, port))
-        self.queue = Queue[PlayerConnection]()
+        self.matchmaker = Matchmaker(policy=matchmaking_policy, group_size=game_config.num_players)
         self.game_config = game_config
-        self.active_connections = 0
+        self.snapshot_interval = snapshot_interval
+        self.match_timeout = match_timeout
+        self.timeout_policy = timeout_policy
+        self.log_sample_interval = log_sample_interval
+        self.match_recorder = MatchRecorder()
+        # Open connections are counted by a thread-safe gauge
+        self.metrics = ServerMetrics()
+        self.metrics_port = metrics_port
+        self.results_store = results_store
+        self.ratings = ratings
+        self.replay_log = replay_log
+        # Every profile_interval-th game is profiled if given, profiling can also be switched on with SIGUSR1
+        self.profiler = GameProfiler(
+            directory=profile_directory, interval=profile_interval or DEFAULT_PROFILE_INTERVAL,
+            enabled=profile_interval is not None)
+        # Games are streamed to spectators if a port is given
+        self.spectators = SpectatorHub(queue_size=spectator_queue_size, metrics=self.metrics) \
+            if spectator_port is not None else None
+        self.spectator_port = spectator_port
+        self.limits = limits
+        self.game_slots = Semaphore(limits.max_games) if limits.max_games is not None else None
         # Configure logger
         configure_logger(filename='server.log', level=logging.INFO if verbose else logging.WARNING)
         # Log start of server
         logging.info(f'[STARTING] Server is starting at {host, port}.')
 
     def start(self):
+        self.server = socket(AF_INET, SOCK_STREAM)
+        self.server.bind((self.host, self.port))
         self.server.listen()
         logging.info(f'[LISTENING] Server is listening on {self.host}.')
+        self.start_metrics()
+        self.start_spectators()
+        self.handle_profile_signal()
+        if self.ratings is not None:
+            self.ratings.start()
         # Handle server queue of waiting players
         queue_thread = Thread(target=self.handle_queue)
         queue_thread.start()
@@ -41,133 +89,253 @@ class GameServer:
             while True:
                 # Handle incoming requests
                 conn, addr = self.server.accept()
+                # Players over the connection cap are turned away without starting a thread. Connections are counted
+                # before their thread starts, so a burst of connections cannot exceed the cap
+                self.metrics.connections.inc()
+                if not self.limits.is_connection_allowed(self.metrics.active_connections.value):
+                    self.reply_busy(conn=conn, reason=CONNECTIONS)
+                    continue
+                self.metrics.active_connections.inc()
                 thread = Thread(target=self.handle_player, args=(conn, addr))
                 thread.start()
         except KeyboardInterrupt:
             self.server.close()
+            # Game threads keep running, so shutdown hooks are called here
+            if self.ratings is not None:
+                self.ratings.close()
             exit(0)
 
+    def handle_profile_signal(self):
+        # Handlers run on the main thread, which never holds the profiler's lock since it plays no games
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiling())
+
+    def toggle_profiling(self):
+        self.profiler.toggle()
+
+    def start_metrics(self):
+        self.metrics.queue_depth.function = lambda: len(self.matchmaker.policy)
+        if self.metrics_port is not None:
+            MetricsServer(metrics=self.metrics, host=self.host, port=self.metrics_port).start()
+
+    def start_spectators(self):
+        if self.spectators is not None:
+            self.metrics.spectators.function = lambda: len(self.spectators)
+            SpectatorServer(hub=self.spectators, host=self.host, port=self.spectator_port).start()
+
     def handle_player(self, conn: socket, addr: str):
-        self.active_connections += 1
+        reader = MessageReader(conn)
         # Read player request
-        request_raw = conn.recv(1024).decode(self.FORMAT)
-        request = JoinRequest.parse_raw(request_raw)
+        conn.settimeout(self.limits.join_timeout)
+        try:
+            request = JSON_CODEC.decode(reader.read_message(), JoinRequest)
+        except (ConnectionError, TimeoutError, ValueError) as e:
+            logging.warning(f'[REJECTED_CONNECTION] {addr}: {e!r}')
+            if isinstance(e, TimeoutError):
+                self.metrics.reaped_connections.inc()
+            else:
+                self.metrics.rejected_connections.inc()
+            conn.close()
+            self.metrics.active_connections.dec()
+            return
+        if not self.limits.is_join_allowed(len(self.matchmaker.policy)):
+            self.reply_busy(conn=conn, reason=WAITING)
+            self.metrics.active_connections.dec()
+            return
+        conn.settimeout(self.limits.idle_timeout)
         # Log connection
         logging.info(f'[NEW_CONNECTION] {request.player_name} {addr} connected.')
-        logging.info(f'[ACTIVE_CONNECTIONS] {self.active_connections}')
+        logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
+        # Frames after the join request use the negotiated encoding
+        reader.sized = request.encoding == BINARY
         # Add player to queue
-        player_conn = PlayerConnection(player_name=request.player_name, conn=conn, addr=addr)
-        self.queue.put_nowait(player_conn)
+        player_conn = PlayerConnection(
+            player_name=request.player_name, conn=conn, addr=addr, reader=reader, writer=MessageWriter(conn),
+            encoding=request.encoding, delta=request.delta, typed=request.typed, games=request.games)
+        self.matchmaker.put(player_conn)
+
+    def reply_busy(self, conn: socket, reason: str):
+        self.metrics.busy_replies[reason].inc()
+        # Never blocks, the reply fits in an empty send buffer
+        conn.setblocking(False)
+        with suppress(OSError):
+            conn.send(self.limits.get_busy_message(reason))
+        # Unread bytes would make closing reset the connection, discarding the reply
+        with suppress(OSError):
+            conn.recv(RECV_SIZE)
+        conn.close()
+
+    def handle_session(self, player_conn: PlayerConnection):
+        # Open sessions join another game or leave, on the connection and buffers of their previous game
+        codec = BinaryCodec() if player_conn.encoding == BINARY else JSON_CODEC
+        try:
+            request = codec.decode(player_conn.reader.read_message())
+            if not isinstance(request, (JoinRequest, LeaveRequest)):
+                raise ValueError(f'Expected JoinRequest or LeaveRequest, got {type(request).__name__}')
+        except (ConnectionError, TimeoutError, ValueError) as e:
+            logging.warning(f'[SESSION] {player_conn}: {e!r}')
+            if isinstance(e, TimeoutError):
+                self.metrics.reaped_connections.inc()
+            self.close_connection(player_conn)
+            return
+        if isinstance(request, LeaveRequest):
+            logging.info(f'[SESSION] {player_conn} left.')
+            self.close_connection(player_conn)
+            return
+        self.rejoin(replace(player_conn, games=request.games))
+
+    def continue_session(self, player_conn: PlayerConnection):
+        if player_conn.games == 0:
+            Thread(target=self.handle_session, args=(player_conn,)).start()
+        else:
+            self.rejoin(replace(player_conn, games=player_conn.games - 1))
+
+    def rejoin(self, player_conn: PlayerConnection):
+        # Sessions joining another game are turned away like new players when too many are waiting
+        if not self.limits.is_join_allowed(len(self.matchmaker.policy)):
+            self.reply_busy(conn=player_conn.conn, reason=WAITING)
+            self.metrics.active_connections.dec()
+            logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
+            return
+        self.matchmaker.put(player_conn)
+
+    def close_connection(self, player_conn: PlayerConnection):
+        player_conn.conn.close()
+        self.metrics.active_connections.dec()
+        logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
 
     def handle_queue(self):
         while True:
-            if self.queue.qsize() > 1:
-                player_conn1 = self.queue.get_nowait()
-                player_conn2 = self.queue.get_nowait()
-                thread = Thread(target=self.handle_game, args=(player_conn1, player_conn2))
-                thread.start()
+            self.acquire_game_slot()
+            # Block until the matchmaking policy groups enough waiting players for a game
+            player_conns = self.matchmaker.get_group()
+            thread = Thread(target=self.handle_game, args=(player_conns,))
+            thread.start()
+            self.log_matchmaking_stats()
 
-    def request_player_choice(
-            self, player_conn: PlayerConnection, game_id: UUID, match_number: int, game_state: GameState
-    ) -> Shape | None:
-        # Send request
-        request = PlayerChoiceRequest(
-            player_name=player_conn.player_name,
-            game_id=game_id,
-            match_number=match_number,
-            options=[shape.name for shape in self.game_config.rules.keys()],
-            current_round=game_state.current_round+1,
-            total_rounds=game_state.config.rounds,
-            past_winners=[player.name for player in game_state.past_winners],
-            player_choices=[
-                PlayerChoiceInfo(
-                    player_name=player.name, shape=player_state.choice.name if player_state.choice else None
-                ) for player, player_state in game_state.player_states.items()]
-        )
-        player_conn.conn.send(encode(request))
-        # Receive client response
-        response_raw = player_conn.conn.recv(1024).decode(self.FORMAT)
-        response = PlayerChoiceResponse.parse_raw(response_raw)
-        # Assert request and response match
-        if any([request.game_id != response.game_id,
-                request.match_number != response.match_number,
-                request.player_name != response.player_name]):
-            return None
-        # Parse response
-        for shape in self.game_config.rules.keys():
-            if shape.name == response.shape:
-                return shape
-
-    def handle_game(self, player_conn1: PlayerConnection, player_conn2: PlayerConnection):
-        players = [player_conn1.player_name, player_conn2.player_name]
-        game_id = uuid1()
-        logging.info(f'[{game_id}] New game created with {player_conn1} and {player_conn2})')
-        # Generate responses
-        response1 = JoinResponse(
-            player_name=player_conn1.player_name,
-            players=players, game_id=game_id,
-            total_rounds=self.game_config.rounds)
-        response2 = JoinResponse(
-            player_name=player_conn2.player_name,
-            players=players, game_id=game_id,
-            total_rounds=self.game_config.rounds)
-        # Send responses
-        player_conn1.conn.send(encode(response1))
-        player_conn2.conn.send(encode(response2))
-        # Get initial game state
-        game_state = GameState.get_initial_state(
-            config=self.game_config, player_names=[player_conn1.player_name, player_conn2.player_name])
-        # Map player objects to connections
-        players_map = {game_state.players[0]: player_conn1, game_state.players[1]: player_conn2}
-        # Run game
-        match_number = 1
-        while not game_state.is_finished():
-            # Request clients to each choose a shape
-            player_choices = {
-                player: self.request_player_choice(
-                    player_conn=player_conn,
-                    game_id=game_id,
-                    match_number=match_number,
-                    game_state=game_state
-                )
-                for player, player_conn in players_map.items()
-            }
-            # Log player choices
-            for player, shape in player_choices.items():
-                logging.info(f'[{game_id}] {players_map[player]} chooses {shape.name}.')
-            # Go to next game state with player choices
-            game_state = game_state.updated_player_choices(player_choices=player_choices)
-            game_state = game_state.get_next_state()
-            # Handle rounds
-            if game_state.is_end_of_round():
-                logging.info(f'[{game_id}] '
-                             f'{players_map[game_state.get_round_winner()]} wins round {game_state.current_round+1}.')
-                game_state = game_state.get_next_round().updated_player_choices(player_choices)
-            else:
-                tied_players = (", ".join([
-                    f"{players_map[player]} chose {game_state.player_states[player].choice.name}"
-                    for player in game_state.get_active_players()]))
-                logging.info(
-                    f'[{game_id}] tie: {tied_players}')
-            match_number += 1
-        # Inform winner
-        winner = players_map[game_state.get_winner()]
-        logging.info(f'[{game_id}] {winner} wins.')
-        end_request = EndOfGameMessage(
-            current_round=game_state.current_round,
-            total_rounds=game_state.config.rounds,
-            past_winners=[player.name for player in game_state.past_winners],
-            player_choices=[
-                PlayerChoiceInfo(
-                    player_name=player.name,
-                    shape=player_state.choice.name if player_state.choice else None
-                ) for player, player_state in game_state.player_states.items()],
-            winner=winner.player_name
-        )
-        player_conn1.conn.send(encode(end_request))
-        player_conn2.conn.send(encode(end_request))
-        # Close connections
-        player_conn1.conn.close()
-        player_conn2.conn.close()
-        self.active_connections -= 2
-        logging.info(f'[ACTIVE_CONNECTIONS] {self.active_connections}')
+    def acquire_game_slot(self):
+        # Groups are not formed while the most games are in progress, so running games keep their pace
+        if self.game_slots is not None:
+            self.game_slots.acquire()
+
+    def log_matchmaking_stats(self):
+        if self.matchmaker.recorder.groups_matched % self.STATS_LOG_INTERVAL == 0:
+            logging.info(f'[MATCHMAKING] {self.matchmaker.get_stats()}')
+            logging.info(f'[MATCHES] {self.match_recorder.get_stats()}')
+
+    def read_player_choice_response(
+            self, player_conn: PlayerConnection, request, game: ServerGame
+    ) -> PlayerChoiceResponse | None:
+        # Decode buffered frames until the response to the request arrives
+        message = player_conn.reader.next_message()
+        while message is not None:
+            response = game.decode(player_conn=player_conn, payload=message, schema_class=PlayerChoiceResponse)
+            # Skip late responses to matches that already timed out
+            if response.match_number >= request.match_number:
+                return response
+            message = player_conn.reader.next_message()
+        return None
+
+    def request_player_choices(self, game: ServerGame) -> dict[Player, Shape | None]:
+        started = monotonic()
+        deadline = started + self.match_timeout if self.match_timeout is not None else None
+        # Send every request before waiting for any response
+        requests, payloads = game.get_player_choice_requests()
+        with game.phase_times.span(SEND):
+            for player, payload in payloads.items():
+                game.players_map[player].writer.send(payload)
+        # Collect responses as they arrive
+        waited, decode_time = perf_counter(), game.phase_times.totals[DECODE]
+        player_choices = {}
+        with DefaultSelector() as selector:
+            for player, request in requests.items():
+                player_conn = game.players_map[player]
+                response = self.read_player_choice_response(player_conn=player_conn, request=request, game=game)
+                if response is None:
+                    selector.register(player_conn.conn, EVENT_READ, player)
+                else:
+                    player_choices[player] = game.parse_player_choice_response(request=request, response=response)
+            while len(player_choices) < len(requests):
+                timeout = deadline - monotonic() if deadline is not None else None
+                if timeout is not None and timeout <= 0:
+                    break
+                for key, _ in selector.select(timeout=timeout):
+                    player = key.data
+                    player_conn, request = game.players_map[player], requests[player]
+                    player_conn.reader.fill()
+                    response = self.read_player_choice_response(player_conn=player_conn, request=request, game=game)
+                    if response is not None:
+                        player_choices[player] = game.parse_player_choice_response(request=request, response=response)
+                        selector.unregister(player_conn.conn)
+        # Waiting is everything but the decoding in between
+        game.phase_times.add(WAIT, perf_counter() - waited - (game.phase_times.totals[DECODE] - decode_time))
+        # Replace missing or invalid choices
+        unanswered = [player for player in requests if player not in player_choices]
+        for player in requests:
+            if player_choices.get(player) is None:
+                player_choices[player] = game.get_fallback_choice(player=player)
+        game.record_match(latency=monotonic() - started, requested=list(requests), unanswered=unanswered)
+        return player_choices
+
+    def handle_game(self, player_conns: list[PlayerConnection]):
+        game = ServerGame(
+            game_config=self.game_config, player_conns=player_conns,
+            snapshot_interval=self.snapshot_interval, timeout_policy=self.timeout_policy,
+            match_recorder=self.match_recorder, log_sample_interval=self.log_sample_interval, metrics=self.metrics,
+            record_matches=self.results_store is not None or self.replay_log is not None, spectators=self.spectators)
+        self.metrics.game_started()
+        profile = self.profiler.start()
+        completed = False
+        sessions = []
+        game.log_event('start', players=[str(player_conn) for player_conn in game.player_conns])
+        game.publish_event(START, players=[player_conn.player_name for player_conn in game.player_conns],
+                           total_rounds=self.game_config.rounds)
+        try:
+            # Buffer responses, so they are sent along with the first request
+            for player, payload in game.get_join_responses().items():
+                game.players_map[player].writer.write(payload)
+            # Run game
+            while not game.is_finished():
+                # Request clients to each choose a shape
+                player_choices = self.request_player_choices(game=game)
+                game.play_match(player_choices=player_choices)
+            # Inform winner. Phase times are formatted now, since encoding the end of game messages adds to them
+            game.log_event('end', winner=game.get_winner().player_name, stats=game.recorder.get_stats(),
+                           phases=str(game.phase_times))
+            completed = True
+            record = game.get_record() if game.match_records is not None else None
+            if self.results_store is not None:
+                self.results_store.put(record)
+            if self.replay_log is not None:
+                self.replay_log.put(record)
+            for player_conn in game.player_conns:
+                end_request = game.get_end_of_game_message(player_conn=player_conn)
+                player_conn.writer.send(game.encode(player_conn=player_conn, message=end_request))
+            sessions = game.get_sessions()
+        except (ConnectionError, TimeoutError, ValueError) as e:
+            game.log_event('aborted', level=logging.WARNING, error=repr(e))
+        finally:
+            if profile is not None:
+                self.profiler.stop(profile=profile, game_id=game.game_id)
+            self.metrics.record_phases(game.phase_times)
+            # Aborted games have no winner
+            game.publish_event(END, winner=game.get_winner().player_name if completed else None)
+            # Close connections, except those of sessions with games left
+            for player_conn in game.player_conns:
+                if player_conn not in sessions:
+                    player_conn.conn.close()
+            self.end_game(
+                player_names=[player_conn.player_name for player_conn in game.player_conns],
+                winner=game.get_winner().player_name if completed else None, sessions=sessions)
+
+    def end_game(self, player_names: list[str], winner: str | None, sessions: list[PlayerConnection]):
+        # Winner is None for aborted games
+        self.metrics.game_finished(completed=winner is not None)
+        if self.game_slots is not None:
+            self.game_slots.release()
+        if winner is not None and self.ratings is not None:
+            self.ratings.record_game(player_names=player_names, winner=winner)
+        self.metrics.active_connections.dec(len(player_names) - len(sessions))
+        logging.info(f'[ACTIVE_CONNECTIONS] {self.metrics.active_connections.value}')
+        for player_conn in sessions:
+            self.continue_session(player_conn=player_conn)
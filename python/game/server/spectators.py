@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import logging
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from socket import socket
+from struct import Struct
+from threading import Event, Lock, Thread
+from uuid import UUID
+
+from game.server.metrics import ServerMetrics
+from game.utils.protocol import FORMAT
+
+
+# Events of a game, sent to spectators as newline terminated JSON documents
+START = 'start'
+MATCH = 'match'
+END = 'end'
+EVENTS = [START, MATCH, END]
+
+DEFAULT_QUEUE_SIZE = 256
+# Seconds between empty lines sent to idle spectators, which also finds out when they have left
+KEEPALIVE_INTERVAL = 15.0
+# Seconds a spectator may take to receive anything before it is disconnected
+WRITE_TIMEOUT = 30.0
+
+# Game id and event index of events relayed by worker processes, followed by the serialized event
+RELAY_HEADER = Struct('!16sB')
+MAX_RELAY_SIZE = 64 * 1024
+
+
+def encode_event(game_id: UUID, event: str, fields: dict) -> bytes:
+    return (dumps({'type': event, 'game_id': str(game_id), **fields}) + '\n').encode(FORMAT)
+
+
+class Subscriber:
+    # Bounded queue of the events sent to one spectator. Publishers never wait for the spectator: when the queue is
+    # full, a match event replaces the queued match of the same game, which it supersedes, or the oldest event
+    # is dropped
+
+    def __init__(self, game_id: UUID | None, queue_size: int = DEFAULT_QUEUE_SIZE):
+        # None follows every game
+        self.game_id = game_id
+        self.queue_size = queue_size
+        self.queue: deque[tuple[UUID, str, bytes]] = deque()
+        self.lock = Lock()
+        # Set while events are queued, which only costs publishers the first event the spectator is waiting for
+        self.ready = Event()
+        # Events the spectator missed since it was last sent any
+        self.missed = 0
+        # Set once the followed game has ended
+        self.closed = False
+
+    def put(self, game_id: UUID, event: str, payload: bytes) -> str | None:
+        # Returns whether the event was coalesced or an event was dropped, None if it was queued
+        with self.lock:
+            if self.closed:
+                return None
+            lost = None
+            if len(self.queue) >= self.queue_size:
+                last_game_id, last_event, _ = self.queue[-1]
+                if event == MATCH and last_event == MATCH and last_game_id == game_id:
+                    self.queue[-1] = (game_id, event, payload)
+                    self.missed += 1
+                    return 'coalesced'
+                self.queue.popleft()
+                self.missed += 1
+                lost = 'dropped'
+            self.queue.append((game_id, event, payload))
+            if event == END and game_id == self.game_id:
+                self.closed = True
+            if not self.ready.is_set():
+                self.ready.set()
+            return lost
+
+    def get(self, timeout: float | None = None) -> list[bytes] | None:
+        # Every queued event at once, an empty list if none arrived in time and None once the followed game has
+        # ended and its events were taken
+        self.ready.wait(timeout=timeout)
+        with self.lock:
+            if not self.queue:
+                return None if self.closed else []
+            payloads = [payload for _, _, payload in self.queue]
+            self.queue.clear()
+            # Stays set once the followed game has ended, so the next call returns at once
+            if not self.closed:
+                self.ready.clear()
+            if self.missed:
+                # Only slow spectators are told, so this is serialized for each of them
+                payloads.insert(0, (dumps({'type': 'missed', 'events': self.missed}) + '\n').encode(FORMAT))
+                self.missed = 0
+            return payloads
+
+
+class SpectatorHub:
+    # Fans out game events to spectators following one game or every game. Each event is serialized once and the
+    # same bytes are queued for every subscriber, without waiting for any of them
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE, metrics: ServerMetrics | None = None):
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self.lock = Lock()
+        # Replaced rather than changed, so they are checked without the lock
+        self.all_subscribers: tuple[Subscriber, ...] = ()
+        self.game_subscribers: dict[UUID, tuple[Subscriber, ...]] = {}
+        # Start and latest match events of games in progress, sent to spectators that subscribe during the game
+        self.started: dict[UUID, bytes] = {}
+        self.latest_matches: dict[UUID, bytes] = {}
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.all_subscribers) + sum(len(subscribers) for subscribers in self.game_subscribers.values())
+
+    def is_watched(self, game_id: UUID) -> bool:
+        # Match events nobody watches are not even built
+        return bool(self.all_subscribers) or game_id in self.game_subscribers
+
+    def publish(self, game_id: UUID, event: str, **fields):
+        if event == MATCH and not self.is_watched(game_id):
+            return
+        self.publish_payload(game_id=game_id, event=event, payload=encode_event(game_id, event, fields))
+
+    def publish_payload(self, game_id: UUID, event: str, payload: bytes):
+        # Spectators subscribing meanwhile get the event either with the game's latest events or from here
+        with self.lock:
+            subscribers = self.all_subscribers + self.game_subscribers.get(game_id, ())
+            if event == START:
+                self.started[game_id] = payload
+            elif event == MATCH:
+                self.latest_matches[game_id] = payload
+            else:
+                # Spectators of the game are closed by the event itself
+                self.started.pop(game_id, None)
+                self.latest_matches.pop(game_id, None)
+                self.game_subscribers.pop(game_id, None)
+        if self.metrics is not None:
+            self.metrics.spectator_events.inc()
+        for subscriber in subscribers:
+            lost = subscriber.put(game_id=game_id, event=event, payload=payload)
+            if lost is not None and self.metrics is not None:
+                self.metrics.spectator_lost_events[lost].inc()
+
+    def subscribe(self, game_id: UUID | None = None) -> Subscriber | None:
+        # None if the game is not in progress. New spectators first get the start and latest match of the games
+        # they follow
+        subscriber = Subscriber(game_id=game_id, queue_size=self.queue_size)
+        with self.lock:
+            if game_id is None:
+                game_ids = list(self.started)
+                self.all_subscribers += (subscriber,)
+            elif game_id in self.started:
+                game_ids = [game_id]
+                self.game_subscribers[game_id] = self.game_subscribers.get(game_id, ()) + (subscriber,)
+            else:
+                return None
+            # Queued before the lock is released, so they come before any event published afterwards
+            for started_id in game_ids:
+                subscriber.put(game_id=started_id, event=START, payload=self.started[started_id])
+            for started_id in game_ids:
+                if started_id in self.latest_matches:
+                    subscriber.put(game_id=started_id, event=MATCH, payload=self.latest_matches[started_id])
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            if subscriber.game_id is None:
+                self.all_subscribers = tuple(other for other in self.all_subscribers if other is not subscriber)
+            elif subscriber.game_id in self.game_subscribers:
+                subscribers = tuple(
+                    other for other in self.game_subscribers[subscriber.game_id] if other is not subscriber)
+                if subscribers:
+                    self.game_subscribers[subscriber.game_id] = subscribers
+                else:
+                    del self.game_subscribers[subscriber.game_id]
+
+    def read_relay(self, channel: socket):
+        # Publishes the events a worker process relays, without serializing them again
+        while True:
+            message = channel.recv(MAX_RELAY_SIZE)
+            if not message:
+                return
+            game_id, event = RELAY_HEADER.unpack_from(message)
+            self.publish_payload(game_id=UUID(bytes=game_id), event=EVENTS[event], payload=message[RELAY_HEADER.size:])
+
+
+class SpectatorRelay:
+    # Sends the events of a worker process's games to the hub of the acceptor process. Workers do not know who
+    # watches, so every event is serialized, and events are dropped rather than waiting for the acceptor
+
+    def __init__(self, channel: socket):
+        self.channel = channel
+        self.channel.setblocking(False)
+        self.lock = Lock()
+        self.dropped = 0
+
+    def is_watched(self, game_id: UUID) -> bool:
+        return True
+
+    def publish(self, game_id: UUID, event: str, **fields):
+        message = RELAY_HEADER.pack(game_id.bytes, EVENTS.index(event)) + encode_event(game_id, event, fields)
+        try:
+            self.channel.send(message)
+        except BlockingIOError:
+            with self.lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped & (dropped - 1) == 0:
+                logging.warning(f'[SPECTATORS] Dropped {dropped} events the acceptor process was too busy to take.')
+        except OSError as e:
+            logging.warning(f'[SPECTATORS] Could not relay an event: {e!r}')
+
+
+class SpectatorServer:
+    # Streams game events over HTTP from a daemon thread, every game at /games and one game at /games/<game_id>
+
+    def __init__(self, hub: SpectatorHub, host: str, port: int):
+        self.hub = hub
+        spectator_server = self
+
+        class SpectatorHandler(BaseHTTPRequestHandler):
+            # Sends that take longer raise a timeout, so spectators that stop reading only hold their own thread
+            timeout = WRITE_TIMEOUT
+
+            def do_GET(self):
+                path = self.path.split('?')[0].rstrip('/')
+                try:
+                    game_id = None if path == '/games' else UUID(path.removeprefix('/games/'))
+                except ValueError:
+                    self.send_error(404)
+                    return
+                subscriber = spectator_server.hub.subscribe(game_id=game_id)
+                if subscriber is None:
+                    self.send_error(404, 'Game is not in progress')
+                    return
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    while True:
+                        payloads = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                        if payloads is None:
+                            break
+                        self.wfile.write(b''.join(payloads) if payloads else b'\n')
+                except OSError:
+                    pass
+                finally:
+                    spectator_server.hub.unsubscribe(subscriber)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), SpectatorHandler)
+        self.http_server.daemon_threads = True
+
+    def start(self):
+        Thread(target=self.http_server.serve_forever, daemon=True).start()
+        logging.info(f'[SPECTATORS] Games are streamed on {self.http_server.server_address}/games.')
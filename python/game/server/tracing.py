@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import cProfile
+import logging
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+
+
+# Phases of a match: building and encoding choice requests, sending them, waiting for responses, decoding them
+# and updating the game state
+BUILD = 'build'
+ENCODE = 'encode'
+SEND = 'send'
+WAIT = 'wait'
+DECODE = 'decode'
+STATE = 'state'
+PHASES = [BUILD, ENCODE, SEND, WAIT, DECODE, STATE]
+
+DEFAULT_PROFILE_INTERVAL = 100
+DEFAULT_PROFILE_DIRECTORY = 'profiles'
+
+
+class Span:
+    # Adds the time spent in a with block to a phase
+
+    __slots__ = ('phase_times', 'phase', 'started')
+
+    def __init__(self, phase_times: PhaseTimes, phase: str):
+        self.phase_times = phase_times
+        self.phase = phase
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.phase_times.add(self.phase, perf_counter() - self.started)
+
+
+class PhaseTimes:
+    # Time spent in each phase of one game. Only the game's thread or task adds to it, so there is no lock
+
+    __slots__ = ('totals', 'counts')
+
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase: str, seconds: float):
+        self.totals[phase] += seconds
+        self.counts[phase] += 1
+
+    def span(self, phase: str) -> Span:
+        return Span(phase_times=self, phase=phase)
+
+    def __str__(self) -> str:
+        return ','.join(f'{phase}:{total:.4f}' for phase, total in self.totals.items())
+
+
+class GameProfiler:
+    # Runs cProfile on every interval-th game and dumps its stats to directory/<game_id>.prof.
+    # Only one game is profiled at a time, and profiling can be switched on and off while the server runs
+
+    def __init__(self, directory: str = DEFAULT_PROFILE_DIRECTORY, interval: int = DEFAULT_PROFILE_INTERVAL,
+                 enabled: bool = False):
+        if interval < 1:
+            raise ValueError('Profile interval must be at least 1.')
+        self.directory = directory
+        self.interval = interval
+        self.enabled = enabled
+        self.lock = Lock()
+        self.games = 0
+        self.profiling = False
+
+    def toggle(self) -> bool:
+        with self.lock:
+            self.enabled = not self.enabled
+            self.games = 0
+        logging.warning(f'[PROFILE] Profiling every {self.interval} games is {"on" if self.enabled else "off"}.')
+        return self.enabled
+
+    def start(self) -> cProfile.Profile | None:
+        # Returns the profile of the game, None if it is not profiled
+        with self.lock:
+            if not self.enabled:
+                return None
+            self.games += 1
+            if self.profiling or (self.games - 1) % self.interval:
+                return None
+            self.profiling = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, game_id):
+        profile.disable()
+        with self.lock:
+            self.profiling = False
+        path = Path(self.directory).joinpath(f'{game_id}.prof')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as e:
+            logging.error(f'[PROFILE] Could not write {path}: {e!r}')
+            return
+        logging.info(f'[PROFILE] Wrote {path}.')
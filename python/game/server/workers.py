@@ -0,0 +1,277 @@
+import logging
+import multiprocessing
+import os
+import signal
+from base64 import b64decode, b64encode
+from json import dumps, loads
+from logging.handlers import QueueHandler
+from socket import AF_UNIX, SOCK_SEQPACKET, recv_fds, send_fds, socket, socketpair
+from threading import Lock, Thread
+
+from game.models.game_config import GameConfig
+from game.server.admission import AdmissionLimits
+from game.server.game import RANDOM, ServerGame
+from game.server.metrics import ServerMetrics
+from game.server.models import PlayerConnection
+from game.server.replay import ReplayLog
+from game.server.results import ResultsStore
+from game.server.server import GameServer
+from game.server.spectators import SpectatorRelay
+from game.server.tracing import DEFAULT_PROFILE_DIRECTORY, DEFAULT_PROFILE_INTERVAL, GameProfiler
+from game.utils.codec import BINARY
+from game.utils.protocol import MessageReader, MessageWriter
+
+
+# Largest handoff message, which carries bytes players sent after their join request
+MAX_HANDOFF_SIZE = 256 * 1024
+# Most file descriptors one message can carry on linux, which caps the players of a game in worker mode
+MAX_HANDOFF_FDS = 253
+
+
+def get_handoff_players(player_conns: list[PlayerConnection]) -> list[dict]:
+    # Connections are sent as file descriptors alongside, in the same order
+    return [{
+        'player_name': player_conn.player_name,
+        'addr': player_conn.addr,
+        'encoding': player_conn.encoding,
+        'delta': player_conn.delta,
+        'typed': player_conn.typed,
+        'games': player_conn.games,
+        'buffer': b64encode(player_conn.reader.buffer[player_conn.reader.offset:]).decode('ascii')
+    } for player_conn in player_conns]
+
+
+def get_player_conns(players: list[dict], fds: list[int], timeout: float | None = None) -> list[PlayerConnection]:
+    player_conns = []
+    for player, fd in zip(players, fds):
+        conn = socket(fileno=fd)
+        # Received sockets share the blocking mode of the sender's, so their timeout is set again
+        conn.settimeout(timeout)
+        reader = MessageReader(conn, sized=player['encoding'] == BINARY)
+        reader.buffer += b64decode(player['buffer'])
+        player_conns.append(PlayerConnection(
+            player_name=player['player_name'], conn=conn, addr=tuple(player['addr']), reader=reader,
+            writer=MessageWriter(conn), encoding=player['encoding'], delta=player['delta'], typed=player['typed'],
+            games=player['games']))
+    return player_conns
+
+
+def encode_handoff(player_conns: list[PlayerConnection]) -> bytes:
+    return dumps(get_handoff_players(player_conns)).encode('utf-8')
+
+
+def decode_handoff(message: bytes, fds: list[int], timeout: float | None = None) -> list[PlayerConnection]:
+    return get_player_conns(players=loads(message), fds=fds, timeout=timeout)
+
+
+class GameWorker(GameServer):
+    # Plays games on connections received from the acceptor process and reports how they ended. Players are accepted,
+    # matched and rated by the acceptor process, so only what games need is set up here
+
+    def __init__(self, channel: socket, game_config: GameConfig, limits: AdmissionLimits,
+                 snapshot_interval: int = ServerGame.DEFAULT_SNAPSHOT_INTERVAL,
+                 match_timeout: float | None = ServerGame.DEFAULT_MATCH_TIMEOUT, timeout_policy: str = RANDOM,
+                 log_sample_interval: int = ServerGame.DEFAULT_LOG_SAMPLE_INTERVAL,
+                 results_store: ResultsStore | None = None, replay_log: ReplayLog | None = None,
+                 profile_interval: int | None = None, profile_directory: str = DEFAULT_PROFILE_DIRECTORY,
+                 spectator_channel: socket | None = None):
+        self.channel = channel
+        self.channel_lock = Lock()
+        self.game_config = game_config
+        self.limits = limits
+        self.snapshot_interval = snapshot_interval
+        self.match_timeout = match_timeout
+        self.timeout_policy = timeout_policy
+        self.log_sample_interval = log_sample_interval
+        # Matches are summed up by the acceptor process, from the metrics reported with each game
+        self.match_recorder = None
+        self.metrics = ServerMetrics()
+        self.results_store = results_store
+        self.replay_log = replay_log
+        self.ratings = None
+        self.profiler = GameProfiler(
+            directory=profile_directory, interval=profile_interval or DEFAULT_PROFILE_INTERVAL,
+            enabled=profile_interval is not None)
+        # Events of the games are streamed to spectators by the acceptor process
+        self.spectators = SpectatorRelay(channel=spectator_channel) if spectator_channel is not None else None
+
+    def start(self):
+        logging.info(f'[WORKER] Worker {multiprocessing.current_process().name} is ready.')
+        self.handle_profile_signal()
+        while True:
+            message, fds, _, _ = recv_fds(self.channel, MAX_HANDOFF_SIZE, MAX_HANDOFF_FDS)
+            # Acceptor has exited
+            if not message:
+                break
+            player_conns = decode_handoff(message=message, fds=fds, timeout=self.limits.idle_timeout)
+            Thread(target=self.handle_game, args=(player_conns,)).start()
+
+    def end_game(self, player_names: list[str], winner: str | None, sessions: list[PlayerConnection]):
+        # Sessions go back to the acceptor process, which queues them for their next game. Match metrics are only
+        # served by the acceptor process, so their changes are reported along
+        try:
+            with self.channel_lock:
+                report = dumps({'player_names': player_names, 'winner': winner,
+                                'sessions': get_handoff_players(sessions), 'metrics': self.metrics.take_match_deltas()})
+                send_fds(self.channel, [report.encode('utf-8')],
+                         [player_conn.conn.fileno() for player_conn in sessions])
+        finally:
+            for player_conn in sessions:
+                player_conn.conn.close()
+
+
+def run_worker(channel: socket, options: dict, results_db: str | None, replay_directory: str | None,
+               spectator_channel: socket | None, log_queue: multiprocessing.Queue, log_level: int):
+    # Records are written by the acceptor process, so workers do not open the log file themselves
+    logging.basicConfig(level=log_level, handlers=[QueueHandler(log_queue)])
+    # Storage threads cannot be sent to a process, so each worker opens the results database and its own replay
+    # log files itself
+    results_store = ResultsStore(path=results_db) if results_db is not None else None
+    replay_log = ReplayLog(directory=replay_directory, game_config=options['game_config']) \
+        if replay_directory is not None else None
+    try:
+        GameWorker(channel=channel, spectator_channel=spectator_channel, results_store=results_store,
+                   replay_log=replay_log, **options).start()
+    except KeyboardInterrupt:
+        pass
+
+
+class MultiProcessGameServer(GameServer):
+    # Accepts and matches players in this process, games are played by worker processes
+
+    def __init__(self, workers: int, **kwargs):
+        super().__init__(**kwargs)
+        self.workers = workers
+        self.channels: list[socket] = []
+        self.processes: list[multiprocessing.Process] = []
+        # Player names of the games in progress on each worker, new games go to the least busy live one
+        self.worker_games: list[list[list[str]]] = []
+        self.live_workers: list[int] = []
+        self.workers_lock = Lock()
+        self.log_queue: multiprocessing.Queue | None = None
+
+    def start(self):
+        self.start_workers()
+        super().start()
+
+    def get_worker_options(self) -> dict:
+        return {
+            'game_config': self.game_config,
+            'snapshot_interval': self.snapshot_interval,
+            'match_timeout': self.match_timeout,
+            'timeout_policy': self.timeout_policy,
+            'log_sample_interval': self.log_sample_interval,
+            'limits': self.limits,
+            'profile_interval': self.profiler.interval if self.profiler.enabled else None,
+            'profile_directory': self.profiler.directory
+        }
+
+    def start_workers(self):
+        # Spawned rather than forked, since this process already runs logging and storage threads
+        context = multiprocessing.get_context('spawn')
+        self.log_queue = context.Queue()
+        Thread(target=self.write_worker_logs, daemon=True).start()
+        for i in range(self.workers):
+            channel, worker_channel = socketpair(AF_UNIX, SOCK_SEQPACKET)
+            results_db = self.results_store.path if self.results_store is not None else None
+            replay_directory = self.replay_log.directory if self.replay_log is not None else None
+            spectator_channel, worker_spectator_channel = socketpair(AF_UNIX, SOCK_SEQPACKET) \
+                if self.spectators is not None else (None, None)
+            process = context.Process(
+                target=run_worker, name=f'worker{i}',
+                args=(worker_channel, self.get_worker_options(), results_db, replay_directory,
+                      worker_spectator_channel, self.log_queue, logging.getLogger().getEffectiveLevel()), daemon=True)
+            process.start()
+            worker_channel.close()
+            if spectator_channel is not None:
+                worker_spectator_channel.close()
+                Thread(target=self.spectators.read_relay, args=(spectator_channel,), daemon=True).start()
+            self.processes.append(process)
+            self.add_worker(channel=channel)
+        logging.info(f'[WORKERS] Started {self.workers} worker processes.')
+
+    def add_worker(self, channel: socket):
+        worker = len(self.channels)
+        self.channels.append(channel)
+        self.worker_games.append([])
+        self.live_workers.append(worker)
+        Thread(target=self.read_reports, args=(worker,), daemon=True).start()
+
+    def remove_worker(self, worker: int):
+        # Games in progress on the worker ended with it, since it held the only copies of their connections
+        with self.workers_lock:
+            self.live_workers.remove(worker)
+            games, self.worker_games[worker] = self.worker_games[worker], []
+        self.channels[worker].close()
+        logging.error(f'[WORKERS] Worker {worker} exited, {len(games)} games in progress were aborted. '
+                      f'{len(self.live_workers)} workers are left.')
+        for player_names in games:
+            self.end_game(player_names=player_names, winner=None, sessions=[])
+
+    def write_worker_logs(self):
+        # Records of the workers go through the handlers of this process, to the same log file
+        while True:
+            record = self.log_queue.get()
+            logging.getLogger(record.name).handle(record)
+
+    def toggle_profiling(self):
+        # Games are played, and profiled, by the workers
+        super().toggle_profiling()
+        for process in self.processes:
+            os.kill(process.pid, signal.SIGUSR1)
+
+    def handle_queue(self):
+        while True:
+            self.acquire_game_slot()
+            player_conns = self.matchmaker.get_group()
+            self.hand_off(player_conns=player_conns)
+            self.log_matchmaking_stats()
+
+    def hand_off(self, player_conns: list[PlayerConnection]):
+        player_names = [player_conn.player_name for player_conn in player_conns]
+        self.metrics.game_started()
+        with self.workers_lock:
+            worker = min(self.live_workers, key=lambda live_worker: len(self.worker_games[live_worker]), default=None)
+            if worker is not None:
+                self.worker_games[worker].append(player_names)
+        try:
+            if worker is None:
+                raise ConnectionError('Every worker process has exited')
+            message = encode_handoff(player_conns=player_conns)
+            send_fds(self.channels[worker], [message], [player_conn.conn.fileno() for player_conn in player_conns])
+        except OSError as e:
+            logging.warning(f'[WORKERS] Could not hand off a game to worker {worker}: {e!r}')
+            if worker is None:
+                self.end_game(player_names=player_names, winner=None, sessions=[])
+            else:
+                self.report_game(worker=worker, player_names=player_names, winner=None, sessions=[])
+        finally:
+            # Worker received its own copies of the connections
+            for player_conn in player_conns:
+                player_conn.conn.close()
+
+    def read_reports(self, worker: int):
+        channel = self.channels[worker]
+        while True:
+            # Workers that exit with games left unread reset the channel
+            try:
+                message, fds, _, _ = recv_fds(channel, MAX_HANDOFF_SIZE, MAX_HANDOFF_FDS)
+            except ConnectionError:
+                message = None
+            if not message:
+                self.remove_worker(worker)
+                return
+            report = loads(message)
+            self.metrics.add_match_deltas(report['metrics'])
+            self.report_game(worker=worker, player_names=report['player_names'], winner=report['winner'],
+                             sessions=get_player_conns(
+                                 players=report['sessions'], fds=fds, timeout=self.limits.idle_timeout))
+
+    def report_game(self, worker: int, player_names: list[str], winner: str | None,
+                    sessions: list[PlayerConnection]):
+        with self.workers_lock:
+            # Games of a worker that exited were already ended
+            if player_names not in self.worker_games[worker]:
+                return
+            self.worker_games[worker].remove(player_names)
+        self.end_game(player_names=player_names, winner=winner, sessions=sessions)
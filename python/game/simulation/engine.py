@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from random import Random
+from typing import Iterator
+
+from game.models.compact_state import CompactState
+from game.models.game_config import GameConfig
+from game.models.player import Player
+from game.simulation.models import ChoiceInfo, ChoiceRequest, GameResult, SimulationStats
+from game.simulation.strategies import STRATEGIES
+
+
+DEFAULT_MAX_MATCHES = 1000
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_player_names(strategies: tuple[str, ...]) -> list[str]:
+    return [f'{strategy}{i+1}' for i, strategy in enumerate(strategies)]
+
+
+def simulate_game(game_config: GameConfig, strategies: tuple[str, ...], rng: Random,
+                  max_matches: int = DEFAULT_MAX_MATCHES) -> GameResult:
+    # Plays the matches of a ServerGame directly on the game state, one strategy object per seat
+    player_names = get_player_names(strategies)
+    players = [
+        STRATEGIES[strategy](player_name=player_name, total_rounds=game_config.rounds, game_config=game_config, rng=rng)
+        for strategy, player_name in zip(strategies, player_names)
+    ]
+    options = [shape.name for shape in game_config.shapes]
+    option_ids = {option: i for i, option in enumerate(options)}
+    state = CompactState.create(config=game_config, players=tuple(Player(name=name) for name in player_names))
+    forfeits = 0
+    match_number = 1
+    while not state.is_finished() and match_number <= max_matches:
+        # Only players still in the round are asked, like the server does
+        active_ids = state.get_active_ids()
+        past_winners = [player_names[player_id] for player_id in state.winners]
+        player_choices = [
+            ChoiceInfo(player_name=player_name, shape=options[shape_id] if shape_id is not None else None)
+            for player_name, shape_id in zip(player_names, state.choices)
+        ]
+        choices = {}
+        for player_id in active_ids:
+            player, player_name = players[player_id], player_names[player_id]
+            player.add_request_content(ChoiceRequest(
+                player_name=player_name, match_number=match_number, current_round=state.current_round + 1,
+                total_rounds=game_config.rounds, past_winners=past_winners, player_choices=player_choices,
+                options=options))
+            choices[player_id] = option_ids.get(player.decide())
+        # Invalid choices forfeit, unless nobody still in the round made a valid one
+        forfeit_ids = [player_id for player_id in active_ids if choices[player_id] is None]
+        if len(forfeit_ids) == len(active_ids):
+            choices.update({player_id: rng.randrange(len(options)) for player_id in forfeit_ids})
+            forfeit_ids = []
+        forfeits += len(forfeit_ids)
+        state = state.played_match(choices)
+        match_number += 1
+    return GameResult(winner=state.get_winner(), matches=match_number - 1, forfeits=forfeits)
+
+
+def simulate_batch(game_config: GameConfig, strategies: tuple[str, ...], seed: str, num_games: int,
+                   max_matches: int = DEFAULT_MAX_MATCHES) -> SimulationStats:
+    rng = Random(seed)
+    return SimulationStats.from_results(strategies=strategies, results=[
+        simulate_game(game_config=game_config, strategies=strategies, rng=rng, max_matches=max_matches)
+        for _ in range(num_games)
+    ])
+
+
+def run_simulation(game_config: GameConfig, strategies: tuple[str, ...], num_games: int, seed: int = 0,
+                   workers: int | None = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                   max_matches: int = DEFAULT_MAX_MATCHES) -> Iterator[SimulationStats]:
+    # Yields running totals as batches finish. Every batch has its own seed, so totals
+    # only depend on the seed, not on the number of workers or the order batches finish in
+    for strategy in strategies:
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown strategy {strategy}')
+    if len(strategies) != game_config.num_players:
+        raise ValueError(f'Invalid number of players: there must be exactly {game_config.num_players} players.')
+    stats = SimulationStats.from_results(strategies=strategies, results=[])
+    batches = [(f'{seed}:{start}', min(batch_size, num_games - start)) for start in range(0, num_games, batch_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(simulate_batch, game_config, strategies, batch_seed, batch_games, max_matches)
+            for batch_seed, batch_games in batches
+        ]
+        for future in as_completed(futures):
+            stats = stats.merged(future.result())
+            yield stats
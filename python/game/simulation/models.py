@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ChoiceInfo:
+    player_name: str
+    shape: str | None
+
+
+@dataclass(frozen=True)
+class ChoiceRequest:
+    # Same fields strategies read from a PlayerChoiceRequest, without validation
+    player_name: str
+    match_number: int
+    current_round: int
+    total_rounds: int
+    past_winners: list[str]
+    player_choices: list[ChoiceInfo]
+    options: list[str]
+
+
+@dataclass(frozen=True)
+class GameResult:
+    # Winner is the seat index of the winning player, None if the game hit the match limit
+    winner: int | None
+    matches: int
+    forfeits: int
+
+
+@dataclass(frozen=True)
+class SimulationStats:
+    strategies: tuple[str, ...]
+    games: int = 0
+    aborted: int = 0
+    matches: int = 0
+    forfeits: int = 0
+    wins: tuple[int, ...] = ()
+
+    @staticmethod
+    def from_results(strategies: tuple[str, ...], results: list[GameResult]) -> SimulationStats:
+        wins = [0] * len(strategies)
+        for result in results:
+            if result.winner is not None:
+                wins[result.winner] += 1
+        return SimulationStats(
+            strategies=strategies,
+            games=len(results),
+            aborted=sum(1 for result in results if result.winner is None),
+            matches=sum(result.matches for result in results),
+            forfeits=sum(result.forfeits for result in results),
+            wins=tuple(wins)
+        )
+
+    def merged(self, other: SimulationStats) -> SimulationStats:
+        return SimulationStats(
+            strategies=self.strategies,
+            games=self.games + other.games,
+            aborted=self.aborted + other.aborted,
+            matches=self.matches + other.matches,
+            forfeits=self.forfeits + other.forfeits,
+            wins=tuple(a + b for a, b in zip(self.wins, other.wins))
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'games': self.games,
+            'aborted': self.aborted,
+            'matches': self.matches,
+            'forfeits': self.forfeits,
+            'wins': [
+                {'seat': i, 'strategy': strategy, 'wins': wins,
+                 'win_rate': wins / self.games if self.games else 0.0}
+                for i, (strategy, wins) in enumerate(zip(self.strategies, self.wins))
+            ]
+        }
@@ -0,0 +1,29 @@
+from functools import partial
+from random import Random
+
+from game.client.bot import BOT_STRATEGIES, GameBot
+from game.models.game_config import GameConfig
+
+
+class RandomStrategy:
+    # Ignores the game and picks a uniformly random shape
+
+    def __init__(self, player_name: str, total_rounds: int, game_config: GameConfig, rng: Random):
+        self.player_name = player_name
+        self.options = [shape.name for shape in game_config.get_shapes()]
+        self.rng = rng
+
+    def add_request_content(self, request):
+        pass
+
+    def decide(self) -> str:
+        return self.rng.choice(self.options)
+
+
+# Strategies take the GameBot constructor arguments and are looked up by name so
+# they can be sent to worker processes
+STRATEGIES = {
+    'bot': GameBot,
+    'random': RandomStrategy,
+    **{strategy: partial(GameBot, strategy=strategy) for strategy in BOT_STRATEGIES}
+}
@@ -0,0 +1,26 @@
+from unittest import TestCase, main
+
+from game.server.admission import CONNECTIONS, AdmissionLimits
+from game.server.schemas import ServerBusyMessage
+from game.utils.codec import JSON_CODEC
+
+
+class TestAdmissionLimits(TestCase):
+
+    def test_limits(self):
+        limits = AdmissionLimits(max_connections=2, max_waiting=0)
+        self.assertTrue(limits.is_connection_allowed(1))
+        self.assertFalse(limits.is_connection_allowed(2))
+        self.assertFalse(limits.is_join_allowed(0))
+        # No limits by default
+        self.assertTrue(AdmissionLimits().is_connection_allowed(10 ** 6))
+        self.assertTrue(AdmissionLimits().is_join_allowed(10 ** 6))
+
+    def test_busy_message(self):
+        payload = AdmissionLimits(retry_after=0.25).get_busy_message(CONNECTIONS)
+        self.assertTrue(payload.endswith(b'\n'))
+        self.assertEqual(JSON_CODEC.decode(payload[:-1]), ServerBusyMessage(reason=CONNECTIONS, retry_after_ms=250))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+from pathlib import Path
+from socket import socket
+from unittest import TestCase, main
+
+from game.client.swarm import BotSwarm, get_swarm_summary
+from game.models.game_config import GameConfig
+from game.server.async_server import AsyncGameServer
+from game.server.ratings import RatingService
+
+
+def get_free_port() -> int:
+    with socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class TestAsyncGameServer(TestCase):
+
+    def setUp(self):
+        self.config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+
+    async def play_game(self, server: AsyncGameServer) -> dict:
+        serving = asyncio.create_task(server.serve())
+        try:
+            # Wait until the server listens
+            for _ in range(100):
+                try:
+                    _, writer = await asyncio.open_connection(server.host, server.port)
+                except ConnectionError:
+                    await asyncio.sleep(0.05)
+                    continue
+                writer.close()
+                break
+            swarm = BotSwarm(host=server.host, port=server.port, game_config=self.config, strategies=['random'],
+                             read_timeout=10, seed=0)
+            summary = get_swarm_summary(await swarm.run(players=2))
+            # Games end on the server after the players are told the winner
+            for _ in range(100):
+                if server.metrics.games_completed.value:
+                    break
+                await asyncio.sleep(0.05)
+            return summary
+        finally:
+            serving.cancel()
+
+    def test_game(self):
+        ratings = RatingService()
+        server = AsyncGameServer(host='127.0.0.1', port=get_free_port(), game_config=self.config, verbose=False,
+                                 ratings=ratings)
+        summary = asyncio.run(self.play_game(server))
+        self.assertEqual(summary['games_completed'], 1)
+        self.assertEqual(summary['players_finished'], 2)
+        self.assertEqual(summary['errors'], {})
+        self.assertEqual(server.metrics.games_completed.value, 1)
+        self.assertEqual(server.metrics.active_connections.value, 0)
+        # The game is rated once it ended, like on the threaded server
+        self.assertEqual(sorted(rating.player_name for rating in ratings.get_top(2)), ['SwarmBot0', 'SwarmBot1'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from pathlib import Path
+from random import Random
+from unittest import TestCase, main
+
+from game.client.bot import COUNTER, FREQUENCY, MARKOV, GameBot, ShapeCounts
+from game.models.compact_state import CompactState
+from game.models.game_config import GameConfig
+from game.models.player import Player
+from game.simulation.engine import simulate_game
+from game.simulation.models import ChoiceInfo, ChoiceRequest
+
+
+class TestGameBot(TestCase):
+
+    @staticmethod
+    def load_game_config() -> GameConfig:
+        json_path = Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json')
+        return GameConfig.load(path=json_path)
+
+    @staticmethod
+    def get_request(match_number: int, opponent_shape: str | None) -> ChoiceRequest:
+        return ChoiceRequest(
+            player_name='Bot', match_number=match_number, current_round=match_number, total_rounds=15,
+            past_winners=[], player_choices=[
+                ChoiceInfo(player_name='Bot', shape='Rock'), ChoiceInfo(player_name='Opponent', shape=opponent_shape)],
+            options=[])
+
+    def play(self, strategy: str, opponent_shapes: list[str | None], history_size: int = GameBot.HISTORY_SIZE):
+        bot = GameBot(player_name='Bot', total_rounds=15, game_config=self.load_game_config(), rng=Random(0),
+                      strategy=strategy, history_size=history_size)
+        for match_number, opponent_shape in enumerate(opponent_shapes):
+            bot.add_request_content(self.get_request(match_number=match_number + 1, opponent_shape=opponent_shape))
+        return bot
+
+    def test_counter_last(self):
+        bot = self.play(strategy=COUNTER, opponent_shapes=[None])
+        self.assertIn(bot.decide(), bot.options)
+        bot = self.play(strategy=COUNTER, opponent_shapes=[None, 'Spock', 'Rock'])
+        self.assertEqual(bot.decide(), 'Paper')
+
+    def test_frequency(self):
+        bot = self.play(strategy=FREQUENCY, opponent_shapes=['Rock', 'Rock', 'Scissors'])
+        self.assertEqual(bot.decide(), 'Paper')
+
+    def test_markov(self):
+        # Opponent always plays Spock after Rock
+        bot = self.play(strategy=MARKOV, opponent_shapes=['Rock', 'Spock', 'Rock', 'Spock', 'Lizard', 'Rock'])
+        self.assertEqual(bot.decide(), 'Paper')
+
+    def test_bounded_history(self):
+        bot = self.play(strategy=FREQUENCY, opponent_shapes=['Rock'] * 10 + ['Scissors'] * 4, history_size=4)
+        self.assertEqual(len(bot.history), 4)
+        self.assertEqual(len(bot.frequencies), 4)
+        self.assertEqual(sum(map(len, bot.transitions.values())), 4)
+        self.assertEqual(bot.decide(), 'Rock')
+
+    def test_match_players(self):
+        # Eliminated players keep their last choice until the round ends, but only players of the match are observed
+        config = self.load_game_config()
+        config = GameConfig(num_players=5, rules=config.rules, rounds=5)
+        names = [f'P{i}' for i in range(config.num_players)]
+        options = [shape.name for shape in config.shapes]
+        rng = Random(0)
+        bot = GameBot(player_name='P0', total_rounds=config.rounds, game_config=config, rng=rng)
+        state = CompactState.create(config=config, players=tuple(Player(name=name) for name in names))
+        asked = 0
+        while not state.is_finished():
+            active_ids = state.get_active_ids()
+            if 0 in active_ids:
+                bot.add_request_content(ChoiceRequest(
+                    player_name='P0', match_number=asked + 1, current_round=state.current_round + 1,
+                    total_rounds=config.rounds, past_winners=[names[i] for i in state.winners], player_choices=[
+                        ChoiceInfo(player_name=name, shape=options[shape_id] if shape_id is not None else None)
+                        for name, shape_id in zip(names, state.choices)], options=options))
+                self.assertEqual(bot.match_players, {names[i] for i in active_ids})
+                asked += 1
+            # Some players forfeit, but never all of them
+            state = state.played_match({i: rng.randrange(len(options)) if i == active_ids[0] or rng.random() > 0.1
+                                        else None for i in active_ids})
+        self.assertGreater(asked, config.rounds)
+
+    def test_shape_counts(self):
+        rng = Random(0)
+        counts = ShapeCounts(5)
+        seen = []
+        for _ in range(500):
+            if seen and rng.random() < 0.4:
+                counts.remove(seen.pop(rng.randrange(len(seen))))
+            else:
+                seen.append(rng.randrange(5))
+                counts.add(seen[-1])
+            most_common = counts.get_most_common()
+            if seen:
+                self.assertEqual(seen.count(most_common), max(map(seen.count, range(5))))
+            else:
+                self.assertIsNone(most_common)
+
+    def test_counter_tie(self):
+        # Two counter bots tying once must not keep tying until the match limit
+        config = self.load_game_config()
+        for seed in range(20):
+            result = simulate_game(game_config=config, strategies=('bot', 'bot'), rng=Random(seed), max_matches=200)
+            self.assertIsNotNone(result.winner)
+
+
+if __name__ == '__main__':
+    main()
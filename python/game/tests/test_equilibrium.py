@@ -0,0 +1,66 @@
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from game.client.bot import EQUILIBRIUM, GameBot
+from game.models import equilibrium
+from game.models.equilibrium import EquilibriumCache, get_config_hash, get_payoff_matrix, solve_equilibrium
+from game.models.game_config import GameConfig
+from game.models.shape import Shape
+
+
+class TestEquilibrium(TestCase):
+
+    def setUp(self):
+        self.config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        # Well beats Rock and Scissors and loses to Paper, so Rock is never worth playing
+        rules = {'Rock': ['Scissors'], 'Paper': ['Rock', 'Well'], 'Scissors': ['Paper'], 'Well': ['Rock', 'Scissors']}
+        self.well_config = GameConfig(
+            num_players=2, rounds=3,
+            rules={Shape(name=name): {Shape(name=other) for other in others} for name, others in rules.items()})
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_solutions(self):
+        uniform = solve_equilibrium(get_payoff_matrix(self.config))
+        for probability in uniform.strategy:
+            self.assertAlmostEqual(probability, 0.2, places=3)
+        well = solve_equilibrium(get_payoff_matrix(self.well_config))
+        self.assertLessEqual(well.exploitability, 1e-4)
+        for probability, expected in zip(well.strategy, [0.0, 1 / 3, 1 / 3, 1 / 3]):
+            self.assertAlmostEqual(probability, expected, places=2)
+
+    def test_solve(self):
+        self.check_solutions()
+        with patch.object(equilibrium, 'numpy', None):
+            self.check_solutions()
+
+    def test_cache(self):
+        self.assertNotEqual(get_config_hash(self.config), get_config_hash(self.well_config))
+        solved = EquilibriumCache(directory=self.directory.name).get(self.well_config)
+        self.assertTrue(Path(self.directory.name).joinpath(f'{get_config_hash(self.well_config)}.json').exists())
+        # Another process loads the equilibrium instead of solving it again
+        with patch.object(equilibrium, 'solve_equilibrium') as solve:
+            cache = EquilibriumCache(directory=self.directory.name)
+            self.assertEqual(cache.get(self.well_config), solved)
+            self.assertIs(cache.get(self.well_config), cache.get(self.well_config))
+            solve.assert_not_called()
+        # A stricter tolerance solves it again
+        self.assertLess(EquilibriumCache(directory=self.directory.name, tolerance=1e-6).get(
+            self.well_config).exploitability, 1e-6)
+
+    def test_bot(self):
+        bot = GameBot(player_name='Bot', total_rounds=3, game_config=self.well_config, rng=Random(0),
+                      strategy=EQUILIBRIUM, equilibrium_cache=EquilibriumCache(directory=self.directory.name))
+        choices = [bot.decide() for _ in range(3000)]
+        self.assertLess(choices.count('Rock'), 30)
+        for shape in ['Paper', 'Scissors', 'Well']:
+            self.assertAlmostEqual(choices.count(shape) / len(choices), 1 / 3, delta=0.05)
+
+
+if __name__ == '__main__':
+    main()
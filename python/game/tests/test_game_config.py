@@ -0,0 +1,48 @@
+from pathlib import Path
+from random import Random
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.models.game_state import GameState
+from game.models.shape import Shape
+
+
+class TestGameConfig(TestCase):
+
+    @staticmethod
+    def get_circular_config(num_shapes: int, num_players: int) -> GameConfig:
+        # Every shape defeats the half of the other shapes that follows it, like RPS-101
+        shapes = [Shape(name=f'Shape{i}') for i in range(num_shapes)]
+        rules = {
+            shape: {shapes[(i + offset) % num_shapes] for offset in range(1, num_shapes // 2 + 1)}
+            for i, shape in enumerate(shapes)
+        }
+        return GameConfig(num_players=num_players, rules=rules, rounds=1)
+
+    def test_load_checks_rules(self):
+        json_path = Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json')
+        config = GameConfig.load(path=json_path)
+        self.assertEqual(len(config.dominance), 5)
+        config = self.get_circular_config(num_shapes=3, num_players=2)
+        config.check_rules()
+        rock, paper = Shape(name='Rock'), Shape(name='Paper')
+        for rules in [{rock: {rock}}, {rock: {paper}, paper: {rock}}, {rock: {Shape(name='Spock')}, paper: set()}]:
+            with self.assertRaises(ValueError):
+                GameConfig(num_players=2, rules=rules, rounds=1).check_rules()
+
+    def test_count_wins(self):
+        config = self.get_circular_config(num_shapes=101, num_players=200)
+        rng = Random(0)
+        state = GameState.get_initial_state(config=config, player_names=[f'P{i}' for i in range(200)])
+        state = state.updated_player_choices({player: rng.choice(config.get_shapes()) for player in state.players})
+        # Same counts as confronting every pair of players
+        expected = {
+            player: sum(state.confront_two_players(player1=player, player2=other_player)
+                        for other_player in state.players if other_player != player)
+            for player in state.players
+        }
+        self.assertEqual(state.confront_all_players(), expected)
+
+
+if __name__ == '__main__':
+    main()
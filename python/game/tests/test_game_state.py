@@ -9,7 +9,7 @@ class TestGameState(TestCase):
 
     @staticmethod
     def load_game_config() -> GameConfig:
-        json_path = Path.cwd().parent.parent.parent.joinpath('data').joinpath('gameconfig.json')
+        json_path = Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json')
         return GameConfig.load(path=json_path)
 
     @staticmethod
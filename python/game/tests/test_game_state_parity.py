@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+from copy import deepcopy
+from dataclasses import dataclass
+from pathlib import Path
+from random import Random
+from typing import Any
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.models.game_state import GameState
+from game.models.player import Player
+from game.models.player_state import PlayerState
+from game.models.shape import Shape
+
+
+# The deepcopy based implementation GameState replaced, kept as the reference for parity
+@dataclass(frozen=True)
+class ReferenceGameState:
+    config: GameConfig
+    player_states: dict[Player, PlayerState]
+    current_round: int
+    past_winners: list[Player]
+
+    @property
+    def players(self) -> list[Player]:
+        return list(self.player_states.keys())
+
+    @staticmethod
+    def get_initial_state(
+            config: GameConfig,
+            player_names: list[str] | None = None,
+            current_round: int = 0,
+            past_winners: list[Player] | None = None
+    ) -> ReferenceGameState:
+        # Assert correct number of players
+        if player_names and len(player_names) != config.num_players:
+            raise ValueError(f'Invalid number of players: there must be exactly {config.num_players} players.')
+        # Generate default names
+        if player_names is None:
+            player_names = []
+            for i in range(config.num_players):
+                player_names.append(f'Player{i+1}')
+        # Create player states
+        player_states = {Player(name=player_name): PlayerState() for player_name in player_names}
+        # Create initial game state
+        return ReferenceGameState(
+            config=config,
+            player_states=player_states,
+            current_round=current_round,
+            past_winners=[] if not past_winners else past_winners
+        )
+
+    def get_player_choice(self, player) -> Shape | None:
+        player_state = self.player_states[player]
+        return player_state.choice
+
+    def get_active_players(self):
+        return [player for player, player_state in self.player_states.items() if player_state.active]
+
+    def get_unready_players(self):
+        return [player for player in self.get_active_players() if self.player_states[player].choice is None]
+
+    def confront_two_players(self, player1, player2) -> int:
+        player1_choice = self.get_player_choice(player=player1)
+        player2_choice = self.get_player_choice(player=player2)
+        player1_defeated_shapes = self.config.get_defeated_shapes(shape=player1_choice)
+        return 1 if player2_choice in player1_defeated_shapes else 0
+
+    def confront_all_players(self) -> dict[Player, int]:
+        # Find players that are still active
+        active_players = self.get_active_players()
+        # Initialize map to count victories
+        player_win_counts = {player: 0 for player in active_players}
+        # Iterate all active players
+        for player in active_players:
+            for confronted_player in active_players:
+                if confronted_player != player:
+                    player_win_counts[player] += self.confront_two_players(player1=player, player2=confronted_player)
+        return player_win_counts
+
+    def is_ready_for_confrontation(self):
+        for player in self.get_active_players():
+            if self.get_player_choice(player=player) is None:
+                return False
+        return True
+
+    def is_finished(self) -> bool:
+        return len(self.past_winners) == self.config.rounds
+
+    def get_winner(self) -> Player | None:
+        if not self.is_finished():
+            return None
+        # Get player with most wins
+        win_count = {player: 0 for player in self.players}
+        for player in self.past_winners:
+            win_count[player] += 1
+        winner = max(win_count, key=win_count.get)
+        return winner
+
+    def is_end_of_round(self) -> bool:
+        return len(self.get_active_players()) == 1
+
+    def get_round_winner(self) -> Player | None:
+        if not self.is_end_of_round():
+            return None
+        return self.get_active_players()[0]
+
+    def get_next_state(self) -> ReferenceGameState:
+        if self.is_end_of_round():
+            return self.get_next_round()
+        if not self.is_ready_for_confrontation():
+            return self
+        # Get win count for each player
+        player_win_counts = self.confront_all_players()
+        # Get the highest win count
+        max_count_player = max(player_win_counts, key=player_win_counts.get)
+        # Find losers
+        losers = [player for player in self.get_active_players()
+                  if player_win_counts[player] != player_win_counts[max_count_player]]
+        # Deactivate losers
+        new_state = self.deactivated_players(players=losers)
+        # Return next state
+        return new_state
+
+    def get_next_round(self) -> ReferenceGameState:
+        if not self.is_end_of_round():
+            return self
+        winners = deepcopy(self.past_winners)
+        winners.append(self.get_active_players()[0])
+        return ReferenceGameState.get_initial_state(
+            config=self.config,
+            player_names=[player.name for player in self.players],
+            current_round=self.current_round + 1,
+            past_winners=winners
+        )
+
+    def updated_player_choice(self, player: Player, choice: Shape):
+        player_state = self.player_states[player].updated_choice(new_choice=choice)
+        player_states = deepcopy(self.player_states)
+        player_states[player] = player_state
+        return self.updated('player_states', player_states)
+
+    def updated_player_choices(self, player_choices: dict[Player, Shape]) -> ReferenceGameState:
+        state = self
+        for player, choice in player_choices.items():
+            state = state.updated_player_choice(player, choice)
+        return state
+
+    def reset_choices(self) -> ReferenceGameState:
+        return self.updated_player_choices(player_choices={player: None for player in self.players})
+
+    def deactivated_player(self, player: Player) -> ReferenceGameState:
+        player_state = self.player_states[player].deactivated()
+        player_states = deepcopy(self.player_states)
+        player_states[player] = player_state
+        return self.updated('player_states', player_states)
+
+    def deactivated_players(self, players) -> ReferenceGameState:
+        state = self
+        for player in players:
+            state = state.deactivated_player(player=player)
+        return state
+
+    def incremented_round(self) -> ReferenceGameState:
+        return self.updated('current_round', self.current_round + 1)
+
+    def updated(self, attr: str, val: Any) -> ReferenceGameState:
+        return ReferenceGameState(**{**self.__dict__, attr: val})
+
+    def __str__(self) -> str:
+        desc = f'Rounds: {self.current_round + 1}/{self.config.rounds}\n'
+        desc += f'Past winners: {", ".join([player.name for player in self.past_winners])}\n' \
+            if self.past_winners else ''
+        desc += f'Player choices:\n'
+        for player, player_state in self.player_states.items():
+            desc += f'\t{player.name} - {player_state.choice}\n'
+        return desc
+
+
+class TestGameStateParity(TestCase):
+
+    @staticmethod
+    def load_game_config(num_players: int = 2) -> GameConfig:
+        json_path = Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json')
+        config = GameConfig.load(path=json_path)
+        return GameConfig(num_players=num_players, rules=config.rules, rounds=config.rounds)
+
+    def assert_same_state(self, state: GameState, reference: ReferenceGameState):
+        self.assertEqual(state.player_states, reference.player_states)
+        self.assertEqual(state.past_winners, reference.past_winners)
+        self.assertEqual(state.current_round, reference.current_round)
+        self.assertEqual(state.players, reference.players)
+        self.assertEqual(state.get_active_players(), reference.get_active_players())
+        self.assertEqual(state.get_unready_players(), reference.get_unready_players())
+        self.assertEqual(state.is_end_of_round(), reference.is_end_of_round())
+        self.assertEqual(state.get_round_winner(), reference.get_round_winner())
+        self.assertEqual(state.is_finished(), reference.is_finished())
+        self.assertEqual(state.get_winner(), reference.get_winner())
+        self.assertEqual(str(state), str(reference))
+        if reference.is_ready_for_confrontation() and reference.get_active_players():
+            self.assertEqual(state.confront_all_players(), reference.confront_all_players())
+
+    def play_games(self, num_players: int, seed: int):
+        config = self.load_game_config(num_players=num_players)
+        names = [f'P{i}' for i in range(num_players)]
+        shapes = config.get_shapes() + [None]
+        rng = Random(seed)
+        state = GameState.get_initial_state(config=config, player_names=names)
+        reference = ReferenceGameState.get_initial_state(config=config, player_names=names)
+        while not reference.is_finished():
+            # Same transitions as a server match, with some players forfeiting
+            player_choices = {player: rng.choice(shapes) for player in reference.get_active_players()}
+            forfeits = [player for player, shape in player_choices.items() if shape is None]
+            if len(forfeits) == len(player_choices):
+                continue
+            state = state.updated_player_choices(player_choices).deactivated_players(forfeits)
+            reference = reference.updated_player_choices(player_choices).deactivated_players(forfeits)
+            self.assert_same_state(state, reference)
+            if not reference.is_end_of_round():
+                state = state.get_next_state()
+                reference = reference.get_next_state()
+                self.assert_same_state(state, reference)
+            if reference.is_end_of_round():
+                state = state.get_next_round().updated_player_choices(player_choices)
+                reference = reference.get_next_round().updated_player_choices(player_choices)
+                self.assert_same_state(state, reference)
+
+    def test_two_player_parity(self):
+        for seed in range(20):
+            self.play_games(num_players=2, seed=seed)
+
+    def test_many_player_parity(self):
+        for num_players in range(3, 7):
+            self.play_games(num_players=num_players, seed=num_players)
+
+    def test_shared_past_winners(self):
+        config = self.load_game_config()
+        player1, player2 = Player(name='Player1'), Player(name='Player2')
+        state = GameState.get_initial_state(config=config)
+        end_of_round = state.deactivated_player(player=player2)
+        first = end_of_round.get_next_round()
+        # Branching from an older state must not change states built from it
+        second = first.deactivated_player(player=player1).get_next_round()
+        branch = first.deactivated_player(player=player2).get_next_round()
+        self.assertEqual(first.past_winners, [player1])
+        self.assertEqual(second.past_winners, [player1, player2])
+        self.assertEqual(branch.past_winners, [player1, player1])
+        self.assertEqual(end_of_round.past_winners, [])
+
+    def test_updated(self):
+        config = self.load_game_config()
+        state = GameState.get_initial_state(config=config)
+        reference = ReferenceGameState.get_initial_state(config=config)
+        player_states = {Player(name='A'): PlayerState(choice=Shape(name='Rock')), Player(name='B'): PlayerState()}
+        self.assert_same_state(
+            state.updated('player_states', player_states), reference.updated('player_states', player_states))
+        self.assert_same_state(state.incremented_round(), reference.incremented_round())
+
+
+if __name__ == '__main__':
+    main()
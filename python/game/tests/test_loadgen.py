@@ -0,0 +1,27 @@
+from os import getpid
+from unittest import TestCase, main
+
+from game.loadtest.loadgen import get_summary, read_process_stats
+
+
+class TestLoadGenerator(TestCase):
+
+    def test_summary(self):
+        summary = get_summary([float(i) for i in range(100, 0, -1)])
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['mean'], 50.5)
+        self.assertEqual(summary['max'], 100.0)
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']), (51.0, 96.0, 100.0))
+        self.assertEqual(get_summary([]), {'count': 0})
+
+    def test_process_stats(self):
+        process_stats = read_process_stats(getpid())
+        if process_stats is None:
+            self.skipTest('Process stats are only available on linux')
+        rss, threads = process_stats
+        self.assertGreater(rss, 0)
+        self.assertGreaterEqual(threads, 1)
+
+
+if __name__ == '__main__':
+    main()
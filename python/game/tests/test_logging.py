@@ -0,0 +1,54 @@
+import atexit
+import logging
+from pathlib import Path
+from queue import SimpleQueue
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from game.utils.logging import DeferredQueueHandler, GameEvent, configure_logger
+
+
+class TestLogging(TestCase):
+
+    def test_game_event(self):
+        event = GameEvent(game_id='game', event='match', fields={
+            'number': 3, 'choices': [('A', 'Rock'), ('B', 'forfeit')], 'result': 'tie'})
+        self.assertEqual(str(event), '[game] match number=3 choices=A:Rock,B:forfeit result=tie')
+        self.assertEqual(str(GameEvent(game_id='game', event='start', fields={})), '[game] start')
+
+    def test_deferred_formatting(self):
+        queue = SimpleQueue()
+        logger = logging.getLogger('test_deferred_formatting')
+        logger.addHandler(DeferredQueueHandler(queue))
+        logger.propagate = False
+        event = GameEvent(game_id='game', event='end', fields={'winner': 'A'})
+        logger.warning('%s', event)
+        # The event is only rendered when the listener formats the record
+        record = queue.get_nowait()
+        self.assertIs(record.args[0], event)
+        self.assertEqual(record.getMessage(), '[game] end winner=A')
+
+    def test_configure_once(self):
+        root = logging.getLogger()
+        handlers, level = root.handlers, root.level
+        root.handlers = []
+        try:
+            with TemporaryDirectory() as directory:
+                filename = str(Path(directory).joinpath('server.log'))
+                listener = configure_logger(filename=filename)
+                try:
+                    # Later calls leave the logger, and its listener thread and file, as they are
+                    self.assertIsNone(configure_logger(filename=filename, level=logging.WARNING))
+                    self.assertEqual(len(root.handlers), 1)
+                    self.assertEqual(root.level, logging.INFO)
+                finally:
+                    atexit.unregister(listener.stop)
+                    listener.stop()
+                    for handler in listener.handlers:
+                        handler.close()
+        finally:
+            root.handlers, root.level = handlers, level
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+from dataclasses import dataclass
+from threading import Thread
+from time import sleep
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from game.server.matchmaking import AsyncMatchmaker, FifoPolicy, Matchmaker, NameExclusionPolicy, QueueEntry, \
+    SkillBucketPolicy
+
+
+@dataclass(frozen=True)
+class FakeConnection:
+    player_name: str
+
+
+class TestMatchmaking(TestCase):
+
+    @staticmethod
+    def add_players(policy, names: list[str], now: float = 0.0):
+        for name in names:
+            policy.add(QueueEntry(player_conn=FakeConnection(player_name=name), enqueued_at=now))
+
+    @staticmethod
+    def get_names(group: list[QueueEntry] | None) -> list[str] | None:
+        return [entry.player_name for entry in group] if group is not None else None
+
+    def test_fifo_policy(self):
+        policy = FifoPolicy()
+        self.add_players(policy, ['A', 'B', 'C'])
+        self.assertEqual(self.get_names(policy.pop_group(size=2, now=0.0)), ['A', 'B'])
+        self.assertIsNone(policy.pop_group(size=2, now=0.0))
+        self.assertEqual(len(policy), 1)
+
+    def test_name_exclusion_policy(self):
+        policy = NameExclusionPolicy()
+        self.add_players(policy, ['A', 'A'])
+        self.assertIsNone(policy.pop_group(size=2, now=0.0))
+        self.add_players(policy, ['B'])
+        self.assertEqual(self.get_names(policy.pop_group(size=2, now=0.0)), ['A', 'B'])
+        self.assertEqual(len(policy), 1)
+
+    def test_skill_bucket_policy(self):
+        skills = {'A': 50, 'B': 450, 'C': 60}
+        policy = SkillBucketPolicy(skill=skills.get, bucket_size=100, max_wait=5.0)
+        self.add_players(policy, ['A', 'B'])
+        self.assertIsNone(policy.pop_group(size=2, now=1.0))
+        self.assertEqual(policy.get_timeout(size=2, now=1.0), 4.0)
+        self.assertIsNone(policy.get_timeout(size=3, now=1.0))
+        self.add_players(policy, ['C'])
+        self.assertEqual(self.get_names(policy.pop_group(size=2, now=1.0)), ['A', 'C'])
+        # Lone players are grouped with anyone after waiting long enough
+        self.add_players(policy, ['A'], now=2.0)
+        self.assertEqual(self.get_names(policy.pop_group(size=2, now=6.0)), ['B', 'A'])
+        self.assertEqual(len(policy), 0)
+
+    def test_skill_bucket_policy_drops_matched_entries(self):
+        skills = {'A': 50, 'B': 450}
+        policy = SkillBucketPolicy(skill=skills.get, bucket_size=100, max_wait=None)
+        self.add_players(policy, ['B'])
+        for _ in range(100):
+            self.add_players(policy, ['A', 'A'])
+            self.assertEqual(self.get_names(policy.pop_group(size=2, now=0.0)), ['A', 'A'])
+        # Entries matched behind the player still waiting are not kept
+        self.assertLessEqual(len(policy.entries), 2)
+        self.assertEqual(len(policy), 1)
+
+    def test_matchmaker_blocks_until_group(self):
+        matchmaker = Matchmaker(policy=FifoPolicy())
+        groups = []
+        thread = Thread(target=lambda: groups.append(matchmaker.get_group()))
+        thread.start()
+        matchmaker.put(FakeConnection(player_name='A'))
+        matchmaker.put(FakeConnection(player_name='B'))
+        thread.join(timeout=5)
+        self.assertEqual([player_conn.player_name for player_conn in groups[0]], ['A', 'B'])
+        stats = matchmaker.get_stats()
+        self.assertEqual(stats.groups_matched, 1)
+        self.assertEqual(stats.queue_depth, 0)
+
+    def test_matchmaker_uses_policy(self):
+        matchmaker = Matchmaker(policy=NameExclusionPolicy())
+        self.assertIsInstance(matchmaker.policy, NameExclusionPolicy)
+        self.assertIsInstance(AsyncMatchmaker(policy=SkillBucketPolicy()).policy, SkillBucketPolicy)
+        groups = []
+        thread = Thread(target=lambda: groups.append(matchmaker.get_group()))
+        thread.start()
+        matchmaker.put(FakeConnection(player_name='A'))
+        matchmaker.put(FakeConnection(player_name='A'))
+        thread.join(timeout=0.2)
+        self.assertEqual(groups, [])
+        matchmaker.put(FakeConnection(player_name='B'))
+        thread.join(timeout=5)
+        self.assertEqual([player_conn.player_name for player_conn in groups[0]], ['A', 'B'])
+
+    def test_matchmaker_blocks_with_long_waiting_player(self):
+        policy = SkillBucketPolicy(max_wait=0.01)
+        matchmaker = Matchmaker(policy=policy)
+        groups = []
+        with patch.object(policy, 'pop_group', wraps=policy.pop_group) as pop_group:
+            thread = Thread(target=lambda: groups.append(matchmaker.get_group()))
+            thread.start()
+            matchmaker.put(FakeConnection(player_name='A'))
+            sleep(0.2)
+            # Waits for arrivals instead of checking the queue again and again
+            self.assertLess(pop_group.call_count, 5)
+            matchmaker.put(FakeConnection(player_name='B'))
+            thread.join(timeout=5)
+        self.assertEqual([player_conn.player_name for player_conn in groups[0]], ['A', 'B'])
+
+    def test_async_matchmaker_blocks_with_long_waiting_player(self):
+        async def play():
+            policy = SkillBucketPolicy(max_wait=0.01)
+            matchmaker = AsyncMatchmaker(policy=policy)
+            with patch.object(policy, 'pop_group', wraps=policy.pop_group) as pop_group:
+                group = asyncio.create_task(matchmaker.get_group())
+                matchmaker.put(FakeConnection(player_name='A'))
+                await asyncio.sleep(0.2)
+                self.assertLess(pop_group.call_count, 5)
+                matchmaker.put(FakeConnection(player_name='B'))
+                return await asyncio.wait_for(group, timeout=5)
+
+        self.assertEqual([player_conn.player_name for player_conn in asyncio.run(play())], ['A', 'B'])
+
+
+if __name__ == '__main__':
+    main()
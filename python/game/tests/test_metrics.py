@@ -0,0 +1,53 @@
+from threading import Thread
+from unittest import TestCase, main
+
+from game.server.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+class TestMetrics(TestCase):
+
+    def test_thread_safe_gauge(self):
+        gauge = Gauge('connections', 'Open connections.')
+
+        def connect_and_disconnect():
+            for _ in range(10000):
+                gauge.inc()
+                gauge.dec()
+
+        threads = [Thread(target=connect_and_disconnect) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(gauge.value, 0)
+
+    def test_histogram(self):
+        histogram = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.get_samples(), [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 2.65',
+            'latency_seconds_count 4'
+        ])
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.register(Counter('messages_total', 'Messages.', labels={'encoding': 'json'})).inc(2)
+        registry.register(Counter('messages_total', 'Messages.', labels={'encoding': 'binary'}))
+        registry.register(Gauge('queue_depth', 'Queue depth.', function=lambda: 3))
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP messages_total Messages.',
+            '# TYPE messages_total counter',
+            'messages_total{encoding="json"} 2',
+            'messages_total{encoding="binary"} 0',
+            '# HELP queue_depth Queue depth.',
+            '# TYPE queue_depth gauge',
+            'queue_depth 3'
+        ]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
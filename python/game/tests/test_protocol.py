@@ -0,0 +1,179 @@
+from socket import socketpair
+from struct import pack
+from unittest import TestCase, main
+from uuid import uuid1
+
+from pydantic import BaseModel
+
+from game.server.schemas import JoinRequest, JoinResponse, PlayerChoiceRequest, PlayerChoiceInfo, \
+    PlayerChoiceResponse, EndOfGameMessage, PlayerChoiceDelta, EndOfGameDelta, LeaveRequest, ServerBusyMessage
+from game.utils.codec import JSON_CODEC, TYPED_JSON_CODEC, BinaryCodec, JsonCodec, decode_join_reply
+from game.utils.protocol import FRAME_SIZE, ConnectionClosedError, FrameTooLargeError, MessageReader, MessageWriter, \
+    encode
+
+
+class TestProtocol(TestCase):
+
+    def setUp(self):
+        self.local, self.remote = socketpair()
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+
+    def test_coalesced_frames(self):
+        reader = MessageReader(self.local)
+        writer = MessageWriter(self.remote)
+        writer.write(JoinRequest(player_name='A'))
+        writer.write(JoinRequest(player_name='B'))
+        writer.flush()
+        self.assertEqual(JoinRequest.parse_raw(reader.read_message()).player_name, 'A')
+        self.assertEqual(JoinRequest.parse_raw(reader.next_message()).player_name, 'B')
+        self.assertIsNone(reader.next_message())
+
+    def test_split_frame(self):
+        reader = MessageReader(self.local)
+        frame = encode(JoinRequest(player_name='A' * 5000))
+        self.remote.sendall(frame[:10])
+        reader.fill()
+        self.assertIsNone(reader.next_message())
+        self.remote.sendall(frame[10:])
+        self.assertEqual(reader.read_message(), frame[:-1])
+
+    def test_frame_too_large(self):
+        reader = MessageReader(self.local, max_frame_size=16)
+        self.remote.sendall(b'x' * 32)
+        with self.assertRaises(FrameTooLargeError):
+            reader.read_message()
+
+    def test_connection_closed(self):
+        reader = MessageReader(self.local)
+        self.remote.sendall(b'{"player_name": ')
+        self.remote.close()
+        with self.assertRaises(ConnectionClosedError):
+            reader.read_message()
+
+    def test_binary_codec(self):
+        codec = BinaryCodec(players=['A', 'B'], shapes=['Rock', 'Paper', 'Scissors'])
+        game_id = uuid1()
+        player_choices = [PlayerChoiceInfo(player_name='A', shape='Rock'), PlayerChoiceInfo(player_name='B', shape=None)]
+        messages = [
+            PlayerChoiceRequest(
+                player_name='B', game_id=game_id, match_number=3, current_round=2, total_rounds=15,
+                past_winners=['A'], player_choices=player_choices, options=['Rock', 'Paper', 'Scissors']),
+            PlayerChoiceResponse(player_name='A', game_id=game_id, match_number=3, shape='Paper'),
+            EndOfGameMessage(
+                current_round=15, total_rounds=15, past_winners=['A', 'B'], player_choices=player_choices, winner='A'),
+            PlayerChoiceDelta(
+                player_name='A', game_id=game_id, match_number=4, current_round=3, new_winners=['B'],
+                player_choices=player_choices),
+            EndOfGameDelta(current_round=15, new_winners=[], player_choices=player_choices, winner='B'),
+            JoinRequest(player_name='A', encoding='binary', delta=True, games=3),
+            LeaveRequest(player_name='B')
+        ]
+        # Frames are read back from a sized stream
+        reader = MessageReader(self.local, sized=True)
+        self.remote.sendall(b''.join(codec.encode(message) for message in messages))
+        for message in messages:
+            self.assertEqual(codec.decode(reader.read_message(), type(message)), message)
+            self.assertLess(len(codec.encode(message)), len(encode(message)))
+        # Shape indices start at 1, 0 only stands for a missing choice
+        response = codec.encode(PlayerChoiceResponse(player_name='A', game_id=game_id, match_number=3, shape='Rock'))
+        for shape in (0, 4):
+            with self.assertRaises(ValueError):
+                codec.decode(response[FRAME_SIZE.size:-2] + pack('!H', shape))
+        long_game = messages[0].copy(update={'current_round': 70_000, 'total_rounds': 70_000})
+        self.assertEqual(codec.decode(codec.encode(long_game)[FRAME_SIZE.size:]), long_game)
+        with self.assertRaises(ValueError):
+            codec.encode(long_game.copy(update={'match_number': 2 ** 32}))
+
+    def test_join_reply(self):
+        # Busy messages are JSON on sized streams too
+        codec = BinaryCodec()
+        response = JoinResponse(player_name='A', players=['A', 'B'], game_id=uuid1(), total_rounds=3, options=['Rock'])
+        busy = ServerBusyMessage(reason='waiting', retry_after_ms=500)
+        reader = MessageReader(self.local, sized=True)
+        self.remote.sendall(JSON_CODEC.encode(busy) + codec.encode(response))
+        self.assertEqual(decode_join_reply(reader.read_join_reply(), codec), busy)
+        self.assertEqual(decode_join_reply(reader.read_join_reply(), codec), response)
+        self.assertTrue(reader.sized)
+        with self.assertRaises(ValueError):
+            decode_join_reply(JSON_CODEC.encode(LeaveRequest(player_name='A'))[:-1], codec)
+
+    def test_json_codecs(self):
+        game_id = uuid1()
+        player_choices = [
+            PlayerChoiceInfo(player_name='A', shape='Rock'), PlayerChoiceInfo(player_name='B', shape=None)]
+        messages = [
+            JoinRequest(player_name='A', typed=True),
+            JoinResponse(player_name='A', players=['A', 'B'], game_id=game_id, total_rounds=3, options=['Rock']),
+            PlayerChoiceRequest(
+                player_name='B', game_id=game_id, match_number=3, current_round=2, total_rounds=15,
+                past_winners=['A'], player_choices=player_choices, options=['Rock', 'Paper', 'Scissors']),
+            PlayerChoiceResponse(player_name='A', game_id=game_id, match_number=3, shape='Paper'),
+            EndOfGameMessage(
+                current_round=15, total_rounds=15, past_winners=['A', 'B'], player_choices=player_choices, winner='A'),
+            PlayerChoiceDelta(
+                player_name='A', game_id=game_id, match_number=4, current_round=3, new_winners=['B'],
+                player_choices=player_choices),
+            EndOfGameDelta(current_round=15, new_winners=[], player_choices=player_choices, winner='B'),
+            JoinRequest(player_name='A', games=0),
+            LeaveRequest(player_name='A'),
+            ServerBusyMessage(reason='connections', retry_after_ms=1000)
+        ]
+        trusted_codec = JsonCodec(trusted=True)
+        for message in messages:
+            # Untyped frames from older peers are recognized by their fields
+            self.assertEqual(JSON_CODEC.encode(message), encode(message))
+            self.assertEqual(JSON_CODEC.decode(JSON_CODEC.encode(message)), message)
+            self.assertEqual(JSON_CODEC.decode(JSON_CODEC.encode(message), type(message)), message)
+            typed_payload = TYPED_JSON_CODEC.encode(message)
+            self.assertTrue(typed_payload.startswith(b'{"type": '))
+            self.assertEqual(JSON_CODEC.decode(typed_payload), message)
+            self.assertEqual(trusted_codec.decode(typed_payload), message)
+        # Discriminators must match the expected schema
+        with self.assertRaises(ValueError):
+            JSON_CODEC.decode(TYPED_JSON_CODEC.encode(messages[2]), PlayerChoiceResponse)
+        with self.assertRaises(ValueError):
+            JSON_CODEC.decode(b'{"type": "unknown"}')
+        with self.assertRaises(ValueError):
+            JSON_CODEC.decode(b'[1, 2]')
+
+    def test_encode_for_players(self):
+        # Names that could be mistaken for the spliced field are escaped
+        players = ['A', '"player_name": ""', 'Ünicode']
+        codec = BinaryCodec(players=players, shapes=['Rock', 'Paper'])
+        game_id = uuid1()
+        player_choices = [PlayerChoiceInfo(player_name=player, shape='Rock') for player in players]
+        messages = [
+            JoinResponse(player_name='', players=players, game_id=game_id, total_rounds=3, options=['Rock', 'Paper']),
+            PlayerChoiceRequest(
+                player_name='', game_id=game_id, match_number=3, current_round=2, total_rounds=3,
+                past_winners=players[1:], player_choices=player_choices, options=['Rock', 'Paper']),
+            PlayerChoiceDelta(
+                player_name='', game_id=game_id, match_number=3, current_round=2, new_winners=players[:1],
+                player_choices=player_choices)
+        ]
+        for message in messages:
+            for message_codec in (JSON_CODEC, TYPED_JSON_CODEC, codec):
+                self.assertEqual(
+                    message_codec.encode_for_players(message, players),
+                    [message_codec.encode(message.copy(update={'player_name': player})) for player in players])
+
+    def test_encode_for_players_field_order(self):
+        # The top-level name is found wherever the schema puts it, and a nested player may have the sentinel name
+        class NameFirst(BaseModel):
+            player_name: str
+            player_choices: list[PlayerChoiceInfo]
+
+        players = ['', 'A', JsonCodec.PLAYER_NAME_SENTINEL]
+        for names in (players[:2], players):
+            message = NameFirst(
+                player_name='', player_choices=[PlayerChoiceInfo(player_name=name, shape=None) for name in names])
+            self.assertEqual(
+                JSON_CODEC.encode_for_players(message, players),
+                [JSON_CODEC.encode(message.copy(update={'player_name': player})) for player in players])
+
+
+if __name__ == '__main__':
+    main()
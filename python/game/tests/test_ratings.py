@@ -0,0 +1,65 @@
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from game.server.ratings import DEFAULT_RATING, Leaderboard, RatingService
+
+
+class TestLeaderboard(TestCase):
+
+    def test_matches_sorted_list(self):
+        rng = Random(0)
+        # Small chunks, so they are split and emptied
+        with patch.object(Leaderboard, 'LOAD', 4):
+            leaderboard = Leaderboard(keys=[(float(rng.randint(0, 50)), f'P{i}') for i in range(20)])
+            expected = sorted(leaderboard)
+            for i in range(500):
+                if expected and rng.random() < 0.4:
+                    key = expected.pop(rng.randrange(len(expected)))
+                    leaderboard.remove(key)
+                else:
+                    key = (float(rng.randint(0, 50)), f'Q{i}')
+                    expected.append(key)
+                    expected.sort()
+                    leaderboard.add(key)
+                self.assertEqual(len(leaderboard), len(expected))
+                if expected:
+                    probe = expected[rng.randrange(len(expected))]
+                    self.assertEqual(leaderboard.index(probe), expected.index(probe))
+            self.assertEqual(list(leaderboard), expected)
+            self.assertEqual(leaderboard.head(5), expected[:5])
+
+
+class TestRatingService(TestCase):
+
+    def test_record_game(self):
+        ratings = RatingService()
+        ratings.record_game(player_names=['A', 'B'], winner='A')
+        self.assertAlmostEqual(ratings.get_rating('A'), DEFAULT_RATING + 16.0)
+        self.assertAlmostEqual(ratings.get_rating('B'), DEFAULT_RATING - 16.0)
+        self.assertEqual(ratings.get_rating('C'), DEFAULT_RATING)
+        # Beating a weaker player gains less
+        ratings.record_game(player_names=['A', 'C'], winner='A')
+        self.assertLess(ratings.get_rating('A'), DEFAULT_RATING + 32.0)
+        self.assertEqual([rating.player_name for rating in ratings.get_top(3)], ['A', 'C', 'B'])
+        rank = ratings.get_rank('C')
+        self.assertEqual((rank.rank, rank.games), (2, 1))
+        self.assertIsNone(ratings.get_rank('D'))
+
+    def test_snapshot(self):
+        with TemporaryDirectory() as directory:
+            path = str(Path(directory).joinpath('ratings.json'))
+            ratings = RatingService(path=path)
+            ratings.start()
+            for i in range(10):
+                ratings.record_game(player_names=[f'P{i}', f'P{i + 1}'], winner=f'P{i}')
+            ratings.close()
+            restored = RatingService(path=path)
+            self.assertEqual(restored.get_top(11), ratings.get_top(11))
+            self.assertEqual(restored.get_rank('P5'), ratings.get_rank('P5'))
+
+
+if __name__ == '__main__':
+    main()
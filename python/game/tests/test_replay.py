@@ -0,0 +1,113 @@
+from dataclasses import dataclass, replace
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.server.game import ServerGame
+from game.server.replay import INDEX_SUFFIX, LOG_SUFFIX, ReplayLog, ReplayReader, read_replays
+
+
+@dataclass(frozen=True)
+class FakeConnection:
+    player_name: str
+    encoding: str = 'json'
+    delta: bool = False
+    typed: bool = False
+    games: int = 1
+
+
+class TestReplay(TestCase):
+
+    def setUp(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        self.config = GameConfig(num_players=5, rules=config.rules, rounds=4)
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def play_game(self, rng: Random) -> tuple[ServerGame, list[tuple]]:
+        # State of the server game before every match, and after the last one
+        game = ServerGame(game_config=self.config, record_matches=True, player_conns=[
+            FakeConnection(player_name=f'P{i}') for i in range(self.config.num_players)])
+        shapes = self.config.get_shapes()
+        states = []
+        while not game.is_finished():
+            states.append(self.get_server_state(game))
+            game.play_match(player_choices={
+                player: rng.choice(shapes) if rng.random() > 0.1 else None
+                for player in game.game_state.get_active_players()})
+        states.append(self.get_server_state(game))
+        return game, states
+
+    @staticmethod
+    def get_server_state(game: ServerGame) -> tuple:
+        game_state = game.game_state
+        return (game_state.current_round, [player.name for player in game_state.get_active_players()],
+                [player.name for player in game_state.past_winners])
+
+    @staticmethod
+    def get_replay_state(state) -> tuple:
+        return (state.current_round, [state.players[i].name for i in state.get_active_ids()],
+                [state.players[i].name for i in state.winners])
+
+    def write_games(self, count: int, **kwargs) -> list[tuple[ServerGame, list[tuple]]]:
+        rng = Random(0)
+        games = [self.play_game(rng) for _ in range(count)]
+        replay_log = ReplayLog(directory=self.directory.name, game_config=self.config, snapshot_interval=3, **kwargs)
+        for game, _ in games:
+            replay_log.put(game.get_record())
+        replay_log.close()
+        return games
+
+    def test_random_access(self):
+        games = self.write_games(count=20)
+        path, = Path(self.directory.name).glob(f'*{LOG_SUFFIX}')
+        with ReplayReader(path=str(path), game_config=self.config) as reader:
+            self.assertEqual(len(reader), 20)
+            for game, states in games:
+                replay = reader.get_game(game.game_id)
+                self.assertEqual(replay.players, tuple(player_conn.player_name for player_conn in game.player_conns))
+                self.assertEqual(replay.matches, game.match_number - 1)
+                self.assertEqual(replay.get_winner(), game.get_winner().player_name)
+                self.assertEqual(len(replay.get_round_winners()), self.config.rounds)
+                # Jump to every match, in reverse so states never come from the previous one
+                for match_number in reversed(range(1, replay.matches + 2)):
+                    self.assertEqual(self.get_replay_state(replay.get_state(match_number)), states[match_number - 1])
+                with self.assertRaises(ValueError):
+                    replay.get_match(replay.matches + 1)
+
+    def test_bad_record(self):
+        rng = Random(0)
+        games = [self.play_game(rng)[0] for _ in range(2)]
+        replay_log = ReplayLog(directory=self.directory.name, game_config=self.config)
+        # Records that cannot be encoded are lost alone, later games are still recorded
+        replay_log.put(replace(games[0].get_record(), matches=None))
+        replay_log.put(games[1].get_record())
+        replay_log.close()
+        self.assertEqual([replay.game_id for replay in read_replays(self.directory.name, game_config=self.config)],
+                         [games[1].game_id])
+
+    def test_rotation_and_scan(self):
+        self.write_games(count=10, max_file_size=1000)
+        paths = sorted(Path(self.directory.name).glob(f'*{LOG_SUFFIX}'))
+        self.assertGreater(len(paths), 1)
+        game_ids = [replay.game_id for replay in read_replays(self.directory.name, game_config=self.config)]
+        self.assertEqual(len(game_ids), 10)
+        # Without an index, whole records are found by scanning and a partial one is ignored
+        path = paths[0]
+        with ReplayReader(path=str(path), game_config=self.config) as reader:
+            indexed = list(reader.offsets.items())
+        path.with_suffix(INDEX_SUFFIX).unlink()
+        path.write_bytes(path.read_bytes() + path.read_bytes()[4:20])
+        with ReplayReader(path=str(path), game_config=self.config) as reader:
+            self.assertEqual(list(reader.offsets.items()), indexed)
+        # Logs whose header was not flushed yet have no games
+        Path(self.directory.name).joinpath(f'live{LOG_SUFFIX}').write_bytes(b'')
+        self.assertEqual(len(list(read_replays(self.directory.name, game_config=self.config))), 10)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import sqlite3
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from game.server.results import GameRecord, MatchRecord, ResultsStore
+
+
+class TestResultsStore(TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = str(Path(self.directory.name).joinpath('results.db'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def get_record(i: int, players: tuple[str, str]) -> GameRecord:
+        return GameRecord(
+            game_id=f'game{i}', players=players, winner=players[0], round_winners=(players[0],),
+            matches=(MatchRecord(match_number=1, round=1, choices=('Rock', None)),),
+            started_at=float(i), finished_at=float(i) + 0.5)
+
+    def test_player_history(self):
+        store = ResultsStore(path=self.path, batch_size=3)
+        records = [self.get_record(i, ('A', 'B') if i % 2 else ('A', 'C')) for i in range(10)]
+        for record in records:
+            store.put(record)
+        store.close()
+        self.assertEqual(store.get_player_history('B'), [records[i] for i in [9, 7, 5, 3, 1]])
+        self.assertEqual(store.get_player_history('A', limit=2, before=(records[5].finished_at, records[5].game_id)),
+                         records[4:2:-1])
+        self.assertEqual(store.get_games(start=2.0, end=4.0), records[2:4])
+        self.assertEqual(store.get_player_history('D'), [])
+
+    def test_same_finished_at(self):
+        store = ResultsStore(path=self.path, batch_size=2)
+        records = [replace(self.get_record(0, ('A', 'B')), game_id=f'game{i}') for i in range(5)]
+        for record in records:
+            store.put(record)
+        # A game written again is ignored
+        store.put(replace(records[0], winner='B'))
+        store.close()
+        pages = [store.get_player_history('A', limit=2)]
+        while pages[-1]:
+            pages.append(store.get_player_history('A', limit=2, before=(
+                pages[-1][-1].finished_at, pages[-1][-1].game_id)))
+        self.assertEqual([record for page in pages for record in page], records[::-1])
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM game_players').fetchone(), (10,))
+        conn.close()
+
+    def test_bad_record(self):
+        store = ResultsStore(path=self.path, batch_size=1)
+        # Players that cannot be serialized lose their batch only
+        store.put(replace(self.get_record(0, ('A', 'B')), players=('A', object())))
+        record = self.get_record(1, ('A', 'B'))
+        store.put(record)
+        store.close()
+        self.assertEqual(store.get_player_history('A'), [record])
+
+    def test_history_uses_index(self):
+        store = ResultsStore(path=self.path)
+        store.close()
+        conn = sqlite3.connect(self.path)
+        plan = ' '.join(str(row) for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT games.* FROM game_players JOIN games USING (game_id) '
+            'WHERE game_players.player_name = ? AND (game_players.finished_at, game_players.game_id) < (?, ?) '
+            'ORDER BY game_players.finished_at DESC, game_players.game_id DESC LIMIT ?', ('A', 1.0, 'game1', 10)))
+        conn.close()
+        self.assertIn('game_players_by_name', plan)
+        self.assertNotIn('SCAN game_players', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+if __name__ == '__main__':
+    main()
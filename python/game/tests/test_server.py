@@ -0,0 +1,136 @@
+from json import dumps, loads
+from pathlib import Path
+from socket import socketpair
+from threading import Thread
+from time import monotonic, sleep
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from game.models.game_config import GameConfig
+from game.server.admission import WAITING, AdmissionLimits
+from game.server.game import FORFEIT, RANDOM, REPEAT, ServerGame
+from game.server.models import PlayerConnection
+from game.server.schemas import JoinRequest
+from game.server.server import GameServer
+from game.utils.codec import JSON_CODEC
+from game.utils.protocol import MessageReader, MessageWriter
+
+
+MATCH_TIMEOUT = 0.3
+
+
+def answer_requests(peer, shape: str, delay: float = 0.0):
+    # Answers every choice request with the same shape until the connection closes
+    reader = MessageReader(peer)
+    try:
+        while True:
+            request = loads(reader.read_message())
+            sleep(delay)
+            peer.sendall((dumps({
+                'player_name': request['player_name'], 'game_id': request['game_id'],
+                'match_number': request['match_number'], 'shape': shape}) + '\n').encode('utf-8'))
+    except OSError:
+        pass
+
+
+class TestRequestPlayerChoices(TestCase):
+
+    def setUp(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        self.config = GameConfig(num_players=3, rules=config.rules, rounds=3)
+        self.pairs = [socketpair() for _ in range(self.config.num_players)]
+        self.player_conns = [PlayerConnection(
+            player_name=f'P{i}', conn=conn, addr=('127.0.0.1', 1000 + i), reader=MessageReader(conn),
+            writer=MessageWriter(conn)) for i, (conn, _) in enumerate(self.pairs)]
+        # The last player never answers, the others always tie
+        self.shapes = ['Rock', 'Rock']
+        for (_, peer), shape in zip(self.pairs, self.shapes):
+            Thread(target=answer_requests, args=(peer, shape), daemon=True).start()
+
+    def tearDown(self):
+        for conn, peer in self.pairs:
+            conn.close()
+            peer.close()
+
+    def get_server_game(self, timeout_policy: str,
+                        match_timeout: float | None = MATCH_TIMEOUT) -> tuple[GameServer, ServerGame]:
+        server = GameServer(host='127.0.0.1', port=0, game_config=self.config, verbose=False,
+                            match_timeout=match_timeout, timeout_policy=timeout_policy)
+        return server, ServerGame(game_config=self.config, player_conns=self.player_conns,
+                                  timeout_policy=timeout_policy)
+
+    def test_deadline(self):
+        server, game = self.get_server_game(timeout_policy=RANDOM)
+        started = monotonic()
+        player_choices = server.request_player_choices(game=game)
+        elapsed = monotonic() - started
+        choices = {player.name: shape.name for player, shape in player_choices.items()}
+        # Answers are collected while the silent player is waited for, until the deadline only
+        self.assertEqual([choices['P0'], choices['P1']], self.shapes)
+        self.assertGreaterEqual(elapsed, MATCH_TIMEOUT)
+        self.assertLess(elapsed, MATCH_TIMEOUT + 0.5)
+        self.assertIn(choices['P2'], [shape.name for shape in self.config.get_shapes()])
+        stats = game.recorder.get_stats()
+        self.assertEqual((stats.matches, stats.timeouts), (1, 1))
+        self.assertEqual([player.name for player in game.unanswered], ['P2'])
+
+    def test_no_deadline(self):
+        server, game = self.get_server_game(timeout_policy=RANDOM, match_timeout=None)
+        # The last player answers after the usual deadline
+        Thread(target=answer_requests, args=(self.pairs[2][1], 'Paper', MATCH_TIMEOUT * 2), daemon=True).start()
+        player_choices = server.request_player_choices(game=game)
+        self.assertEqual([shape.name for shape in player_choices.values()], ['Rock', 'Rock', 'Paper'])
+        stats = game.recorder.get_stats()
+        self.assertEqual((stats.matches, stats.timeouts), (1, 0))
+
+    def test_forfeit(self):
+        server, game = self.get_server_game(timeout_policy=FORFEIT)
+        player_choices = server.request_player_choices(game=game)
+        self.assertIsNone(player_choices[game.game_state.players[2]])
+        game.play_match(player_choices=player_choices)
+        # Players that forfeit are out until the round ends
+        self.assertEqual([player.name for player in game.game_state.get_active_players()], ['P0', 'P1'])
+
+    def test_repeat(self):
+        server, game = self.get_server_game(timeout_policy=REPEAT)
+        silent = game.game_state.players[2]
+        # Without a previous shape, a random one is picked, Paper here so the silent player stays in the game
+        paper, = [shape for shape in self.config.get_shapes() if shape.name == 'Paper']
+        with patch('game.server.game.choice', return_value=paper):
+            player_choices = server.request_player_choices(game=game)
+        self.assertEqual(player_choices[silent], paper)
+        game.play_match(player_choices=player_choices)
+        # Afterwards the previous shape is repeated
+        while not game.is_finished():
+            self.assertEqual(game.game_state.get_player_choice(player=silent), paper)
+            player_choices = server.request_player_choices(game=game)
+            self.assertEqual(player_choices[silent], paper)
+            game.play_match(player_choices=player_choices)
+        self.assertEqual(game.get_winner().player_name, 'P2')
+
+
+class TestSessions(TestCase):
+
+    def test_rejoin_over_waiting_cap(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        server = GameServer(host='127.0.0.1', port=0, game_config=config, verbose=False,
+                            limits=AdmissionLimits(max_waiting=0))
+        conn, peer = socketpair()
+        peer.settimeout(5)
+        try:
+            server.metrics.active_connections.inc()
+            peer.sendall(JSON_CODEC.encode(JoinRequest(player_name='P0', games=0)))
+            # Sessions joining another game are admitted like new players
+            server.handle_session(PlayerConnection(
+                player_name='P0', conn=conn, addr=('127.0.0.1', 1000), reader=MessageReader(conn),
+                writer=MessageWriter(conn), games=0))
+            self.assertEqual(JSON_CODEC.decode(MessageReader(peer).read_message()).reason, WAITING)
+            self.assertEqual(len(server.matchmaker.policy), 0)
+            self.assertEqual(server.metrics.active_connections.value, 0)
+        finally:
+            conn.close()
+            peer.close()
+
+
+if __name__ == '__main__':
+    main()
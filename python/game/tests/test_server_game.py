@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from pathlib import Path
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.server.game import ServerGame
+from game.server.schemas import JoinResponse, PlayerChoiceDelta, PlayerChoiceRequest
+from game.utils.codec import BINARY, JSON
+
+
+@dataclass(frozen=True)
+class FakeConnection:
+    player_name: str
+    encoding: str = JSON
+    delta: bool = False
+    typed: bool = False
+    games: int = 1
+
+
+class TestServerGame(TestCase):
+
+    def setUp(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        self.config = GameConfig(num_players=6, rules=config.rules, rounds=3)
+        self.player_conns = [
+            FakeConnection(player_name=f'P{i}', encoding=BINARY if i % 2 else JSON, delta=i % 3 == 0)
+            for i in range(self.config.num_players)]
+        self.game = ServerGame(game_config=self.config, player_conns=self.player_conns, snapshot_interval=4)
+
+    def test_requests_match_individual_encoding(self):
+        shapes = self.config.get_shapes()
+        while not self.game.is_finished():
+            requests, payloads = self.game.get_player_choice_requests()
+            # Only players still in the round are asked
+            self.assertEqual(list(requests), self.game.game_state.get_active_players())
+            for player, request in requests.items():
+                player_conn = self.game.players_map[player]
+                self.assertEqual(request.player_name, player.name)
+                expected_type = PlayerChoiceDelta if player_conn.delta and not self.game.is_snapshot_match() \
+                    else PlayerChoiceRequest
+                self.assertIsInstance(request, expected_type)
+                self.assertEqual(payloads[player], self.game.encode(player_conn=player_conn, message=request))
+            self.game.play_match(player_choices={
+                player: shapes[(self.game.match_number + i) % len(shapes)] for i, player in enumerate(requests)})
+
+    def test_join_responses(self):
+        join_responses = self.game.get_join_responses()
+        self.assertEqual(len(join_responses), self.config.num_players)
+        for player, payload in join_responses.items():
+            player_conn = self.game.players_map[player]
+            response = self.game.get_codec(player_conn=player_conn).decode(
+                payload[4:] if player_conn.encoding == BINARY else payload, JoinResponse)
+            self.assertEqual(response.player_name, player.name)
+            self.assertEqual(response.players, [player_conn.player_name for player_conn in self.player_conns])
+
+    def test_sessions(self):
+        player_conns = [FakeConnection(player_name='A', games=0), FakeConnection(player_name='B', games=3),
+                        FakeConnection(player_name='C', games=2), FakeConnection(player_name='D')]
+        game = ServerGame(game_config=GameConfig(num_players=4, rules=self.config.rules, rounds=3),
+                          player_conns=player_conns)
+        players = game.game_state.players
+        game.record_match(latency=0.1, requested=players, unanswered=players[1:3])
+        game.record_match(latency=0.1, requested=players[:2], unanswered=[])
+        # C did not answer its last request, D plays a single game
+        self.assertEqual(game.get_sessions(), player_conns[:2])
+
+
+if __name__ == '__main__':
+    main()
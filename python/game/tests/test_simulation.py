@@ -0,0 +1,51 @@
+from pathlib import Path
+from random import Random
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.simulation.engine import run_simulation, simulate_batch, simulate_game
+
+
+class TestSimulation(TestCase):
+
+    @staticmethod
+    def load_game_config() -> GameConfig:
+        json_path = Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json')
+        return GameConfig.load(path=json_path)
+
+    def test_simulate_game(self):
+        config = self.load_game_config()
+        result = simulate_game(game_config=config, strategies=('bot', 'random'), rng=Random(0))
+        self.assertIn(result.winner, [0, 1])
+        self.assertGreaterEqual(result.matches, config.rounds)
+        # Games that cannot finish stop at the match limit
+        result = simulate_game(game_config=config, strategies=('bot', 'random'), rng=Random(0), max_matches=3)
+        self.assertIsNone(result.winner)
+        self.assertEqual(result.matches, 3)
+
+    def test_deterministic_batches(self):
+        config = self.load_game_config()
+        stats = simulate_batch(game_config=config, strategies=('bot', 'random'), seed='0:0', num_games=50)
+        self.assertEqual(stats, simulate_batch(
+            game_config=config, strategies=('bot', 'random'), seed='0:0', num_games=50))
+        self.assertEqual(stats.games, 50)
+        self.assertEqual(sum(stats.wins) + stats.aborted, 50)
+
+    def test_run_simulation(self):
+        config = self.load_game_config()
+        totals = [
+            list(run_simulation(
+                game_config=config, strategies=('random', 'random'), num_games=100, seed=1, workers=workers,
+                batch_size=30))
+            for workers in [1, 2]
+        ]
+        # Running totals are streamed once per batch and only the final one depends on the seed alone
+        self.assertEqual(len(totals[0]), 4)
+        self.assertEqual(totals[0][-1].games, 100)
+        self.assertEqual(totals[0][-1], totals[1][-1])
+        with self.assertRaises(ValueError):
+            list(run_simulation(game_config=config, strategies=('random',), num_games=1))
+
+
+if __name__ == '__main__':
+    main()
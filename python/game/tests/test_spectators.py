@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from json import loads
+from pathlib import Path
+from random import Random
+from unittest import TestCase, main
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from uuid import uuid1
+
+from game.models.game_config import GameConfig
+from game.server.game import ServerGame
+from game.server.metrics import ServerMetrics
+from game.server.spectators import END, MATCH, START, SpectatorHub, SpectatorServer
+
+
+@dataclass(frozen=True)
+class FakeConnection:
+    player_name: str
+    encoding: str = 'json'
+    delta: bool = False
+    typed: bool = False
+    games: int = 1
+
+
+class TestSpectatorHub(TestCase):
+
+    def setUp(self):
+        self.metrics = ServerMetrics()
+        self.hub = SpectatorHub(queue_size=4, metrics=self.metrics)
+
+    def test_fan_out(self):
+        game_id = uuid1()
+        self.hub.publish(game_id=game_id, event=START, players=['A', 'B'], total_rounds=3)
+        # Matches nobody watches are dropped before being serialized
+        self.hub.publish(game_id=game_id, event=MATCH, number=1)
+        self.assertIsNone(self.hub.subscribe(game_id=uuid1()))
+        subscribers = [self.hub.subscribe(), self.hub.subscribe(game_id=game_id)]
+        self.assertEqual(len(self.hub), 2)
+        self.hub.publish(game_id=game_id, event=MATCH, number=2)
+        self.hub.publish(game_id=game_id, event=END, winner='A')
+        first, second = [subscriber.get(timeout=0) for subscriber in subscribers]
+        self.assertEqual([loads(payload)['type'] for payload in first], [START, MATCH, END])
+        # Every subscriber gets the same bytes
+        for payload, other in zip(first, second):
+            self.assertIs(payload, other)
+        self.assertEqual(loads(first[1]), {'type': MATCH, 'game_id': str(game_id), 'number': 2})
+        # Spectators of one game are closed when it ends, those of every game keep waiting
+        self.assertIsNone(subscribers[1].get(timeout=0))
+        self.assertEqual(subscribers[0].get(timeout=0), [])
+        self.assertEqual(len(self.hub), 1)
+        self.hub.unsubscribe(subscribers[0])
+        self.assertEqual(len(self.hub), 0)
+        self.assertIsNone(self.hub.subscribe(game_id=game_id))
+
+    def test_slow_subscriber(self):
+        game_ids = [uuid1(), uuid1()]
+        subscriber = self.hub.subscribe()
+        for game_id in game_ids:
+            self.hub.publish(game_id=game_id, event=START, players=['A', 'B'], total_rounds=3)
+        # Matches of the same game replace each other once the queue is full
+        for number in range(1, 11):
+            self.hub.publish(game_id=game_ids[0], event=MATCH, number=number)
+        self.assertEqual(self.metrics.spectator_lost_events['coalesced'].value, 8)
+        # Other events push out the oldest ones
+        self.hub.publish(game_id=game_ids[1], event=MATCH, number=1)
+        self.assertEqual(self.metrics.spectator_lost_events['dropped'].value, 1)
+        events = [loads(payload) for payload in subscriber.get(timeout=0)]
+        self.assertEqual(events[0], {'type': 'missed', 'events': 9})
+        self.assertEqual([(event['type'], event.get('number')) for event in events[1:]],
+                         [(START, None), (MATCH, 1), (MATCH, 10), (MATCH, 1)])
+        # New spectators get the start and latest match of games in progress
+        late = self.hub.subscribe(game_id=game_ids[0])
+        self.assertEqual([loads(payload).get('number') for payload in late.get(timeout=0)], [None, 10])
+
+    def test_server_game(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        game = ServerGame(game_config=config, spectators=self.hub, player_conns=[
+            FakeConnection(player_name=f'P{i}') for i in range(config.num_players)])
+        game.publish_event(START, players=['P0', 'P1'], total_rounds=config.rounds)
+        subscriber = self.hub.subscribe(game_id=game.game_id)
+        rng = Random(0)
+        game.play_match(player_choices={
+            player: rng.choice(config.get_shapes()) for player in game.game_state.get_active_players()})
+        _, match = [loads(payload) for payload in subscriber.get(timeout=0)]
+        self.assertEqual(match['number'], 1)
+        self.assertEqual([choice['player_name'] for choice in match['player_choices']], ['P0', 'P1'])
+        self.assertEqual(match['past_winners'], [match['round_winner']] if match['round_winner'] else [])
+
+
+class TestSpectatorServer(TestCase):
+
+    def test_stream(self):
+        hub = SpectatorHub()
+        server = SpectatorServer(hub=hub, host='127.0.0.1', port=0)
+        server.start()
+        host, port = server.http_server.server_address
+        try:
+            game_id = uuid1()
+            hub.publish(game_id=game_id, event=START, players=['A', 'B'], total_rounds=3)
+            with self.assertRaises(HTTPError):
+                urlopen(f'http://{host}:{port}/games/{uuid1()}')
+            with urlopen(f'http://{host}:{port}/games/{game_id}', timeout=5) as stream:
+                self.assertEqual(loads(stream.readline())['type'], START)
+                hub.publish(game_id=game_id, event=MATCH, number=1)
+                hub.publish(game_id=game_id, event=END, winner='B')
+                # The stream ends with the game
+                self.assertEqual([loads(line)['type'] for line in stream.readlines()], [MATCH, END])
+        finally:
+            server.http_server.shutdown()
+            server.http_server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+from pathlib import Path
+from unittest import TestCase, main
+from uuid import uuid1
+
+from game.client.swarm import BotSwarm, PlayerResult, get_swarm_summary
+from game.models.game_config import GameConfig
+
+
+class TestBotSwarm(TestCase):
+
+    def setUp(self):
+        self.config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+
+    def test_strategies(self):
+        swarm = BotSwarm(host='localhost', port=0, game_config=self.config, strategies=['random', 'markov', 'markov'])
+        self.assertEqual([swarm.get_strategy(i) for i in range(5)], ['random', 'markov', 'markov', 'random', 'markov'])
+        with self.assertRaises(ValueError):
+            BotSwarm(host='localhost', port=0, game_config=self.config, strategies=['unknown'])
+        with self.assertRaises(ValueError):
+            BotSwarm(host='localhost', port=0, game_config=self.config, games=0)
+
+    def test_summary(self):
+        game_ids = [uuid1(), uuid1()]
+        results = [
+            PlayerResult(player_name='A', strategy='random', game_ids=game_ids, wins=2, finished=True),
+            PlayerResult(player_name='B', strategy='markov', game_ids=game_ids[:1], error='ConnectionResetError'),
+            PlayerResult(player_name='C', strategy='random', game_ids=game_ids[1:], finished=True)
+        ]
+        summary = get_swarm_summary(results)
+        self.assertEqual(summary['games_completed'], 2)
+        self.assertEqual(summary['players_finished'], 2)
+        self.assertEqual(summary['errors'], {'ConnectionResetError': 1})
+        self.assertEqual(summary['strategies']['random'], {'players': 2, 'games': 3, 'wins': 2})
+
+
+if __name__ == '__main__':
+    main()
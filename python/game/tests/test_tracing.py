@@ -0,0 +1,53 @@
+import pstats
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from uuid import uuid1
+
+from game.server.metrics import ServerMetrics
+from game.server.tracing import BUILD, STATE, WAIT, GameProfiler, PhaseTimes
+
+
+class TestPhaseTimes(TestCase):
+
+    def test_spans(self):
+        phase_times = PhaseTimes()
+        with phase_times.span(STATE):
+            sum(range(1000))
+        phase_times.add(WAIT, 0.5)
+        phase_times.add(WAIT, 0.25)
+        self.assertEqual(phase_times.counts[STATE], 1)
+        self.assertGreater(phase_times.totals[STATE], 0.0)
+        self.assertEqual((phase_times.counts[WAIT], phase_times.totals[WAIT]), (2, 0.75))
+        self.assertIn('wait:0.7500', str(phase_times))
+        metrics = ServerMetrics()
+        metrics.record_phases(phase_times)
+        metrics.record_phases(phase_times)
+        self.assertIn('rpsls_phase_seconds_total{phase="wait"} 1.5', metrics.render())
+        self.assertIn(f'rpsls_phase_spans_total{{phase="{BUILD}"}} 0', metrics.render())
+
+
+class TestGameProfiler(TestCase):
+
+    def test_profiles_every_nth_game(self):
+        with TemporaryDirectory() as directory:
+            profiler = GameProfiler(directory=directory, interval=3)
+            self.assertIsNone(profiler.start())
+            self.assertTrue(profiler.toggle())
+            profiles = [profiler.start() for _ in range(6)]
+            self.assertEqual([profile is not None for profile in profiles], [True] + [False] * 5)
+            # Games starting while another is profiled are skipped
+            game_id = uuid1()
+            profiler.stop(profile=profiles[0], game_id=game_id)
+            profile = profiler.start()
+            self.assertIsNotNone(profile)
+            profile.disable()
+            pstats.Stats(str(Path(directory).joinpath(f'{game_id}.prof')))
+            self.assertFalse(profiler.toggle())
+            self.assertIsNone(profiler.start())
+        with self.assertRaises(ValueError):
+            GameProfiler(interval=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+from socket import AF_UNIX, SOCK_SEQPACKET, recv_fds, send_fds, socketpair
+from json import dumps, loads
+from time import sleep
+from unittest import TestCase, main
+
+from game.models.game_config import GameConfig
+from game.server.metrics import ServerMetrics
+from game.server.models import PlayerConnection
+from game.server.tracing import WAIT, PhaseTimes
+from game.server.workers import MAX_HANDOFF_FDS, MAX_HANDOFF_SIZE, MultiProcessGameServer, decode_handoff, \
+    encode_handoff
+from game.utils.codec import BINARY, JSON
+from game.utils.protocol import MessageReader, MessageWriter
+
+
+class TestHandoff(TestCase):
+
+    def test_connections_survive_handoff(self):
+        channel, worker_channel = socketpair(AF_UNIX, SOCK_SEQPACKET)
+        pairs = [socketpair(), socketpair()]
+        player_conns = []
+        for i, (conn, peer) in enumerate(pairs):
+            reader = MessageReader(conn)
+            peer.sendall(b'{"player_name": "P%d"}\n{"early": true}\n' % i)
+            reader.read_message()
+            player_conns.append(PlayerConnection(
+                player_name=f'P{i}', conn=conn, addr=('127.0.0.1', 1000 + i), reader=reader,
+                writer=MessageWriter(conn), encoding=BINARY if i else JSON, delta=bool(i)))
+        send_fds(channel, [encode_handoff(player_conns)], [player_conn.conn.fileno() for player_conn in player_conns])
+        for player_conn in player_conns:
+            player_conn.conn.close()
+        message, fds, _, _ = recv_fds(worker_channel, MAX_HANDOFF_SIZE, MAX_HANDOFF_FDS)
+        received = decode_handoff(message=message, fds=fds)
+        try:
+            self.assertEqual([player_conn.player_name for player_conn in received], ['P0', 'P1'])
+            self.assertEqual(received[0].addr, ('127.0.0.1', 1000))
+            self.assertEqual([player_conn.encoding for player_conn in received], [JSON, BINARY])
+            self.assertTrue(received[1].reader.sized and received[1].delta)
+            # Bytes read past the join request are kept, and the sockets still reach the players
+            self.assertEqual(received[0].reader.read_message(), b'{"early": true}')
+            received[0].writer.send(b'hello')
+            self.assertEqual(pairs[0][1].recv(5), b'hello')
+        finally:
+            for player_conn in received:
+                player_conn.conn.close()
+            for _, peer in pairs:
+                peer.close()
+            channel.close()
+            worker_channel.close()
+
+
+class TestWorkerPool(TestCase):
+
+    def test_worker_exit(self):
+        config = GameConfig.load(path=Path(__file__).parents[3].joinpath('data').joinpath('gameconfig.json'))
+        server = MultiProcessGameServer(workers=2, host='127.0.0.1', port=0, game_config=config, verbose=False)
+        worker_channels = []
+        for _ in range(2):
+            channel, worker_channel = socketpair(AF_UNIX, SOCK_SEQPACKET)
+            server.add_worker(channel=channel)
+            worker_channels.append(worker_channel)
+        peers = []
+
+        def hand_off_game():
+            pairs = [socketpair() for _ in range(config.num_players)]
+            peers.extend(peer for _, peer in pairs)
+            server.hand_off(player_conns=[PlayerConnection(
+                player_name=f'P{i}', conn=conn, addr=('127.0.0.1', 1000 + i), reader=MessageReader(conn),
+                writer=MessageWriter(conn)) for i, (conn, _) in enumerate(pairs)])
+
+        try:
+            hand_off_game()
+            hand_off_game()
+            self.assertEqual([len(games) for games in server.worker_games], [1, 1])
+            # Games in progress on a worker that exits are aborted, and no more games are sent to it
+            worker_channels[0].close()
+            for _ in range(100):
+                if server.live_workers == [1]:
+                    break
+                sleep(0.01)
+            self.assertEqual(server.live_workers, [1])
+            self.assertEqual(server.metrics.games_aborted.value, 1)
+            hand_off_game()
+            self.assertEqual([len(games) for games in server.worker_games], [0, 2])
+            for _ in range(2):
+                _, fds, _, _ = recv_fds(worker_channels[1], MAX_HANDOFF_SIZE, MAX_HANDOFF_FDS)
+                for fd in fds:
+                    os.close(fd)
+            self.assertEqual(server.metrics.games_in_progress.value, 2)
+        finally:
+            for peer in peers:
+                peer.close()
+            worker_channels[1].close()
+
+
+class TestWorkerMetrics(TestCase):
+
+    def test_match_deltas(self):
+        worker, acceptor = ServerMetrics(), ServerMetrics()
+        self.assertEqual(worker.take_match_deltas(), {})
+        for _ in range(2):
+            worker.match_round_trip.observe(0.02)
+            worker.match_timeouts.inc()
+            worker.encode_time[BINARY].observe(0.0001)
+            phase_times = PhaseTimes()
+            phase_times.add(WAIT, 0.5)
+            worker.record_phases(phase_times)
+            # Reports only carry what changed since the previous one
+            deltas = worker.take_match_deltas()
+            self.assertEqual(deltas['rpsls_match_timeouts_total'], [1])
+            self.assertNotIn('rpsls_decode_seconds{encoding="json"}', deltas)
+            acceptor.add_match_deltas(loads(dumps(deltas)))
+        self.assertEqual(worker.take_match_deltas(), {})
+        for key, metric in worker.match_metrics.items():
+            self.assertEqual(acceptor.match_metrics[key].get_state(), metric.get_state())
+        self.assertIn('rpsls_match_round_trip_seconds_count 2', acceptor.render())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+from json import dumps, loads
+from struct import Struct, error, pack, unpack_from
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from game.server.schemas import JoinRequest, JoinResponse, PlayerChoiceInfo, PlayerChoiceRequest, \
+    PlayerChoiceResponse, EndOfGameMessage, PlayerChoiceDelta, EndOfGameDelta, LeaveRequest, ServerBusyMessage
+from game.utils.protocol import FORMAT, FRAME_SIZE, encode
+
+
+JSON = 'json'
+BINARY = 'binary'
+ENCODINGS = [JSON, BINARY]
+
+
+# Message type discriminators of typed JSON frames
+MESSAGE_TYPES: dict[str, type[BaseModel]] = {
+    'join_request': JoinRequest,
+    'join_response': JoinResponse,
+    'player_choice_request': PlayerChoiceRequest,
+    'player_choice_response': PlayerChoiceResponse,
+    'end_of_game': EndOfGameMessage,
+    'player_choice_delta': PlayerChoiceDelta,
+    'end_of_game_delta': EndOfGameDelta,
+    'leave_request': LeaveRequest,
+    'server_busy': ServerBusyMessage
+}
+MESSAGE_TYPE_NAMES: dict[type[BaseModel], str] = {schema_class: name for name, schema_class in MESSAGE_TYPES.items()}
+
+
+def get_message_type(fields: dict) -> type[BaseModel]:
+    # Frames without a discriminator are told apart by the fields only their schema has
+    if 'winner' in fields:
+        return EndOfGameDelta if 'new_winners' in fields else EndOfGameMessage
+    if 'shape' in fields:
+        return PlayerChoiceResponse
+    if 'new_winners' in fields:
+        return PlayerChoiceDelta
+    if 'past_winners' in fields:
+        return PlayerChoiceRequest
+    if 'players' in fields:
+        return JoinResponse
+    if 'leave' in fields:
+        return LeaveRequest
+    if 'retry_after_ms' in fields:
+        return ServerBusyMessage
+    if 'player_name' in fields:
+        return JoinRequest
+    raise ValueError('Unknown message type')
+
+
+class JsonCodec:
+    # Newline terminated JSON documents, understood by every client. Typed codecs add a "type" discriminator
+    # to every frame, trusted codecs build messages without validating them
+    SIZED = False
+
+    # Stands in for the player name of a message serialized once for several players
+    PLAYER_NAME_SENTINEL = '\x00'
+    PLAYER_NAME_KEY = b'"player_name": '
+    PLAYER_NAME_PLACEHOLDER = PLAYER_NAME_KEY + dumps(PLAYER_NAME_SENTINEL).encode(FORMAT)
+
+    def __init__(self, typed: bool = False, trusted: bool = False):
+        self.typed = typed
+        self.trusted = trusted
+        self.type_prefixes = {
+            schema_class: f'{{"type": "{name}", '.encode(FORMAT) for schema_class, name in MESSAGE_TYPE_NAMES.items()}
+
+    def encode(self, schema: BaseModel) -> bytes:
+        payload = encode(schema)
+        if not self.typed:
+            return payload
+        return self.type_prefixes[type(schema)] + payload[1:]
+
+    def decode(self, payload: bytes, schema_class: type[BaseModel] = BaseModel) -> BaseModel:
+        # Frames are parsed once, whether or not the peer sends a discriminator
+        fields = loads(payload)
+        if not isinstance(fields, dict):
+            raise ValueError('Expected a JSON object')
+        message_type = fields.pop('type', None)
+        if message_type is not None:
+            if message_type not in MESSAGE_TYPES:
+                raise ValueError(f'Unknown message type {message_type}')
+            message_class = MESSAGE_TYPES[message_type]
+        elif schema_class is not BaseModel:
+            message_class = schema_class
+        else:
+            message_class = get_message_type(fields)
+        if not issubclass(message_class, schema_class):
+            raise ValueError(f'Expected {schema_class.__name__}, got {message_class.__name__}')
+        if self.trusted:
+            return self.construct(message_class, fields)
+        return message_class.parse_obj(fields)
+
+    @staticmethod
+    def construct(schema_class: type[BaseModel], fields: dict) -> BaseModel:
+        # Only nested models and ids need converting when fields are not validated
+        if 'game_id' in fields:
+            fields['game_id'] = UUID(fields['game_id'])
+        if 'player_choices' in fields:
+            fields['player_choices'] = [
+                PlayerChoiceInfo.construct(**player_choice) for player_choice in fields['player_choices']]
+        return schema_class.construct(**fields)
+
+    def encode_for_players(self, schema: BaseModel, player_names: list[str]) -> list[bytes]:
+        # Serializes a message once and splices in the player_name field of each player in place of the sentinel,
+        # wherever the field is. Messages are encoded for each player if a nested player has the sentinel name
+        template = self.encode(schema.copy(update={'player_name': self.PLAYER_NAME_SENTINEL}))
+        if template.count(self.PLAYER_NAME_PLACEHOLDER) != 1:
+            return [self.encode(schema.copy(update={'player_name': player_name})) for player_name in player_names]
+        prefix, suffix = template.split(self.PLAYER_NAME_PLACEHOLDER)
+        prefix += self.PLAYER_NAME_KEY
+        return [prefix + dumps(player_name).encode(FORMAT) + suffix for player_name in player_names]
+
+
+class BinaryCodec:
+    # Length prefixed frames using shape and player indices instead of names and 16 byte UUIDs
+    SIZED = True
+
+    JOIN_REQUEST = 1
+    JOIN_RESPONSE = 2
+    PLAYER_CHOICE_REQUEST = 3
+    PLAYER_CHOICE_RESPONSE = 4
+    END_OF_GAME_MESSAGE = 5
+    PLAYER_CHOICE_DELTA = 6
+    END_OF_GAME_DELTA = 7
+    LEAVE_REQUEST = 8
+
+    TYPE = Struct('!B')
+    FLAG = Struct('!?')
+    GAMES = Struct('!I')
+    COUNT = Struct('!H')
+    INDEX = Struct('!H')
+    # Player index, game id, match number
+    CHOICE_BASE = Struct('!H16sI')
+    # Current round, total rounds
+    ROUNDS = Struct('!II')
+    ROUND = Struct('!I')
+    JOIN_RESPONSE_BODY = Struct('!H16sI')
+
+    def __init__(self, players: list[str] | None = None, shapes: list[str] | None = None):
+        # Index tables are shared by both peers through the join response
+        self.players = players or []
+        self.shapes = shapes or []
+        self.player_indices = {player: i for i, player in enumerate(self.players)}
+        # Index 0 stands for no shape
+        self.shape_indices = {shape: i + 1 for i, shape in enumerate(self.shapes)}
+
+    def encode(self, schema: BaseModel) -> bytes:
+        try:
+            payload = self.encode_payload(schema)
+        except error as e:
+            raise ValueError(f'{type(schema).__name__} does not fit a binary frame: {e}')
+        return FRAME_SIZE.pack(len(payload)) + payload
+
+    def encode_for_players(self, schema: BaseModel, player_names: list[str]) -> list[bytes]:
+        # Messages with a player name start with its index, right after the type
+        template = self.encode(schema.copy(update={'player_name': player_names[0]}))
+        start = FRAME_SIZE.size + self.TYPE.size
+        prefix, suffix = template[:start], template[start + self.INDEX.size:]
+        return [prefix + self.INDEX.pack(self.player_indices[player_name]) + suffix for player_name in player_names]
+
+    def decode(self, payload: bytes, schema_class: type[BaseModel] = BaseModel) -> BaseModel:
+        try:
+            message_type, = self.TYPE.unpack_from(payload)
+            schema, offset = self.decode_payload(message_type, payload, self.TYPE.size)
+        except (error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f'Malformed binary frame: {e}')
+        if not isinstance(schema, schema_class):
+            raise ValueError(f'Expected {schema_class.__name__}, got {type(schema).__name__}')
+        return schema
+
+    def encode_payload(self, schema: BaseModel) -> bytes:
+        if isinstance(schema, PlayerChoiceRequest):
+            return b''.join([
+                self.TYPE.pack(self.PLAYER_CHOICE_REQUEST),
+                self.CHOICE_BASE.pack(self.player_indices[schema.player_name], schema.game_id.bytes,
+                                      schema.match_number),
+                self.encode_game_state_info(schema),
+                self.encode_indices([self.shape_indices[shape] for shape in schema.options])
+            ])
+        if isinstance(schema, PlayerChoiceDelta):
+            return b''.join([
+                self.TYPE.pack(self.PLAYER_CHOICE_DELTA),
+                self.CHOICE_BASE.pack(self.player_indices[schema.player_name], schema.game_id.bytes,
+                                      schema.match_number),
+                self.encode_game_state_delta(schema)
+            ])
+        if isinstance(schema, PlayerChoiceResponse):
+            return b''.join([
+                self.TYPE.pack(self.PLAYER_CHOICE_RESPONSE),
+                self.CHOICE_BASE.pack(self.player_indices[schema.player_name], schema.game_id.bytes,
+                                      schema.match_number),
+                self.INDEX.pack(self.shape_indices[schema.shape])
+            ])
+        if isinstance(schema, EndOfGameMessage):
+            return b''.join([
+                self.TYPE.pack(self.END_OF_GAME_MESSAGE),
+                self.encode_game_state_info(schema),
+                self.INDEX.pack(self.player_indices[schema.winner])
+            ])
+        if isinstance(schema, EndOfGameDelta):
+            return b''.join([
+                self.TYPE.pack(self.END_OF_GAME_DELTA),
+                self.encode_game_state_delta(schema),
+                self.INDEX.pack(self.player_indices[schema.winner])
+            ])
+        if isinstance(schema, JoinResponse):
+            return b''.join([
+                self.TYPE.pack(self.JOIN_RESPONSE),
+                self.JOIN_RESPONSE_BODY.pack(schema.players.index(schema.player_name), schema.game_id.bytes,
+                                             schema.total_rounds),
+                self.encode_strings(schema.players),
+                self.encode_strings(schema.options or [])
+            ])
+        if isinstance(schema, JoinRequest):
+            return b''.join([
+                self.TYPE.pack(self.JOIN_REQUEST),
+                self.encode_strings([schema.player_name, schema.encoding]),
+                self.FLAG.pack(schema.delta),
+                self.GAMES.pack(schema.games)
+            ])
+        if isinstance(schema, LeaveRequest):
+            return b''.join([
+                self.TYPE.pack(self.LEAVE_REQUEST),
+                self.encode_strings([schema.player_name])
+            ])
+        raise ValueError(f'No binary encoding for {type(schema).__name__}')
+
+    def decode_payload(self, message_type: int, payload: bytes, offset: int) -> tuple[BaseModel, int]:
+        if message_type == self.PLAYER_CHOICE_REQUEST:
+            player, game_id, match_number = self.CHOICE_BASE.unpack_from(payload, offset)
+            offset += self.CHOICE_BASE.size
+            state_info, offset = self.decode_game_state_info(payload, offset)
+            options, offset = self.decode_indices(payload, offset)
+            return PlayerChoiceRequest.construct(
+                player_name=self.players[player], game_id=UUID(bytes=game_id), match_number=match_number,
+                options=[self.get_shape(shape) for shape in options], **state_info), offset
+        if message_type == self.PLAYER_CHOICE_DELTA:
+            player, game_id, match_number = self.CHOICE_BASE.unpack_from(payload, offset)
+            offset += self.CHOICE_BASE.size
+            state_delta, offset = self.decode_game_state_delta(payload, offset)
+            return PlayerChoiceDelta.construct(
+                player_name=self.players[player], game_id=UUID(bytes=game_id), match_number=match_number,
+                **state_delta), offset
+        if message_type == self.PLAYER_CHOICE_RESPONSE:
+            player, game_id, match_number = self.CHOICE_BASE.unpack_from(payload, offset)
+            offset += self.CHOICE_BASE.size
+            shape, = self.INDEX.unpack_from(payload, offset)
+            return PlayerChoiceResponse.construct(
+                player_name=self.players[player], game_id=UUID(bytes=game_id), match_number=match_number,
+                shape=self.get_shape(shape)), offset + self.INDEX.size
+        if message_type == self.END_OF_GAME_MESSAGE:
+            state_info, offset = self.decode_game_state_info(payload, offset)
+            winner, = self.INDEX.unpack_from(payload, offset)
+            return EndOfGameMessage.construct(winner=self.players[winner], **state_info), offset + self.INDEX.size
+        if message_type == self.END_OF_GAME_DELTA:
+            state_delta, offset = self.decode_game_state_delta(payload, offset)
+            winner, = self.INDEX.unpack_from(payload, offset)
+            return EndOfGameDelta.construct(winner=self.players[winner], **state_delta), offset + self.INDEX.size
+        if message_type == self.JOIN_RESPONSE:
+            player, game_id, total_rounds = self.JOIN_RESPONSE_BODY.unpack_from(payload, offset)
+            offset += self.JOIN_RESPONSE_BODY.size
+            players, offset = self.decode_strings(payload, offset)
+            options, offset = self.decode_strings(payload, offset)
+            return JoinResponse.construct(
+                player_name=players[player], players=players, game_id=UUID(bytes=game_id),
+                total_rounds=total_rounds, options=options), offset
+        if message_type == self.JOIN_REQUEST:
+            (player_name, encoding), offset = self.decode_strings(payload, offset)
+            delta, = self.FLAG.unpack_from(payload, offset)
+            offset += self.FLAG.size
+            games, = self.GAMES.unpack_from(payload, offset)
+            return JoinRequest(
+                player_name=player_name, encoding=encoding, delta=delta, games=games), offset + self.GAMES.size
+        if message_type == self.LEAVE_REQUEST:
+            (player_name,), offset = self.decode_strings(payload, offset)
+            return LeaveRequest(player_name=player_name), offset
+        raise ValueError(f'Unknown binary message type {message_type}')
+
+    def get_shape(self, index: int) -> str:
+        # Index 0 only stands for no shape where a choice may be missing, and would otherwise wrap to the last shape
+        if not 1 <= index <= len(self.shapes):
+            raise IndexError(f'Unknown shape index {index}')
+        return self.shapes[index - 1]
+
+    def encode_game_state_info(self, schema) -> bytes:
+        return b''.join([
+            self.ROUNDS.pack(schema.current_round, schema.total_rounds),
+            self.encode_winners(schema.past_winners),
+            self.encode_player_choices(schema.player_choices)
+        ])
+
+    def decode_game_state_info(self, payload: bytes, offset: int) -> tuple[dict, int]:
+        current_round, total_rounds = self.ROUNDS.unpack_from(payload, offset)
+        past_winners, offset = self.decode_winners(payload, offset + self.ROUNDS.size)
+        player_choices, offset = self.decode_player_choices(payload, offset)
+        return dict(
+            current_round=current_round, total_rounds=total_rounds, past_winners=past_winners,
+            player_choices=player_choices
+        ), offset
+
+    def encode_game_state_delta(self, schema) -> bytes:
+        return b''.join([
+            self.ROUND.pack(schema.current_round),
+            self.encode_winners(schema.new_winners),
+            self.encode_player_choices(schema.player_choices)
+        ])
+
+    def decode_game_state_delta(self, payload: bytes, offset: int) -> tuple[dict, int]:
+        current_round, = self.ROUND.unpack_from(payload, offset)
+        new_winners, offset = self.decode_winners(payload, offset + self.ROUND.size)
+        player_choices, offset = self.decode_player_choices(payload, offset)
+        return dict(current_round=current_round, new_winners=new_winners, player_choices=player_choices), offset
+
+    def encode_winners(self, winners: list[str]) -> bytes:
+        return self.encode_indices([self.player_indices[player] for player in winners])
+
+    def decode_winners(self, payload: bytes, offset: int) -> tuple[list[str], int]:
+        winners, offset = self.decode_indices(payload, offset)
+        return [self.players[player] for player in winners], offset
+
+    def encode_player_choices(self, player_choices: list[PlayerChoiceInfo]) -> bytes:
+        # Flattened pairs of player and shape indices
+        return self.encode_indices([
+            index
+            for player_choice in player_choices
+            for index in (self.player_indices[player_choice.player_name],
+                          self.shape_indices[player_choice.shape] if player_choice.shape else 0)
+        ])
+
+    def decode_player_choices(self, payload: bytes, offset: int) -> tuple[list[PlayerChoiceInfo], int]:
+        indices, offset = self.decode_indices(payload, offset)
+        return [
+            PlayerChoiceInfo.construct(
+                player_name=self.players[player], shape=self.get_shape(shape) if shape else None)
+            for player, shape in zip(indices[::2], indices[1::2])
+        ], offset
+
+    def encode_indices(self, indices: list[int]) -> bytes:
+        return pack(f'!H{len(indices)}H', len(indices), *indices)
+
+    def decode_indices(self, payload: bytes, offset: int) -> tuple[tuple[int, ...], int]:
+        count, = self.COUNT.unpack_from(payload, offset)
+        offset += self.COUNT.size
+        return unpack_from(f'!{count}H', payload, offset), offset + count * self.INDEX.size
+
+    def encode_strings(self, strings: list[str]) -> bytes:
+        parts = [self.COUNT.pack(len(strings))]
+        for string in strings:
+            encoded = string.encode(FORMAT)
+            parts.append(self.COUNT.pack(len(encoded)))
+            parts.append(encoded)
+        return b''.join(parts)
+
+    def decode_strings(self, payload: bytes, offset: int) -> tuple[list[str], int]:
+        count, = self.COUNT.unpack_from(payload, offset)
+        offset += self.COUNT.size
+        strings = []
+        for _ in range(count):
+            size, = self.COUNT.unpack_from(payload, offset)
+            offset += self.COUNT.size
+            strings.append(payload[offset:offset + size].decode(FORMAT))
+            offset += size
+        return strings, offset
+
+
+JSON_CODEC = JsonCodec()
+TYPED_JSON_CODEC = JsonCodec(typed=True)
+
+
+def decode_join_reply(payload: bytes, codec: JsonCodec | BinaryCodec) -> JoinResponse | ServerBusyMessage:
+    # Busy messages are JSON whatever the client asked for, binary payloads never start with a brace
+    if payload.startswith(b'{'):
+        reply = JSON_CODEC.decode(payload)
+        if not isinstance(reply, (JoinResponse, ServerBusyMessage)):
+            raise ValueError(f'Expected JoinResponse or ServerBusyMessage, got {type(reply).__name__}')
+        return reply
+    return codec.decode(payload, JoinResponse)
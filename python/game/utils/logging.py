@@ -1,15 +1,68 @@
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 
-def configure_logger(filename: str, level=logging.INFO, mode='a'):
+class DeferredQueueHandler(QueueHandler):
+    # Hands records over as they are, so messages are formatted by the listener thread.
+    # Arguments of logged messages must not be changed afterwards
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class GameEvent:
+    # Structured game record, rendered as "[game_id] event key=value ..." when written
+
+    __slots__ = ('game_id', 'event', 'fields')
+
+    def __init__(self, game_id, event: str, fields: dict):
+        self.game_id = game_id
+        self.event = event
+        self.fields = fields
+
+    @staticmethod
+    def format_value(value) -> str:
+        # Lists are comma separated and tuples colon separated, e.g. choices=A:Rock,B:Paper
+        if isinstance(value, list):
+            return ','.join(GameEvent.format_value(item) for item in value)
+        if isinstance(value, tuple):
+            return ':'.join(str(item) for item in value)
+        return str(value)
+
+    def __str__(self) -> str:
+        fields = ' '.join(f'{key}={self.format_value(value)}' for key, value in self.fields.items())
+        return f'[{self.game_id}] {self.event} {fields}' if fields else f'[{self.game_id}] {self.event}'
+
+
+def log_event(game_id, event: str, level: int = logging.INFO, **fields):
+    logging.log(level, '%s', GameEvent(game_id=game_id, event=event, fields=fields))
+
+
+def configure_logger(filename: str, level=logging.INFO, mode='a') -> QueueListener | None:
+    # Game threads only put records in a queue, file and console output happen on a background thread. Like
+    # basicConfig, nothing is done if the root logger already has handlers, and None is returned
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    queue = SimpleQueue()
+    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s')
+    handlers = [
+        logging.FileHandler(
+            filename=filename,
+            mode=mode
+        ),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    listener = QueueListener(queue, *handlers)
     logging.basicConfig(
         level=level,
-        format='[%(asctime)s] [%(levelname)s] %(message)s',
-        handlers=[
-            logging.FileHandler(
-                filename=filename,
-                mode=mode
-            ),
-            logging.StreamHandler()
-        ]
+        handlers=[DeferredQueueHandler(queue)]
     )
+    listener.start()
+    # Write pending records on exit
+    atexit.register(listener.stop)
+    return listener
@@ -1,8 +1,149 @@
+from asyncio import IncompleteReadError, LimitOverrunError, StreamReader
+from socket import socket
+from struct import Struct
+
 from pydantic import BaseModel
 
 
 FORMAT = 'utf-8'
+TERMINATOR = b'\n'
+JSON_START = ord('{')
+# Length prefix of frames in sized (binary) encodings
+FRAME_SIZE = Struct('!I')
+MAX_FRAME_SIZE = 1024 * 1024
+RECV_SIZE = 64 * 1024
+
+
+class FrameTooLargeError(ValueError):
+    pass
+
+
+class ConnectionClosedError(ConnectionError):
+    pass
 
 
 def encode(schema: BaseModel) -> bytes:
     return (schema.json() + '\n').encode(FORMAT)
+
+
+def check_frame_size(size: int, max_frame_size: int):
+    if size > max_frame_size:
+        raise FrameTooLargeError(f'Frame exceeds {max_frame_size} bytes')
+
+
+class MessageReader:
+    # Splits a socket stream into newline terminated or length prefixed (sized) frames,
+    # keeping leftover bytes between calls
+
+    def __init__(self, conn: socket, max_frame_size: int = MAX_FRAME_SIZE, sized: bool = False):
+        self.conn = conn
+        self.max_frame_size = max_frame_size
+        self.sized = sized
+        self.buffer = bytearray()
+        # Start of the next unread frame and position to resume searching for a terminator
+        self.offset = 0
+        self.scanned = 0
+
+    def next_message(self) -> bytes | None:
+        # Return the next complete frame already buffered, without reading from the socket
+        if self.sized:
+            return self.next_sized_message()
+        index = self.buffer.find(TERMINATOR, self.scanned)
+        if index < 0:
+            self.scanned = len(self.buffer)
+            check_frame_size(self.scanned - self.offset, self.max_frame_size)
+            return None
+        check_frame_size(index - self.offset, self.max_frame_size)
+        message = bytes(self.buffer[self.offset:index])
+        self.offset = self.scanned = index + 1
+        return message
+
+    def next_sized_message(self) -> bytes | None:
+        if len(self.buffer) - self.offset < FRAME_SIZE.size:
+            return None
+        size, = FRAME_SIZE.unpack_from(self.buffer, self.offset)
+        check_frame_size(size, self.max_frame_size)
+        start = self.offset + FRAME_SIZE.size
+        if len(self.buffer) < start + size:
+            return None
+        message = bytes(self.buffer[start:start + size])
+        self.offset = self.scanned = start + size
+        return message
+
+    def fill(self):
+        # Discard consumed frames before growing the buffer
+        if self.offset:
+            del self.buffer[:self.offset]
+            self.scanned -= self.offset
+            self.offset = 0
+        data = self.conn.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionClosedError('Connection closed by peer')
+        self.buffer += data
+
+    def read_message(self) -> bytes:
+        message = self.next_message()
+        while message is None:
+            self.fill()
+            message = self.next_message()
+        return message
+
+    def read_join_reply(self) -> bytes:
+        # Busy replies are JSON even on sized streams, whose frames start with a zero byte
+        while len(self.buffer) <= self.offset:
+            self.fill()
+        sized = self.sized
+        self.sized = sized and self.buffer[self.offset] != JSON_START
+        try:
+            return self.read_message()
+        finally:
+            self.sized = sized
+
+
+class MessageWriter:
+    # Buffers encoded frames so several of them can be sent with a single system call
+
+    def __init__(self, conn: socket):
+        self.conn = conn
+        self.buffer = bytearray()
+
+    def write(self, schema: BaseModel | bytes):
+        self.buffer += schema if isinstance(schema, bytes) else encode(schema)
+
+    def flush(self):
+        if self.buffer:
+            self.conn.sendall(self.buffer)
+            self.buffer.clear()
+
+    def send(self, schema: BaseModel | bytes):
+        self.write(schema)
+        self.flush()
+
+
+async def read_message_async(reader: StreamReader, sized: bool = False) -> bytes:
+    # The frame size limit is the one given to asyncio.start_server or asyncio.open_connection
+    try:
+        if sized:
+            size, = FRAME_SIZE.unpack(await reader.readexactly(FRAME_SIZE.size))
+            check_frame_size(size, MAX_FRAME_SIZE)
+            return await reader.readexactly(size)
+        return (await reader.readuntil(TERMINATOR))[:-1]
+    except IncompleteReadError:
+        raise ConnectionClosedError('Connection closed by peer')
+    except LimitOverrunError:
+        raise FrameTooLargeError(f'Frame exceeds {MAX_FRAME_SIZE} bytes')
+
+
+async def read_join_reply_async(reader: StreamReader, sized: bool = False) -> bytes:
+    # Busy replies are JSON even on sized streams, whose frames start with a zero byte
+    try:
+        first = await reader.readexactly(1)
+        if sized and first[0] != JSON_START:
+            size, = FRAME_SIZE.unpack(first + await reader.readexactly(FRAME_SIZE.size - 1))
+            check_frame_size(size, MAX_FRAME_SIZE)
+            return await reader.readexactly(size)
+        return first + (await reader.readuntil(TERMINATOR))[:-1]
+    except IncompleteReadError:
+        raise ConnectionClosedError('Connection closed by peer')
+    except LimitOverrunError:
+        raise FrameTooLargeError(f'Frame exceeds {MAX_FRAME_SIZE} bytes')